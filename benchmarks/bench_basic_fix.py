@@ -0,0 +1,128 @@
+import sys
+import os
+import time
+import random
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.normalizer import basic_fix
+from utils.sql.all_keywords import ALL_KEY_WORDS
+
+def basic_fix_legacy(sql_str, all_headers, table_title=None):
+    '''
+    basic_fix before the bytearray rewrite, kept as the reference for the equivalence check.
+    '''
+    def finditer(sub_str: str, mother_str: str):
+        result = []
+        start_index = 0
+        while True:
+            start_index = mother_str.find(sub_str, start_index, -1)
+            if start_index == -1:
+                break
+            end_idx = start_index + len(sub_str)
+            result.append((start_index, end_idx))
+            start_index = end_idx
+        return result
+    if table_title:
+        sql_str = sql_str.replace("FROM " + table_title, "FROM w")
+        sql_str = sql_str.replace("FROM " + table_title.lower(), "FROM w")
+    while '' in all_headers:
+        all_headers.remove('')
+    sql_str = sql_str.replace("\\n", "\n")
+    sql_str = sql_str.replace("\n", "\\n")
+    all_headers.sort(key=lambda x: len(x), reverse=True)
+    have_matched = [0 for i in range(len(sql_str))]
+    idx_s_single_quotation = [_ for _ in range(1, len(sql_str)) if
+                              sql_str[_] in ["\'"] and sql_str[_ - 1] not in ["\'"]]
+    idx_s_double_quotation = [_ for _ in range(1, len(sql_str)) if
+                              sql_str[_] in ["\""] and sql_str[_ - 1] not in ["\""]]
+    for idx_s in [idx_s_single_quotation, idx_s_double_quotation]:
+        if len(idx_s) % 2 == 0:
+            for idx in range(int(len(idx_s) / 2)):
+                start_idx = idx_s[idx * 2]
+                end_idx = idx_s[idx * 2 + 1]
+                have_matched[start_idx: end_idx] = [2 for _ in range(end_idx - start_idx)]
+    for header in all_headers:
+        if (header in sql_str) and (header not in ALL_KEY_WORDS):
+            all_matched_of_this_header = finditer(header, sql_str)
+            for matched_of_this_header in all_matched_of_this_header:
+                start_idx, end_idx = matched_of_this_header
+                if all(have_matched[start_idx: end_idx]) == 0 and (not sql_str[start_idx - 1] == "`") and (
+                        not sql_str[end_idx] == "`"):
+                    have_matched[start_idx: end_idx] = [1 for _ in range(end_idx - start_idx)]
+    start_have_matched = [0] + have_matched
+    end_have_matched = have_matched + [0]
+    start_idx_s = [idx - 1 for idx in range(1, len(start_have_matched)) if
+                   start_have_matched[idx - 1] == 0 and start_have_matched[idx] == 1]
+    end_idx_s = [idx for idx in range(len(end_have_matched) - 1) if
+                 end_have_matched[idx] == 1 and end_have_matched[idx + 1] == 0]
+    assert len(start_idx_s) == len(end_idx_s)
+    spans = []
+    current_idx = 0
+    for start_idx, end_idx in zip(start_idx_s, end_idx_s):
+        spans.append(sql_str[current_idx:start_idx])
+        spans.append(sql_str[start_idx:end_idx + 1])
+        current_idx = end_idx + 1
+    spans.append(sql_str[current_idx:])
+    sql_str = '`'.join(spans)
+
+    return sql_str
+
+header_pool = ["year", "rank", "name", "nation", "total", "gold", "silver", "bronze", "team", "team name", "points",
+               "name_2", "from", "as", "-", "the", "a", "col", "column", "w", "n", "nation_name", "total points"]
+sql_pool = ["SELECT", "FROM", "WHERE", "AND", "OR", "GROUP BY", "ORDER BY", "DESC", "LIMIT 1", "COUNT(*)", "=", ">", "<",
+            "(", ")", ",", "'", "\"", "`", "\n", "\\n", "'gold medal'", "\"team name\"", "`rank`", "1", "2001", "w", " "]
+
+def random_sql(rng: random.Random, headers: list, num_tokens: int) -> str:
+    tokens = []
+    for _ in range(num_tokens):
+        tokens.append(rng.choice(headers) if rng.random() < 0.4 else rng.choice(sql_pool))
+    return rng.choice([" ", ""]).join(tokens)
+
+def check_equivalence(num_cases: int, seed: int):
+    rng = random.Random(seed)
+    for i in range(num_cases):
+        headers = rng.sample(header_pool, rng.randint(1, len(header_pool))) + rng.choice([[], [""]])
+        sql_str = random_sql(rng, [h for h in headers if h] or ["x"], rng.randint(0, 40))
+        title = rng.choice([None, "Team_Stats", "year"])
+        try:
+            expected = basic_fix_legacy(sql_str, list(headers), title)
+        except AssertionError:
+            expected = AssertionError
+        try:
+            actual = basic_fix(sql_str, list(headers), title)
+        except AssertionError:
+            actual = AssertionError
+        assert actual == expected, (i, sql_str, headers, title, actual, expected)
+    print(f"Equivalence: {num_cases} random queries match the legacy basic_fix.")
+
+def benchmark(num_cols: int, num_ctes: int, repeat: int):
+    headers = [f"column_{i}_name" for i in range(num_cols)] + ["year", "rank", "name", "nation", "total"]
+    rng = random.Random(0)
+    ctes = []
+    for i in range(num_ctes):
+        columns = ", ".join(rng.sample(headers, min(10, len(headers))))
+        ctes.append(f"t{i} AS (SELECT {columns} FROM w WHERE year > 2000 AND name = 'john smith' ORDER BY rank)")
+    sql_str = "WITH " + ", ".join(ctes) + " SELECT * FROM t0"
+    for name, fn in (("legacy", basic_fix_legacy), ("bytearray", basic_fix)):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(sql_str, list(headers))
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:>10}: {best * 1000:.3f} ms ({len(headers)} headers, {len(sql_str)} characters)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time basic_fix of post_process_sql.")
+    parser.add_argument("--num_cases", type=int, default=20000, help="Random queries for the equivalence check")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cols", type=int, default=60)
+    parser.add_argument("--ctes", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    check_equivalence(args.num_cases, args.seed)
+    benchmark(args.cols, args.ctes, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import sys
+import os
+import time
+import random
+import argparse
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.normalizer import convert_df_type
+
+def convert_df_type_legacy(df: pd.DataFrame, lower_case=True):
+    '''
+    convert_df_type before vectorization, kept as the reference for the equivalence check.
+    '''
+    def get_table_content_in_column(table):
+        if isinstance(table, pd.DataFrame):
+            header = table.columns.tolist()
+            rows = table.values.tolist()
+        else:
+            header, rows = table['header'], table['rows']
+        all_col_values = []
+        for i in range(len(header)):
+            one_col_values = []
+            for _row in rows:
+                one_col_values.append(_row[i])
+            all_col_values.append(one_col_values)
+        return all_col_values
+    new_columns = []
+    for idx, header in enumerate(df.columns):
+        if header == '':
+            new_columns.append('FilledColumnName')
+        else:
+            new_columns.append(header)
+    df.columns = new_columns
+    new_columns = []
+    for idx, header in enumerate(df.columns):
+        if header in new_columns:
+            new_header, suffix = header, 2
+            while new_header in new_columns:
+                new_header = header + '_' + str(suffix)
+                suffix += 1
+            new_columns.append(new_header)
+        else:
+            new_columns.append(header)
+    df.columns = new_columns
+    null_tokens = ['', '-', '/']
+    for header in df.columns:
+        df[header] = df[header].map(lambda x: str(None) if x in null_tokens else x)
+    all_col_values = get_table_content_in_column(df)
+    for col_i, one_col_values in enumerate(all_col_values):
+        all_number_flag = True
+        for row_i, cell_value in enumerate(one_col_values):
+            try:
+                float(cell_value)
+            except Exception as e:
+                if not cell_value in [str(None), str(None).lower()]:
+                    all_number_flag = False
+        if all_number_flag:
+            _header = df.columns[col_i]
+            df[_header] = df[_header].map(lambda x: "NaN" if x in [str(None), str(None).lower()] else x)
+    if lower_case:
+        new_columns = []
+        for header in df.columns:
+            lower_header = str(header).lower()
+            if lower_header in new_columns:
+                new_header, suffix = lower_header, 2
+                while new_header in new_columns:
+                    new_header = lower_header + '-' + str(suffix)
+                    suffix += 1
+                new_columns.append(new_header)
+            else:
+                new_columns.append(lower_header)
+        df.columns = new_columns
+        for header in df.columns:
+            df[header] = df[header].map(lambda x: str(x).lower().strip())
+    return df
+
+# Cells that exercise every branch: None tokens, forms only float() accepts, padded and mixed-case text
+cell_pool = [
+    "", "-", "/", "None", "none", "NaN", "nan", "inf", "-Infinity", "1", "-2", "+3.5", "1e5", ".5", "5.",
+    " 7 ", "1_000", "1,000", "١٢", "0x10", "12%", "$3", "abc", " Mixed Case ", "2001-02-03", "3rd", "n/a",
+]
+header_pool = ["", "Year", "year", "Name", "name", "Score", "score_2", "Total"]
+
+def random_table(rng: random.Random, num_rows: int, num_cols: int, numeric_bias: float) -> pd.DataFrame:
+    header = [rng.choice(header_pool) for _ in range(num_cols)]
+    rows = []
+    for _ in range(num_rows):
+        row = []
+        for col in range(num_cols):
+            if col % 2 == 0 and rng.random() < numeric_bias:
+                row.append(rng.choice(["1", "-2", "+3.5", "1e5", " 7 ", "1_000", "None", "-", ""]))
+            else:
+                row.append(rng.choice(cell_pool))
+        rows.append(row)
+    return pd.DataFrame(data=rows, columns=header)
+
+def check_equivalence(num_tables: int, seed: int):
+    rng = random.Random(seed)
+    for i in range(num_tables):
+        df = random_table(rng, rng.randint(0, 30), rng.randint(1, 8), rng.random())
+        for lower_case in (True, False):
+            expected = convert_df_type_legacy(df.copy(), lower_case=lower_case)
+            actual = convert_df_type(df.copy(), lower_case=lower_case)
+            assert list(actual.columns) == list(expected.columns), (i, list(actual.columns), list(expected.columns))
+            assert actual.values.tolist() == expected.values.tolist(), (i, df.values.tolist())
+    print(f"Equivalence: {num_tables} random tables match the legacy implementation.")
+
+def benchmark(num_rows: int, num_cols: int, repeat: int):
+    rng = random.Random(0)
+    header = [f"col {i}" for i in range(num_cols)]
+    rows = [
+        [str(rng.randint(0, 10 ** 6)) if col % 2 == 0 else rng.choice(cell_pool) for col in range(num_cols)]
+        for _ in range(num_rows)
+    ]
+    df = pd.DataFrame(data=rows, columns=header)
+    for name, fn in (("legacy", convert_df_type_legacy), ("vectorized", convert_df_type)):
+        best = float("inf")
+        for _ in range(repeat):
+            table = df.copy()
+            start = time.perf_counter()
+            fn(table)
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:>10}: {best * 1000:.1f} ms ({num_rows} x {num_cols})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the vectorized convert_df_type.")
+    parser.add_argument("--num_tables", type=int, default=500, help="Random tables for the equivalence check")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--cols", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    check_equivalence(args.num_tables, args.seed)
+    benchmark(args.rows, args.cols, args.repeat)
+
+if __name__ == "__main__":
+    main()
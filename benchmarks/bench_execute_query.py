@@ -0,0 +1,50 @@
+import sys
+import os
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.database import MYSQLDB
+
+def build_db(num_rows: int) -> MYSQLDB:
+    tables = [{
+        "title": "bench",
+        "table": {"header": ["row_id", "name", "value"], "rows": [["0", "a", "1"]]},
+    }]
+    # Without the result cache, so every timed call runs the query
+    sqldb = MYSQLDB(tables=tables, result_cache=False)
+    sqldb.sqlite_conn.execute("CREATE TABLE rows_bench (row_id int, name text, city text, value real, year int)")
+    sqldb.sqlite_conn.executemany(
+        "INSERT INTO rows_bench VALUES (?, ?, ?, ?, ?)",
+        ((i, f"name {i}", f"city {i % 97}", i * 0.5, 1900 + i % 120) for i in range(num_rows))
+    )
+    sqldb.sqlite_conn.commit()
+    return sqldb
+
+def time_query(sqldb: MYSQLDB, sql_query: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sqldb.execute_query(sql_query)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the sqlite3 and records paths of MYSQLDB.execute_query.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000], help="Result sizes in rows")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement; the best one is reported")
+    args = parser.parse_args()
+
+    sqldb = build_db(max(args.sizes))
+    print(f"{'rows':>8} {'records (ms)':>14} {'sqlite3 (ms)':>14} {'speedup':>8}")
+    for size in args.sizes:
+        sql_query = f"SELECT * FROM rows_bench LIMIT {size}"
+        timings = {}
+        for engine in ("records", "sqlite3"):
+            sqldb.query_engine = engine
+            timings[engine] = time_query(sqldb, sql_query, args.repeat)
+        print(f"{size:>8} {timings['records'] * 1000:>14.3f} {timings['sqlite3'] * 1000:>14.3f} {timings['records'] / timings['sqlite3']:>7.1f}x")
+    sqldb.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import sys
+import os
+import time
+import random
+import argparse
+import tempfile
+from multiprocessing import Pool
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.llm_cache import LLMCache, get_llm_cache, flush_llm_caches, make_cache_key
+
+def request_key(i: int) -> str:
+    return make_cache_key("gpt-4o-mini", [{"role": "user", "content": f"question {i}"}])
+
+def lookup_sample(args) -> tuple[int, int]:
+    '''
+    One sample of a Pool worker: a few cache lookups, then the flush `process_one_example` does after each sample.
+    '''
+    path, seed, num_lookups, num_entries = args
+    rng = random.Random(seed)
+    cache = get_llm_cache(path)
+    hits = 0
+    try:
+        for _ in range(num_lookups):
+            # Half of the keys are stored
+            if cache.get(request_key(rng.randrange(2 * num_entries))) is not None:
+                hits += 1
+    finally:
+        flush_llm_caches()
+    return hits, num_lookups - hits
+
+def check(num_workers: int, num_samples: int, num_lookups: int, num_entries: int):
+    '''
+    The totals of a cache shared by Pool workers count every lookup, although the pool terminates its workers
+    without running their exit hooks.
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "cache.db")
+        cache = LLMCache(path)
+        for i in range(num_entries):
+            cache.set(request_key(i), [f"answer {i}"])
+        cache.close()
+
+        tasks = [(path, seed, num_lookups, num_entries) for seed in range(num_samples)]
+        with Pool(processes=num_workers) as pool:
+            counts = pool.map(lookup_sample, tasks)
+
+        cache = LLMCache(path)
+        stats = cache.stats()
+        cache.close()
+    hits = sum(count[0] for count in counts)
+    misses = sum(count[1] for count in counts)
+    assert (stats["total_hits"], stats["total_misses"]) == (hits, misses), (stats, hits, misses)
+    print(f"Counters: {num_workers} workers, {hits + misses} lookups in {num_samples} samples, all of them counted "
+          f"({hits} hits, {misses} misses).")
+
+def benchmark(num_lookups: int, num_entries: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = LLMCache(os.path.join(tmp_dir, "cache.db"))
+        for i in range(num_entries):
+            cache.set(request_key(i), [f"answer {i}"])
+        keys = [request_key(i % (2 * num_entries)) for i in range(num_lookups)]
+        start = time.perf_counter()
+        for key in keys:
+            cache.get(key)
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        cache.flush()
+        flushed = time.perf_counter() - start
+        cache.close()
+    print(f"LLMCache.get: {elapsed / num_lookups * 1e6:.0f} us per lookup; flushing the last batch: {flushed * 1e3:.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the shared counters of the LLM response cache and time its lookups.")
+    parser.add_argument("--num_workers", type=int, default=8)
+    parser.add_argument("--num_samples", type=int, default=64, help="Samples spread over the Pool workers")
+    parser.add_argument("--num_lookups", type=int, default=37, help="Lookups per sample, not a multiple of the flush batch")
+    parser.add_argument("--num_entries", type=int, default=200)
+    args = parser.parse_args()
+
+    check(args.num_workers, args.num_samples, args.num_lookups, args.num_entries)
+    benchmark(args.num_samples * args.num_lookups, args.num_entries)
+
+if __name__ == "__main__":
+    main()
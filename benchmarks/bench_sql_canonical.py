@@ -0,0 +1,161 @@
+import sys
+import os
+import time
+import random
+import sqlite3
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.sql.canonical import canonicalize_sql, sql_fingerprint
+from utils.sql.tokens import SQLITE_KEYWORDS, tokenize_sql
+import utils.database as database
+from utils.database import MYSQLDB
+from bench_sql_validator import tables, corpus, split_script
+
+def build_database(seed: int) -> sqlite3.Connection:
+    rng = random.Random(seed)
+    words = ["germany", "Germany", "kenya", "world championships", "1st", "2nd", "home", "away", "w 2-1", "l 0-3",
+             "grand slam", "australian open", "14,749", "5,465", "2001-05-03", "1998"]
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    for table, columns in tables.items():
+        conn.execute("CREATE TABLE {} ({})".format(table, ", ".join(columns)))
+        for row_id in range(20):
+            values = [row_id] + [rng.choice(words + [str(rng.randint(0, 5))]) for _ in columns[1:]]
+            conn.execute("INSERT INTO {} VALUES ({})".format(table, ", ".join("?" for _ in columns)), values)
+    return conn
+
+def outcome(conn: sqlite3.Connection, sql: str) -> tuple:
+    '''
+    (rows of the last statement, error) of `sql`, on a rolled-back copy of the database state.
+    '''
+    rows = None
+    try:
+        conn.execute("SAVEPOINT check_sql")
+        for statement in split_script(sql):
+            rows = conn.execute(statement).fetchall()
+        return rows, ""
+    except sqlite3.Error as e:
+        # The error of the same query can name its tokens in a different spelling
+        return None, str(e).split(":")[0]
+    finally:
+        conn.execute("ROLLBACK TO check_sql")
+        conn.execute("RELEASE check_sql")
+
+def random_case(rng: random.Random, text: str) -> str:
+    return "".join(c.upper() if rng.random() < 0.5 else c.lower() for c in text)
+
+def variant(rng: random.Random, sql: str) -> str:
+    '''
+    `sql` respelled the ways the canonical form ignores: whitespace and comments, keyword and name case,
+    name quoting, ==, redundant parentheses and trailing semicolons.
+    '''
+    parts, last = [], 0
+    tokens = tokenize_sql(sql)
+    # Quoting is significant for window names
+    requote = not any(value in ("over", "window") for kind, value, _, _ in tokens if kind == "keyword")
+    for i, (kind, value, start, end) in enumerate(tokens):
+        gap = sql[last:start]
+        if gap.strip() == "" and gap and rng.random() < 0.3:
+            gap = rng.choice(["  ", "\n", "\t", " /* c */ ", "\n  "])
+        parts.append(gap)
+        text = sql[start:end]
+        before = tokens[i - 1] if i > 0 else None
+        if kind == "keyword" or (kind == "name" and text.isascii()):
+            text = random_case(rng, text)
+            if kind == "name" and value not in SQLITE_KEYWORDS and value not in ("rowid", "true", "false") \
+                    and (before is None or before[1] != ".") and requote and rng.random() < 0.3:
+                text = rng.choice(["`{}`", "[{}]"]).format(text)
+        elif kind == "op" and text == "=" and rng.random() < 0.3:
+            text = "=="
+        elif kind == "number" and before is not None and before[1] in ("=", ">", "<", ">=", "<=") and rng.random() < 0.5:
+            text = "(" + text + ")"
+        parts.append(text)
+        last = end
+    parts.append(sql[last:])
+    respelled = "".join(parts).rstrip().rstrip(";")
+    return respelled + rng.choice(["", ";", " ;", ";;"])
+
+def check(num_variants: int, seed: int):
+    conn = build_database(seed)
+    rng = random.Random(seed)
+    fingerprints = {}
+    for sql in corpus:
+        fingerprints.setdefault(sql_fingerprint(sql), []).append(sql)
+    assert all(len(group) == 1 for group in fingerprints.values()), "distinct corpus queries share a fingerprint"
+
+    groups = {}
+    for _ in range(num_variants):
+        sql = rng.choice(corpus)
+        respelled = variant(rng, sql)
+        assert sql_fingerprint(respelled) == sql_fingerprint(sql), (sql, respelled, canonicalize_sql(respelled))
+        groups.setdefault(sql_fingerprint(respelled), set()).add(respelled)
+    compared = 0
+    for group in groups.values():
+        expected = None
+        for sql in sorted(group):
+            result = outcome(conn, sql)
+            assert expected is None or result == expected, (sorted(group)[0], sql, expected, result)
+            expected = result
+            compared += 1
+    print(f"Equivalence: {num_variants} respellings of {len(corpus)} queries keep their fingerprint; "
+          f"the {compared} distinct ones give the same result on SQLite as the other spellings.")
+
+def benchmark(num_queries: int, seed: int):
+    '''
+    A stream of generated SQLs where one in three repeats an earlier query in another spelling, as the agents'
+    candidates and retries do.
+    '''
+    rng = random.Random(seed)
+    stream, earlier = [], []
+    for _ in range(num_queries):
+        sql = rng.choice(earlier) if earlier and rng.random() < 1 / 3 else rng.choice(corpus)
+        earlier.append(sql)
+        stream.append(variant(rng, sql))
+
+    canonicalize_sql.cache_clear()
+    sql_fingerprint.cache_clear()
+    start = time.perf_counter()
+    for sql in stream:
+        sql_fingerprint(sql)
+    elapsed = time.perf_counter() - start
+    print(f"sql_fingerprint: {elapsed / len(stream) * 1e6:.0f} us per query (uncached: {len(stream)} distinct strings)")
+
+    # Rows are shared between spellings only for slow queries by default; a threshold of 0 shares them for every
+    # query, so the respelled headers are compared on the whole stream
+    configs = [("no result cache", False, None), ("result cache", True, None),
+               ("result cache, rows shared by fingerprint for every query", True, 0.0)]
+    default_min_seconds = database.shared_rows_min_seconds
+    for num_rows in (1, 2000):
+        results = []
+        for label, result_cache, min_seconds in configs:
+            table = {table: {"header": columns, "rows": [[str(row_id)] * len(columns) for row_id in range(num_rows)]}
+                     for table, columns in tables.items()}
+            sqldb = MYSQLDB(tables=[{"title": title, "table": t} for title, t in table.items()], result_cache=result_cache)
+            canonicalize_sql.cache_clear()
+            sql_fingerprint.cache_clear()
+            database.shared_rows_min_seconds = default_min_seconds if min_seconds is None else min_seconds
+            try:
+                start = time.perf_counter()
+                results.append([sqldb.execute_query(sql) for sql in stream])
+                elapsed = time.perf_counter() - start
+            finally:
+                database.shared_rows_min_seconds = default_min_seconds
+            stats = sqldb.result_cache_stats()
+            sqldb.close()
+            print(f"execute_query, {num_rows}-row tables, {label}: {elapsed / len(stream) * 1e6:.0f} us per query, "
+                  f"{stats['hits']} of {len(stream)} served from the cache")
+        # Headers and error messages follow each spelling, as SQLite gives them
+        assert all(result == results[0] for result in results[1:])
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the SQL canonicalizer.")
+    parser.add_argument("--num_variants", type=int, default=5000, help="Respelled queries for the equivalence check")
+    parser.add_argument("--num_queries", type=int, default=3000, help="Queries in the timed stream")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    check(args.num_variants, args.seed)
+    benchmark(args.num_queries, args.seed)
+
+if __name__ == "__main__":
+    main()
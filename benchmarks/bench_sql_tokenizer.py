@@ -0,0 +1,142 @@
+import sys
+import os
+import time
+import random
+import re
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils.sql.process_sql as process_sql
+from utils.sql.process_sql import Schema, get_sql, tokenize, word_tokenize
+from utils.sql.extraction_from_sql import extract_partial_template_from_sql
+
+# Queries in the style the pipeline generates for WikiTQ tables
+corpus = [
+    "SELECT * FROM Fabrice_Santoro LIMIT 3;",
+    "SELECT name, career_nwin_loss FROM Fabrice_Santoro WHERE name LIKE '%grand slam%';",
+    "SELECT city, passengers FROM Playa_de_Oro_International_Airport WHERE city LIKE '%united states%' ORDER BY passengers DESC LIMIT 1;",
+    "SELECT COUNT(*) FROM w WHERE nation = 'germany' AND gold >= 2",
+    "SELECT nation FROM w ORDER BY CAST(REPLACE(total, ',', '') AS INTEGER) DESC LIMIT 1",
+    "SELECT year FROM w WHERE competition = \"world championships\" AND position = '1st'",
+    "SELECT MAX(CAST(attendance AS REAL)) - MIN(CAST(attendance AS REAL)) FROM w",
+    "SELECT title FROM w WHERE year BETWEEN 1990 AND 1999 AND role != 'himself'",
+    "SELECT COUNT(DISTINCT opponent) FROM w WHERE result LIKE 'w%'",
+    "SELECT name, SUM(wins) as total_wins, SUM(losses) as total_losses FROM Wins GROUP BY name;",
+    "SELECT T1.pld FROM pld AS T1 JOIN games AS T2 ON T1.crs_code = T2.crs_code WHERE T2.gf = '8' AND T2.gf = '9'",
+    "SELECT avg(T1.Votes) FROM seats AS T1 JOIN votes AS T2 ON T1.Seat_ID = T2.Seat_ID WHERE T1.seats BETWEEN 1 AND 2",
+    "WITH ranked AS (SELECT athlete, time, ROW_NUMBER() OVER (ORDER BY time) AS rn FROM w) SELECT athlete FROM ranked WHERE rn = 2",
+    "CREATE TABLE table_name_tmp AS SELECT district, incumbent, first_elected FROM w WHERE first_elected < 1990;",
+    "SELECT district FROM table_name_tmp WHERE incumbent = 'john smith'",
+    "SELECT song FROM w WHERE chart_peak <= 10 AND year > 2001 ORDER BY chart_peak ASC",
+    "SELECT COUNT(*) FROM w WHERE CAST(SUBSTR(date, 1, 4) AS INTEGER) = 1998",
+    "SELECT player FROM w WHERE pick IN (1,2,3) OR round = 1",
+    "SELECT (SELECT COUNT(*) FROM w WHERE venue = 'home') - (SELECT COUNT(*) FROM w WHERE venue = 'away')",
+    "SELECT team FROM w WHERE points = (SELECT MAX(points) FROM w)",
+    "SELECT party FROM w GROUP BY party HAVING COUNT(*) > 3 ORDER BY COUNT(*) DESC",
+    "SELECT `name` FROM w WHERE `no.` = 7",
+    "SELECT name FROM w WHERE notes = \"it's over\" LIMIT 1.",
+    "SELECT t.* FROM w AS t WHERE t.rank = 1",
+    "SELECT name FROM w WHERE score = '6–4, 7–5'",
+    "SELECT población FROM w WHERE año = 2010 -- population",
+]
+
+def random_sql_like(rng: random.Random) -> str:
+    pieces = ["SELECT", "FROM", "w", "t1.col", "x_2", "COUNT", "(", ")", "*", ",", " ", "  ", "\n", "=", ">=", "<=", "!=",
+              "<>", "<", ">", "1,000", "3.5", "%", ";", "-", "+", "/", "!", ".", "..", ",,", "gonna", "Cannot", "año", "'a b'",
+              "\"c\"", "1", "2", "_", "AND", "OR", "IN", "LIKE", "NOT", "as", "val", ":", "?", "$", "`", "--", "é",
+              "'", "\"", "''", "[", "]", "{", "}", "«", "»", "“", "”", "–", "#", "@", "&", "it's", "can't", "'tis", "..."]
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(0, 30)))
+
+# Queries and text with the tokens nltk 3.10's tokenizer gives them (quotes, brackets, ":", "?", "$", "..", "--",
+# contractions, unicode dashes, ...), as the regression corpus of the tokenizer
+corpus_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql_tokenizer_corpus.json")
+
+def check_corpus():
+    '''
+    tokenize and word_tokenize over the committed corpus, without nltk.
+    '''
+    with open(corpus_path, encoding="utf-8") as f:
+        expected = json.load(f)
+    process_sql._tokenize_cached.cache_clear()
+    for entry in expected["tokenize"]:
+        tokens = tokenize(entry["sql"])
+        assert tokens == entry["tokens"], (entry["sql"], tokens, entry["tokens"])
+    for entry in expected["word_tokenize"]:
+        tokens = word_tokenize(entry["text"])
+        assert tokens == entry["tokens"], (entry["text"], tokens, entry["tokens"])
+    process_sql._tokenize_cached.cache_clear()
+    print(f"Corpus: {len(expected['tokenize'])} queries and {len(expected['word_tokenize'])} texts tokenize as expected.")
+
+def check_equivalence(num_strings: int, seed: int):
+    '''
+    word_tokenize against nltk's tokenizer on random text, when nltk is installed.
+    '''
+    try:
+        from nltk.tokenize import NLTKWordTokenizer
+    except ImportError:
+        print("Equivalence: skipped, nltk is not installed.")
+        return
+    rng = random.Random(seed)
+    treebank = NLTKWordTokenizer()
+    for i in range(num_strings):
+        text = random_sql_like(rng)
+        assert word_tokenize(text) == treebank.tokenize(text), (i, text, word_tokenize(text), treebank.tokenize(text))
+    print(f"Equivalence: {num_strings} random strings match nltk.")
+
+def check_parse_cache():
+    '''
+    Equal schemas held by different objects share their parses, and each call returns its own copy.
+    '''
+    tables = {"w": ["id", "nation", "gold", "total"], "games": ["id", "gold"]}
+    query = "SELECT T1.nation FROM w AS T1 JOIN games AS T2 ON T1.id = T2.id WHERE T2.gold = (SELECT MAX(gold) FROM w)"
+    process_sql.clear_parse_cache()
+    first = get_sql(Schema(tables), query)
+    second = get_sql(Schema({table: list(columns) for table, columns in tables.items()}), query)
+    assert len(process_sql._parse_cache) == 1, len(process_sql._parse_cache)
+    assert first == second
+    first["where"].clear()
+    assert get_sql(Schema(tables), query) == second
+    process_sql.clear_parse_cache()
+    print("Parse cache: one entry for equal schemas, independent copies.")
+
+def benchmark(repeat: int):
+    # The text tokenize hands to word_tokenize, with its quoted values replaced
+    queries = [re.sub(r'"[^"]*"', "__val__", query.replace("'", '"')) for query in corpus if query.count("'") % 2 == 0]
+    tokenizers = [("regex word_tokenize", word_tokenize)]
+    try:
+        from nltk.tokenize import NLTKWordTokenizer
+        tokenizers.insert(0, ("nltk tokenizer", NLTKWordTokenizer().tokenize))
+    except ImportError:
+        pass
+    for name, fn in tokenizers:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for query in queries:
+                fn(query)
+        print(f"{name}: {(time.perf_counter() - start) / (repeat * len(queries)) * 1e6:.1f} us per query")
+
+    # The template extractor does not handle WITH / CREATE TABLE AS
+    queries = [query for query in queries if query.split()[0].upper() == "SELECT"]
+    process_sql._tokenize_cached.cache_clear()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            extract_partial_template_from_sql(query)
+            tokenize(query)
+    print(f"tokenize + partial template, cached: {(time.perf_counter() - start) / (repeat * len(queries)) * 1e6:.1f} us per query")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the regex SQL tokenizer.")
+    parser.add_argument("--num_strings", type=int, default=100000, help="Random strings for the equivalence check")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    check_corpus()
+    check_equivalence(args.num_strings, args.seed)
+    check_parse_cache()
+    benchmark(args.repeat)
+
+if __name__ == "__main__":
+    main()
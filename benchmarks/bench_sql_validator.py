@@ -0,0 +1,215 @@
+import sys
+import os
+import time
+import random
+import sqlite3
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.sql.process_sql import Schema
+from utils.sql.validator import validate_sql
+from utils.sql.tokens import tokenize_sql
+from utils.database import MYSQLDB
+from magsql.main_scripts.MAG import Refiner
+from magsql.main_scripts.const import REFINER_NAME, SYSTEM_NAME
+
+tables = {
+    "w": ["row_id", "name", "year", "nation", "gold", "silver", "total", "city", "passengers", "career_nwin_loss",
+          "competition", "position", "notes", "venue", "date", "rank"],
+    "results": ["row_id", "nation", "opponent", "result", "attendance"],
+}
+
+# Queries in the style the agents generate; all of them run on the tables above
+corpus = [
+    "SELECT * FROM w LIMIT 3;",
+    "SELECT name, career_nwin_loss FROM w WHERE name LIKE '%grand slam%';",
+    "SELECT city, passengers FROM w WHERE city LIKE \"%united states%\" ORDER BY passengers DESC LIMIT 1;",
+    "SELECT COUNT(*) FROM w WHERE nation = 'germany' AND gold >= 2",
+    "SELECT nation FROM w ORDER BY CAST(REPLACE(total, ',', '') AS INTEGER) DESC LIMIT 1",
+    "SELECT year FROM w WHERE competition = \"world championships\" AND position = '1st'",
+    "SELECT MAX(CAST(passengers AS REAL)) - MIN(CAST(passengers AS REAL)) FROM w",
+    "SELECT name FROM w WHERE year BETWEEN 1990 AND 1999 AND notes != 'himself'",
+    "SELECT COUNT(DISTINCT opponent) FROM results WHERE result LIKE 'w%'",
+    "WITH Wins AS (SELECT name, CAST(SUBSTR(career_nwin_loss, 1, INSTR(career_nwin_loss, '-') - 1) AS INT) AS wins, "
+    "CAST(SUBSTR(career_nwin_loss, INSTR(career_nwin_loss, '-') + 1) AS INT) AS losses FROM w "
+    "WHERE name LIKE \"%australian open%\" OR name LIKE \"%indian wells%\") "
+    "SELECT name, SUM(wins) as total_wins, SUM(losses) as total_losses FROM Wins GROUP BY name;",
+    "WITH PassengerCounts AS (SELECT city, CAST(REPLACE(passengers, ',', '') AS INT) AS passenger_count FROM w "
+    "WHERE city LIKE \"%los angeles%\" OR city LIKE \"%saskatoon%\") "
+    "SELECT SUM(CASE WHEN city LIKE \"%los angeles%\" THEN passenger_count ELSE 0 END) - "
+    "SUM(CASE WHEN city LIKE \"%saskatoon%\" THEN passenger_count ELSE 0 END) AS passenger_difference FROM PassengerCounts;",
+    "SELECT T1.name FROM w AS T1 JOIN results AS T2 ON T1.nation = T2.nation WHERE T2.attendance > 100",
+    "SELECT a.name, b.result FROM w a, results b WHERE a.nation = b.nation",
+    "WITH ranked AS (SELECT name, year, ROW_NUMBER() OVER (ORDER BY year) AS rn FROM w) SELECT name FROM ranked WHERE rn = 2",
+    "CREATE TABLE table_name_tmp AS SELECT name, nation, year FROM w WHERE year < 1990; "
+    "SELECT name FROM table_name_tmp WHERE nation = 'kenya'",
+    "SELECT name FROM w WHERE gold = (SELECT MAX(gold) FROM w)",
+    "SELECT nation FROM w GROUP BY nation HAVING COUNT(*) > 3 ORDER BY COUNT(*) DESC",
+    "SELECT `name` FROM w WHERE `rank` = 7",
+    "SELECT [name] FROM w WHERE \"rank\" = 1",
+    "SELECT t.* FROM w AS t WHERE t.rank = 1",
+    "SELECT name, gold + silver AS medals FROM w ORDER BY medals DESC",
+    "SELECT count(*) cnt FROM w WHERE nation = 'x' ORDER BY cnt",
+    "SELECT name FROM (SELECT name, year AS y FROM w) sub WHERE y > 2000 AND sub.y < 2010",
+    "SELECT (SELECT COUNT(*) FROM w WHERE venue = 'home') - (SELECT COUNT(*) FROM w WHERE venue = 'away')",
+    "SELECT name FROM w WHERE nation IN (SELECT nation FROM results WHERE result = 'w') AND year IS NOT NULL",
+    "SELECT CASE WHEN gold > silver THEN 'more gold' ELSE 'more silver' END label, name FROM w",
+    "SELECT name FROM w WHERE date LIKE '%2001%' AND strftime('%Y', date) = '2001'",
+    "SELECT name FROM w WHERE EXISTS (SELECT 1 FROM results r WHERE r.nation = w.nation)",
+    "SELECT name FROM w UNION SELECT opponent FROM results ORDER BY 1",
+    "SELECT w.name, r.opponent FROM w LEFT JOIN results r USING (nation)",
+    "SELECT name, rowid FROM w WHERE rowid < 3",
+    "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 5) SELECT x FROM n",
+    "WITH a AS (SELECT nation, SUM(gold) AS g FROM w GROUP BY nation), b AS (SELECT * FROM a WHERE g > 1) "
+    "SELECT nation FROM b ORDER BY g DESC",
+    "SELECT name FROM w WHERE name LIKE '%a\\_%' ESCAPE '\\' COLLATE NOCASE",
+    "SELECT name, total FROM w ORDER BY total DESC NULLS LAST LIMIT 1 OFFSET 1",
+    "SELECT AVG(gold) FILTER (WHERE year > 2000) FROM w",
+    "SELECT name, SUM(gold) OVER win FROM w WINDOW win AS (PARTITION BY nation)",
+    "SELECT value FROM json_each('[1, 2]')",
+    "SELECT 1 + 1",
+    "SELECT name FROM w -- the names\nWHERE year > 2000 /* recent */",
+    "SELECT nation, \"total medals\" FROM w",
+]
+
+def run(conn: sqlite3.Connection, sql: str) -> str:
+    '''
+    The error SQLite reports for `sql` ("" when it runs), on a rolled-back copy of the database state.
+    '''
+    try:
+        conn.execute("SAVEPOINT check_sql")
+        for statement in split_script(sql):
+            conn.execute(statement).fetchall()
+        return ""
+    except sqlite3.Error as e:
+        return str(e)
+    finally:
+        conn.execute("ROLLBACK TO check_sql")
+        conn.execute("RELEASE check_sql")
+
+def split_script(sql: str) -> list:
+    statements, current = [], ""
+    for part in sql.split(";"):
+        current += part
+        if sqlite3.complete_statement(current + ";"):
+            if current.strip():
+                statements.append(current)
+            current = ""
+        else:
+            current += ";"
+    if current.strip():
+        statements.append(current)
+    return statements
+
+def build_database() -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    for table, columns in tables.items():
+        conn.execute("CREATE TABLE {} ({})".format(table, ", ".join(columns)))
+        conn.execute("INSERT INTO {} VALUES ({})".format(table, ", ".join("'1'" for _ in columns)))
+    return conn
+
+def perturb(rng: random.Random, name: str) -> str:
+    chars = list(name)
+    op = rng.random()
+    pos = rng.randrange(len(chars))
+    if op < 0.25 and len(chars) > 1:
+        del chars[pos]
+    elif op < 0.5:
+        chars.insert(pos, rng.choice("abcdefghijklmnopqrstuvwxyz_"))
+    elif op < 0.75:
+        chars[pos] = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    elif len(chars) > 1:
+        pos = min(pos, len(chars) - 2)
+        chars[pos], chars[pos + 1] = chars[pos + 1], chars[pos]
+    return "".join(chars)
+
+def check(num_mutations: int, seed: int):
+    conn = build_database()
+    schema = Schema(tables)
+    for sql in corpus:
+        error = run(conn, sql)
+        assert not error, (sql, error)
+        diagnostic = validate_sql(sql, schema)
+        assert diagnostic.valid, (sql, diagnostic.issues)
+    print(f"Corpus: {len(corpus)} queries run on SQLite and pass the check.")
+
+    rng = random.Random(seed)
+    known = {column for columns in tables.values() for column in columns} | set(tables)
+    counts = {"rejected by both": 0, "missed": 0, "accepted by both": 0, "repaired": 0}
+    for _ in range(num_mutations):
+        sql = rng.choice(corpus)
+        names = [token for token in tokenize_sql(sql) if token[0] == "name" and token[1] in known]
+        if not names:
+            continue
+        _, name, start, end = rng.choice(names)
+        mutated = sql[:start] + perturb(rng, sql[start:end]) + sql[end:]
+        error = run(conn, mutated)
+        diagnostic = validate_sql(mutated, schema)
+        if not diagnostic.valid:
+            assert error, ("flagged a query SQLite runs", mutated, diagnostic.issues)
+            counts["rejected by both"] += 1
+            if diagnostic.repaired_sql:
+                assert not run(conn, diagnostic.repaired_sql), ("repair does not run", mutated, diagnostic.repaired_sql)
+                counts["repaired"] += 1
+        elif error:
+            counts["missed"] += 1
+        else:
+            counts["accepted by both"] += 1
+    print(f"Mutations: {num_mutations} single-name edits, no query SQLite runs was flagged: {counts}")
+
+class NoLLM(object):
+    def generate(self, prompt: str):
+        raise AssertionError("the refiner called the LLM")
+
+def check_refiner_repair():
+    '''
+    MAG's Refiner fixes a misspelled column from the validator's suggestion, without an LLM call.
+    '''
+    table = {"header": ["name", "nation", "gold"], "rows": [["kip", "kenya", "2"], ["eva", "germany", "1"]]}
+    sqldb = MYSQLDB(tables=[{"title": "w", "table": table}])
+    message = {
+        "send_to": REFINER_NAME,
+        "sqldb": sqldb,
+        "final_sql": "SELECT nam, gold FROM w WHERE nation = 'kenya'",
+        "subquery_list": ["Which athlete from kenya won gold medals?"],
+    }
+    refiner = Refiner(llm=NoLLM())
+    try:
+        # The first round repairs the query, the second runs the repair and accepts it
+        while message["send_to"] == REFINER_NAME:
+            refiner.talk(message)
+    finally:
+        sqldb.close()
+    assert message["send_to"] == SYSTEM_NAME, message
+    assert message["pred"] == "SELECT name, gold FROM w WHERE nation = 'kenya'", message["pred"]
+    print("Refiner: a misspelled column is repaired without calling the LLM.")
+
+def benchmark(repeat: int):
+    conn = build_database()
+    schema = Schema(tables)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for sql in corpus:
+            validate_sql(sql, schema)
+    validated = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for sql in corpus:
+            run(conn, sql)
+    executed = time.perf_counter() - start
+    per_query = 1e6 / (repeat * len(corpus))
+    print(f"validate_sql: {validated * per_query:.0f} us per query; running it on SQLite: {executed * per_query:.0f} us")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the static SQL validator.")
+    parser.add_argument("--num_mutations", type=int, default=5000, help="Mutated queries for the check against SQLite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    check(args.num_mutations, args.seed)
+    check_refiner_repair()
+    benchmark(args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import sys
+import os
+import time
+import random
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils.normalizer as normalizer
+from utils.normalizer import str_normalize, str_normalize_batch, configure_str_normalize
+
+filler_words = ["boston", "celtics", "united", "states", "river", "john", "smith", "club", "album", "song", "park",
+                "road", "los angeles", "new york", "-", "/", "&", "a.m.", "mr.", "½", "xiv", "o'clock"]
+
+def random_corpus(rng: random.Random, size: int) -> list:
+    '''
+    Phrases built from the recognizers' own words (stopwords and single letters included) and plain words.
+    '''
+    words = sorted(normalizer._recognizer_words()) + filler_words * 4
+    corpus = []
+    for _ in range(size):
+        corpus.append(" ".join(rng.choice(words) for _ in range(rng.randint(1, 5))))
+    return corpus
+
+def random_column(rng: random.Random, size: int) -> list:
+    names = ["boston celtics", "john smith", "united states", "los angeles lakers", "river plate", "the beatles",
+             "real madrid", "gold", "silver", "bronze", "none", "n/a", "winner", "runner-up", "round of 16"]
+    months = ["january", "march", "may", "august", "october", "december"]
+    column = []
+    for _ in range(size):
+        kind = rng.random()
+        if kind < 0.6:
+            column.append(rng.choice(names))
+        elif kind < 0.8:
+            column.append(f"{rng.randint(1, 5000):,}")
+        else:
+            column.append(f"{rng.choice(months)} {rng.randint(1, 28)}, {rng.randint(1950, 2020)}")
+    return column
+
+def check_equivalence(num_strings: int, seed: int):
+    rng = random.Random(seed)
+    corpus = random_corpus(rng, num_strings)
+    expected = [str_normalize(value) for value in corpus]
+    actual = str_normalize_batch(corpus)
+    mismatches = [(value, a, e) for value, a, e in zip(corpus, actual, expected) if a != e]
+    assert not mismatches, mismatches[:10]
+    skipped = sum(1 for value in corpus if not normalizer._get_trigger_pattern().search(value))
+    print(f"Equivalence: {num_strings} random strings match str_normalize ({skipped} skipped by the pre-filter).")
+
+def benchmark(num_cells: int, num_workers: int):
+    column = random_column(random.Random(0), num_cells)
+    start = time.perf_counter()
+    [str_normalize(value) for value in column]
+    legacy = time.perf_counter() - start
+
+    timings = []
+    for workers in sorted({1, num_workers}):
+        normalizer._str_normalize_cache.clear()
+        configure_str_normalize(num_workers=workers, min_parallel=1)
+        str_normalize_batch(column[:1] * 2)  # Start the pool outside the measurement
+        normalizer._str_normalize_cache.clear()
+        start = time.perf_counter()
+        str_normalize_batch(column)
+        timings.append((workers, time.perf_counter() - start))
+    start = time.perf_counter()
+    str_normalize_batch(column)
+    warm = time.perf_counter() - start
+
+    print(f"{num_cells} cells, per-cell str_normalize: {legacy * 1000:.0f} ms")
+    for workers, elapsed in timings:
+        print(f"str_normalize_batch, {workers} worker(s), cold cache: {elapsed * 1000:.0f} ms")
+    print(f"str_normalize_batch, warm cache: {warm * 1000:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the pre-filtered, memoized str_normalize.")
+    parser.add_argument("--num_strings", type=int, default=2000, help="Random strings for the equivalence check")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cells", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    check_equivalence(args.num_strings, args.seed)
+    benchmark(args.cells, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import sys
+import os
+import time
+import random
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils.table_render as table_render
+from utils.table_render import create_table, df_pipe_table, df_create_table
+from utils.general_prompt import select_x_rows_prompt, create_table_prompt, table2pipe, ensure_strings, _omitted_rows_line
+from utils.helper import table2string
+from chain.utils.helper import table2string as chain_table2string
+
+# The renderers as they were before utils/table_render.py (table2pipe with the middle-row trimming fix)
+def legacy_select_x_rows_prompt(full_table: bool, df: pd.DataFrame, title: str, num_rows: int = 3) -> tuple[int, str]:
+    total_number = len(df)
+    if full_table:
+        prompt = f'/*\nAll rows of the table:\nSELECT * FROM {title};\n'
+        num_rows = total_number
+    else:
+        num_rows = min(num_rows, total_number)
+        if num_rows == total_number:
+            prompt = f'/*\nAll rows of the table:\nSELECT * FROM {title};\n'
+            num_rows = total_number
+        else:
+            prompt = f'/*\n{num_rows} example rows:\nSELECT * FROM {title} LIMIT {num_rows};\n'
+    prompt += "| "
+    prompt += " | ".join(df.columns)
+    prompt += " |\n"
+    for _, row in df.iloc[:num_rows].iterrows():
+        prompt += "| "
+        prompt += " | ".join(map(str, row.values))
+        prompt += " |\n"
+    prompt += '*/\n'
+    return total_number, prompt
+
+def legacy_create_table_prompt(df: pd.DataFrame, title: str) -> str:
+    prompt = "CREATE TABLE {}(\n".format(title)
+    for header in df.columns:
+        column_type = 'text'
+        try:
+            if df[header].dtype == 'int64':
+                column_type = 'int'
+            elif df[header].dtype == 'float64':
+                column_type = 'real'
+            elif df[header].dtype == 'datetime64':
+                column_type = 'datetime'
+        except AttributeError as e:
+            pass
+        prompt += '\t{} {},\n'.format(header, column_type)
+    prompt = prompt.rstrip(',\n') + ')\n'
+    return prompt
+
+def legacy_create_table_from_types(table_name: str, columns: list, types: list) -> str:
+    prompt = "CREATE TABLE {}(\n".format(table_name)
+    for column_name, column_type in zip(columns, types):
+        prompt += '\t{} {},\n'.format(column_name, column_type)
+    return prompt.rstrip(',\n') + ')\n'
+
+def legacy_table2pipe(table: dict, max_tokens: int = None) -> str:
+    try:
+        header_line = "| " + " | ".join(table["header"]) + " |\n"
+        row_lines = ["| " + " | ".join(ensure_strings(raw_row)) + " |\n" for raw_row in table["rows"]]
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError("Wrong table format.") from e
+    num_omitted = table.get("num_omitted", 0)
+    omitted_at = table.get("omitted_at", len(row_lines))
+    if max_tokens is not None:
+        if not num_omitted:
+            omitted_at = (len(row_lines) + 1) // 2
+        head_lines, tail_lines = row_lines[:omitted_at], row_lines[omitted_at:]
+        size = len(header_line) + sum(len(line) for line in row_lines)
+        budget = max_tokens * 4
+        while size + (len(_omitted_rows_line(num_omitted)) if num_omitted else 0) > budget and len(head_lines) + len(tail_lines) > 2:
+            if len(head_lines) > len(tail_lines):
+                size -= len(head_lines.pop())
+            else:
+                size -= len(tail_lines.pop(0))
+            num_omitted += 1
+        row_lines = head_lines + tail_lines
+        omitted_at = len(head_lines)
+    if num_omitted:
+        row_lines = row_lines[:omitted_at] + [_omitted_rows_line(num_omitted)] + row_lines[omitted_at:]
+    return header_line + "".join(row_lines)
+
+def legacy_table2string(table_text, num_rows=100, caption=None):
+    df = pd.DataFrame(data=table_text[1:][:num_rows], columns=table_text[0])
+    linear_table = ""
+    if caption is not None:
+        linear_table += "table caption : " + caption + "\n"
+    header = "col : " + " | ".join(df.columns) + "\n"
+    linear_table += header
+    rows = df.values.tolist()
+    for row_idx, row in enumerate(rows):
+        row = [str(x) for x in row]
+        line = "row {} : ".format(row_idx + 1) + " | ".join(row)
+        if row_idx != len(rows) - 1:
+            line += "\n"
+        linear_table += line
+    return linear_table
+
+cell_makers = [
+    lambda rng: rng.choice(["germany", "14,749", "2001-05-03", "", " a b ", "año", "w 2-1", "none", "nan"]),
+    lambda rng: rng.randint(-5, 5000),
+    lambda rng: rng.choice([0.5, 1.0, 1e16, float("nan"), -2.25]),
+    lambda rng: rng.choice([True, False]),
+    lambda rng: None,
+    lambda rng: pd.Timestamp(2001, rng.randint(1, 12), 3),
+    lambda rng: datetime.date(1999, 1, rng.randint(1, 28)),
+    lambda rng: np.int64(rng.randint(0, 9)),
+]
+
+def random_df(rng: random.Random) -> pd.DataFrame:
+    num_columns, num_rows = rng.randint(0, 5), rng.randint(0, 12)
+    columns = {}
+    names = [rng.choice(["name", "year", "total", "city", "notes"]) + rng.choice(["", "_2"]) for _ in range(num_columns)]
+    for col_idx in range(num_columns):
+        # Mostly one kind per column, sometimes mixed
+        makers = rng.sample(cell_makers, rng.choice([1, 1, 1, 2]))
+        columns[col_idx] = [rng.choice(makers)(rng) for _ in range(num_rows)]
+    df = pd.DataFrame(columns) if num_columns else pd.DataFrame(index=range(num_rows))
+    df.columns = names
+    if num_columns and rng.random() < 0.3:
+        df = df.convert_dtypes() if rng.random() < 0.5 else df.infer_objects()
+    return df
+
+def random_table_text(rng: random.Random) -> list:
+    num_columns, num_rows = rng.randint(1, 5), rng.randint(0, 12)
+    header = [rng.choice(["name", "year", "total"]) for _ in range(num_columns)]
+    if rng.random() < 0.7:
+        makers = [cell_makers[0]]
+    else:
+        makers = rng.sample(cell_makers, 2)
+    rows = [[rng.choice(makers)(rng) for _ in range(num_columns)] for _ in range(num_rows)]
+    if rows and rng.random() < 0.05:
+        rows[0] = rows[0][:-1]
+    return [header] + rows
+
+def same(fn, legacy, *args, **kwargs):
+    try:
+        expected = legacy(*args, **kwargs)
+    except Exception as e:
+        try:
+            fn(*args, **kwargs)
+        except Exception as f:
+            assert type(f) == type(e), (args, e, f)
+            return
+        raise AssertionError(("legacy raised, new did not", args, e))
+    actual = fn(*args, **kwargs)
+    assert actual == expected, (args, expected, actual)
+    # And again, from the render cache
+    assert fn(*args, **kwargs) == expected
+
+def check(num_tables: int, seed: int):
+    rng = random.Random(seed)
+    for _ in range(num_tables):
+        df = random_df(rng)
+        for full_table in (False, True):
+            same(select_x_rows_prompt, legacy_select_x_rows_prompt, full_table, df, "w", rng.randint(0, 5))
+        same(create_table_prompt, legacy_create_table_prompt, df, "w")
+
+        header = list(map(str, df.columns))
+        rows = [list(row) for row in df.itertuples(index=False)]
+        result = {"header": header, "rows": rows}
+        if rows and rng.random() < 0.5:
+            result.update(num_omitted=rng.randint(1, 50), omitted_at=rng.randint(0, len(rows)))
+        max_tokens = rng.choice([None, 5, 20, 60, 1000])
+        same(table2pipe, legacy_table2pipe, result, max_tokens)
+        same(create_table, legacy_create_table_from_types, "t", header, [rng.choice(["TEXT", "INT", ""]) for _ in header])
+
+        table_text = random_table_text(rng)
+        num_rows, caption = rng.choice([100, 3, 0]), rng.choice([None, "a caption"])
+        same(table2string, legacy_table2string, table_text, num_rows, caption)
+        same(chain_table2string, legacy_table2string, table_text, num_rows, caption)
+    same(table2pipe, legacy_table2pipe, {"header": None, "rows": []})
+    print(f"Equivalence: {num_tables} random tables render byte-identically in every format (fresh and cached).")
+
+def check_budget_trimming():
+    '''
+    A result that only overflows the token budget keeps its header, first and last rows, with the marker between them.
+    '''
+    result = {"header": ["row_id", "name"], "rows": [[str(i), f"name {i}"] for i in range(10)]}
+    lines = table2pipe(result, max_tokens=20).splitlines()
+    assert lines[0] == "| row_id | name |", lines
+    assert lines[1] == "| 0 | name 0 |" and lines[-1] == "| 9 | name 9 |", lines
+    marker = [i for i, line in enumerate(lines) if "more rows" in line]
+    assert len(marker) == 1 and 1 < marker[0] < len(lines) - 1, lines
+    assert int(lines[marker[0]].split()[2]) + len(lines) - 2 == 10, lines
+    # Within the budget, nothing is dropped
+    assert table2pipe(result, max_tokens=1000) == table2pipe(result)
+    # Already truncated by max_rows: trimming continues next to the existing marker
+    truncated = dict(result, num_omitted=5, omitted_at=8)
+    lines = table2pipe(truncated, max_tokens=20).splitlines()
+    assert lines[1] == "| 0 | name 0 |" and lines[-1] == "| 9 | name 9 |", lines
+    print("Budget trimming: first and last rows kept, one marker in the middle.")
+
+def check_edit_in_place():
+    '''
+    A table changed in place after it is rendered renders its new content in every format.
+    '''
+    df = pd.DataFrame({"name": ["germany", "france"], "gold": [3, 1]})
+    assert "germany" in df_pipe_table(df, 2)
+    df.iloc[0, 0] = "italy"
+    assert "italy" in df_pipe_table(df, 2) and "germany" not in df_pipe_table(df, 2)
+    df.iloc[1, 1] = -0.0
+    assert df_pipe_table(df, 2) == legacy_select_x_rows_prompt(True, df, "w")[1].split("\n", 3)[3][:-3]
+    assert df_create_table(df, "w") == legacy_create_table_prompt(df, "w")
+
+    result = {"header": ["name", "gold"], "rows": [["germany", 3], ["france", 1]]}
+    assert table2pipe(result) == legacy_table2pipe(result)
+    result["rows"][1][1] = 1.0
+    assert table2pipe(result) == legacy_table2pipe(result)
+
+    table_text = [["name", "gold"], ["germany", "3"], ["france", "1"]]
+    assert table2string(table_text) == legacy_table2string(table_text)
+    table_text[2][0] = "italy"
+    assert table2string(table_text) == legacy_table2string(table_text)
+    # Past the rows it shows, an edit leaves the render as it was
+    assert table2string(table_text, 1) == legacy_table2string(table_text, 1)
+    print("Edits in place: a changed cell renders again in every format.")
+
+def timed(fn, repeat: int, *args) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return (time.perf_counter() - start) / repeat * 1e3
+
+def benchmark(num_rows: int, repeat: int):
+    rng = random.Random(0)
+    df = pd.DataFrame({
+        "row_id": range(num_rows),
+        "name": [rng.choice(["australian open", "french open", "wimbledon"]) for _ in range(num_rows)],
+        "year": [str(rng.randint(1990, 2020)) for _ in range(num_rows)],
+        "total": [f"{rng.randint(1, 5000):,}" for _ in range(num_rows)],
+    })
+    table_text = [list(df.columns)] + [list(map(str, row)) for row in df.values.tolist()]
+    result = {"header": list(df.columns), "rows": [list(row) for row in df.itertuples(index=False)]}
+    # Only DataFrame renders are memoized
+    cases = [
+        ("select_x_rows_prompt, all rows", legacy_select_x_rows_prompt, select_x_rows_prompt, (True, df, "w"), True),
+        ("table2string", legacy_table2string, table2string, (table_text, num_rows), False),
+        ("table2pipe", legacy_table2pipe, table2pipe, (result,), False),
+    ]
+    for name, legacy, fn, args, memoized in cases:
+        legacy_ms = timed(legacy, repeat, *args)
+        table_render.clear_render_cache()
+        cold_ms = timed(lambda *a: (table_render.clear_render_cache(), fn(*a)), repeat, *args)
+        line = f"{name}, {num_rows} rows: legacy {legacy_ms:.2f} ms, table_render {cold_ms:.2f} ms"
+        if memoized:
+            line += f", cached {timed(fn, repeat, *args):.3f} ms"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the shared table renderer.")
+    parser.add_argument("--num_tables", type=int, default=2000, help="Random tables for the equivalence check")
+    parser.add_argument("--num_rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    check(args.num_tables, args.seed)
+    check_budget_trimming()
+    check_edit_in_place()
+    benchmark(args.num_rows, args.repeat)
+
+if __name__ == "__main__":
+    main()
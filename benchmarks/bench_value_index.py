@@ -0,0 +1,126 @@
+import sys
+import os
+import time
+import random
+import argparse
+import pandas as pd
+from fuzzywuzzy import fuzz
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils.value_index as value_index
+from utils.value_index import TableValueIndex, get_table_value_index
+
+def get_matched_cells_legacy(value_str, df, fuzz_threshold=70):
+    '''
+    post_process_sql's cell matcher before the value index, kept as the reference for the equivalence check.
+    '''
+    matched_cells = []
+    for row_id, row in df.iterrows():
+        for cell in row:
+            cell = str(cell)
+            fuzz_score = fuzz.ratio(value_str, cell)
+            if fuzz_score == 100:
+                matched_cells = [(cell, fuzz_score)]
+                return matched_cells
+            if fuzz_score >= fuzz_threshold:
+                matched_cells.append((cell, fuzz_score))
+
+    matched_cells = sorted(matched_cells, key=lambda x: x[1], reverse=True)
+    return matched_cells
+
+def get_matched_columns_legacy(sql_col, df):
+    matched_columns = []
+    for col in df.columns:
+        score = fuzz.ratio(sql_col.lower(), col)
+        if score == 100:
+            matched_columns = [(col, score)]
+            break
+        if score >= 80:
+            matched_columns.append((col, score))
+    return sorted(matched_columns, key=lambda x: x[1], reverse=True)
+
+words = ["boston", "celtics", "lakers", "chicago", "bulls", "new", "york", "knicks", "1996", "2001", "gold", "silver",
+         "bronze", "none", "nan", "united", "states", "canada", "mexico", "fc", "city", "1st", "2nd", "-", "(a)"]
+
+def random_cell(rng: random.Random) -> str:
+    return " ".join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+
+def perturb(rng: random.Random, value: str) -> str:
+    chars = list(value)
+    for _ in range(rng.randint(0, 3)):
+        op = rng.random()
+        pos = rng.randint(0, max(len(chars) - 1, 0))
+        if op < 0.3 and chars:
+            del chars[pos]
+        elif op < 0.6:
+            chars.insert(pos, rng.choice("abcdefghijklmnopqrstuvwxyz 0123456789"))
+        elif chars:
+            chars[pos] = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    return "".join(chars)
+
+def random_table(rng: random.Random, num_rows: int, num_cols: int) -> pd.DataFrame:
+    header = [f"{rng.choice(words)}_{col}" for col in range(num_cols)]
+    return pd.DataFrame(data=[[random_cell(rng) for _ in range(num_cols)] for _ in range(num_rows)], columns=header)
+
+def check_equivalence(num_tables: int, seed: int):
+    rng = random.Random(seed)
+    for i in range(num_tables):
+        df = random_table(rng, rng.randint(1, 40), rng.randint(1, 6))
+        index = TableValueIndex(df)
+        cells = df.values.ravel().tolist()
+        for _ in range(10):
+            query = perturb(rng, rng.choice(cells)) if rng.random() < 0.8 else random_cell(rng)
+            assert index.cells.match(query, 70) == get_matched_cells_legacy(query, df), (i, query)
+            column = perturb(rng, rng.choice(list(df.columns))).upper()
+            assert index.columns.match(column.lower(), 80) == get_matched_columns_legacy(column, df), (i, column)
+    print(f"Equivalence: {num_tables} random tables match the legacy matcher.")
+
+def check_edit_in_place():
+    df = pd.DataFrame(data=[["boston celtics", "1996"], ["chicago bulls", "2001"]], columns=["team", "year"])
+    assert get_table_value_index(df) is get_table_value_index(df.copy())
+    df.iloc[0, 0] = "new york knicks"
+    assert get_table_value_index(df).cells.match("new york knicks", 70) == [("new york knicks", 100)]
+    print("Edit in place: the index follows the table content.")
+
+def benchmark(num_rows: int, num_cols: int, num_queries: int):
+    rng = random.Random(0)
+    df = random_table(rng, num_rows, num_cols)
+    cells = df.values.ravel().tolist()
+    queries = [perturb(rng, rng.choice(cells)) for _ in range(num_queries)]
+
+    start = time.perf_counter()
+    for query in queries:
+        get_matched_cells_legacy(query, df)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = TableValueIndex(df)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    for query in queries:
+        index.cells.match(query, 70)
+    indexed = time.perf_counter() - start
+    print(f"{num_rows} x {num_cols}, {num_queries} literals: legacy {legacy * 1000:.1f} ms, "
+          f"index build {build * 1000:.1f} ms + lookups {indexed * 1000:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the value index used by post_process_sql.")
+    parser.add_argument("--num_tables", type=int, default=200, help="Random tables for the equivalence check")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--cols", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=20)
+    args = parser.parse_args()
+
+    backends = [("character bound", None)]
+    if value_index.rapid_process is not None:
+        backends.insert(0, ("rapidfuzz", value_index.rapid_process))
+    for name, backend in backends:
+        value_index.rapid_process = backend
+        print(f"[{name}]")
+        check_equivalence(args.num_tables, args.seed)
+        check_edit_in_place()
+        benchmark(args.rows, args.cols, args.queries)
+
+if __name__ == "__main__":
+    main()
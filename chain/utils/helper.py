@@ -17,6 +17,7 @@ import pandas as pd
 import json
 import re
 from _ctypes import PyObj_FromPtr
+from utils.table_render import table_text_linear
 
 
 def table2df(table_text, num_rows=100):
@@ -31,21 +32,7 @@ def table2string(
     num_rows=100,
     caption=None,
 ):
-    df = table2df(table_text, num_rows)
-    linear_table = ""
-    if caption is not None:
-        linear_table += "table caption : " + caption + "\n"
-
-    header = "col : " + " | ".join(df.columns) + "\n"
-    linear_table += header
-    rows = df.values.tolist()
-    for row_idx, row in enumerate(rows):
-        row = [str(x) for x in row]
-        line = "row {} : ".format(row_idx + 1) + " | ".join(row)
-        if row_idx != len(rows) - 1:
-            line += "\n"
-        linear_table += line
-    return linear_table
+    return table_text_linear(table_text, num_rows=num_rows, caption=caption)
 
 
 class NoIndent(object):
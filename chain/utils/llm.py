@@ -14,6 +14,8 @@
 import openai
 import time
 import numpy as np
+from utils.http_clients import get_openai_client
+from utils.rate_limiter import RateLimiter, estimate_request_tokens, retry_after_seconds, is_rate_limit_error, backoff_delay
 
 class MyChatGPT:
     """
@@ -22,15 +24,20 @@ class MyChatGPT:
     This class provides methods to generate text using OpenAI's GPT models,
     dynamically adjust token limits, and handle API errors efficiently.
     """
-    def __init__(self, model_name: str, key: str):
+    def __init__(self, model_name: str, key: str, rate_limiter: RateLimiter = None, retry_limit: int = 5, client=None):
         """
         Initializes the ChatGPT class with the specified model and API key.
 
         :param model_name: Name of the OpenAI GPT model (e.g., "gpt-4", "gpt-3.5-turbo").
         :param key: OpenAI API key for authentication.
+        :param rate_limiter: Optional limiter shared with other workers (see utils/rate_limiter.py).
+        :param retry_limit: Number of retries (with exponential backoff) before giving up.
+        :param client: Pre-built client to use instead of creating one (e.g. utils.replay_llm.CassetteClient).
         """
         self.model_name = model_name
-        self.client = openai.OpenAI(api_key=key)
+        self.rate_limiter = rate_limiter
+        self.retry_limit = retry_limit
+        self.client = client if client is not None else get_openai_client(key)
 
 
 
@@ -77,9 +84,12 @@ class MyChatGPT:
         ]
         gpt_responses = None
         retry_num = 0
-        retry_limit = 2
+        retry_limit = self.retry_limit
         error = None
+        request_tokens = estimate_request_tokens(messages, options)
         while gpt_responses is None:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(request_tokens)
             try:
                 gpt_responses = self.client.chat.completions.create(
                     model=self.model_name,
@@ -106,7 +116,11 @@ class MyChatGPT:
                         "choices": [{"message": {"content": "PLACEHOLDER"}}]
                     }
                 else:
-                    time.sleep(10)  # Wait for 10 seconds before retrying
+                    # Back off exponentially, or as long as the server asks via Retry-After
+                    delay = backoff_delay(retry_num, retry_after=retry_after_seconds(e))
+                    if self.rate_limiter is not None and is_rate_limit_error(e):
+                        self.rate_limiter.penalize(delay)
+                    time.sleep(delay)
 
                 retry_num += 1  # Increment retry counter
         if error:
@@ -135,16 +149,21 @@ class MyDeepSeek:
     This class provides methods to generate text using OpenAI's GPT models,
     dynamically adjust token limits, and handle API errors efficiently.
     """
-    def __init__(self, model_name: str, key: str):
+    def __init__(self, model_name: str, key: str, rate_limiter: RateLimiter = None, retry_limit: int = 5, client=None):
         """
         Initializes the ChatGPT class with the specified model and API key.
 
         :param model_name: Name of the OpenAI GPT model (e.g., "gpt-4", "gpt-3.5-turbo").
         :param key: OpenAI API key for authentication.
+        :param rate_limiter: Optional limiter shared with other workers (see utils/rate_limiter.py).
+        :param retry_limit: Number of retries (with exponential backoff) before giving up.
+        :param client: Pre-built client to use instead of creating one (e.g. utils.replay_llm.CassetteClient).
         """
         self.model_name = model_name
-        self.client = openai.OpenAI(
-          api_key=key,
+        self.rate_limiter = rate_limiter
+        self.retry_limit = retry_limit
+        self.client = client if client is not None else get_openai_client(
+          key,
           base_url="https://api.deepseek.com"  # 注意是 DeepSeek 的地址
         )
 
@@ -193,9 +212,12 @@ class MyDeepSeek:
         ]
         gpt_responses = None
         retry_num = 0
-        retry_limit = 2
+        retry_limit = self.retry_limit
         error = None
+        request_tokens = estimate_request_tokens(messages, options)
         while gpt_responses is None:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(request_tokens)
             try:
                 gpt_responses = self.client.chat.completions.create(
                     model=self.model_name,
@@ -222,7 +244,11 @@ class MyDeepSeek:
                         "choices": [{"message": {"content": "PLACEHOLDER"}}]
                     }
                 else:
-                    time.sleep(10)  # Wait for 10 seconds before retrying
+                    # Back off exponentially, or as long as the server asks via Retry-After
+                    delay = backoff_delay(retry_num, retry_after=retry_after_seconds(e))
+                    if self.rate_limiter is not None and is_rate_limit_error(e):
+                        self.rate_limiter.penalize(delay)
+                    time.sleep(delay)
 
                 retry_num += 1  # Increment retry counter
         if error:
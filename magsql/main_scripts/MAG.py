@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
 import json
-from func_timeout import func_timeout,FunctionTimedOut
+from utils.database import is_query_error
+from utils.sql.canonical import sql_fingerprint
 from magsql.main_scripts.utils import parse_json, check_letter, contain_value, add_prefix, load_json_file, extract_world_info, is_email, is_valid_date_column, extract_sql, detect_special_char, add_quotation_mark, get_matched_content_sequence, get_chosen_schema, extract_subquery
 from magsql.main_scripts.bridge_content_encoder import get_matched_entries
 
@@ -66,11 +67,13 @@ class Soft_Schema_linker(BaseAgent):
 
         if self.total_content_dict.get(table_name) is None:
             self.total_content_dict[table_name] = {}
+            rows = None
             for col_name, col_type in zip(all_column_names, all_column_types):
                 if col_type.upper() != "TEXT":
                     continue
 
-                rows = sqldb.get_rows(table_name)
+                if rows is None:
+                    rows = sqldb.get_rows(table_name)
                 col_idx = all_column_names.index(col_name)
                 values = [r[col_idx] for r in rows if r[col_idx] not in (None, '')]
                 values = list(dict.fromkeys(values))
@@ -175,8 +178,6 @@ class Soft_Schema_linker(BaseAgent):
         header = sqldb.get_header()
         rows = sqldb.get_rows(table_name)
         row_count, schema = sqldb.get_table_schema(table_name)
-        pk_cols = sqldb.get_primary_keys(table_name)
-
         pk_cols = sqldb.get_primary_keys(table_name) if hasattr(sqldb, 'get_primary_keys') else []
 
         # Column Value Example Extraction
@@ -535,19 +536,20 @@ class Refiner(BaseAgent):
 
     def _execute_sql(self, sql: str, sqldb) -> dict:
         try:
-            result = func_timeout(30, sqldb.execute_query, args=(sql,))
+            result = sqldb.execute_query(sql, timeout=30)
+            # A failed query has no data, so its own error (not 'no data selected') reaches the repair and the refiner
+            if is_query_error(result):
+                return {
+                    "sql": str(sql),
+                    "sqlite_error": result["sqlite_error"],
+                    "exception_class": result["exception_class"]
+                }
             return {
                 "sql": str(sql),
                 "data": result["rows"],
                 "sqlite_error": result["sqlite_error"],
                 "exception_class": result["exception_class"]
             }
-        except FunctionTimedOut as te:
-            return {
-                "sql": str(sql),
-                "sqlite_error": str(te.args),
-                "exception_class": str(type(te).__name__)
-            }
         except Exception as e:
             return {
                 "sql": str(sql),
@@ -588,6 +590,17 @@ class Refiner(BaseAgent):
 
         return False
 
+    @staticmethod
+    def _repair_locally(sql: str, error_info: dict, sqldb) -> str | None:
+        """
+        A misspelled column or table name with one clear closest match in the schema is fixed without the LLM.
+        Returns the repaired SQL, or None when the error is of another kind or has no such fix.
+        """
+        sqlite_error = (error_info.get('sqlite_error') or '').lower()
+        if "no such column" not in sqlite_error and "no such table" not in sqlite_error:
+            return None
+        return sqldb.validate_query(sql).repaired_sql
+
     # No call?
     # def _value_retriver(self, target: str, db_id: str, db_content_dict: dict, related_schema: dict):
     #     inputs = target.strip('\'').strip('%')
@@ -723,12 +736,23 @@ class Refiner(BaseAgent):
 
         try_times = message.get('try_times', 0)
 
-        # Execute SQL
-        error_info = self._execute_sql(old_sql, sqldb)
-        # import ipdb; ipdb.set_trace()
-        # Determine whether refinement is needed
-        # import ipdb; ipdb.set_trace()
-        need_refine = self._is_need_refine(error_info, try_times)
+        # A refinement that returns a SQL already tried for this subquery (same fingerprint) would only repeat
+        # the same execution and the same refine prompt, so it ends the refinement. The SQL is judged by the
+        # result it had then, and a known failure is not accepted
+        fingerprint = sql_fingerprint(old_sql)
+        tried_sqls = message.setdefault('tried_sqls', {})
+        known_failure = False
+        if fingerprint in tried_sqls:
+            need_refine = False
+            known_failure = self._is_need_refine(dict(tried_sqls[fingerprint]), 0)
+        else:
+            # Execute SQL
+            error_info = self._execute_sql(old_sql, sqldb)
+            # import ipdb; ipdb.set_trace()
+            # Determine whether refinement is needed
+            # import ipdb; ipdb.set_trace()
+            need_refine = self._is_need_refine(error_info, try_times)
+            tried_sqls[fingerprint] = error_info
 
         if not need_refine:
             if " || ' ' || " in old_sql:
@@ -737,7 +761,10 @@ class Refiner(BaseAgent):
             # import ipdb; ipdb.set_trace()
             # print("Final predicted sql: ", old_sql)
             message['try_times'] = try_times + 1
-            message['pred'] = old_sql
+            if known_failure:
+                message.pop('pred', None)
+            else:
+                message['pred'] = old_sql
 
             if len(message['subquery_list']) == 1:
                 message['send_to'] = SYSTEM_NAME
@@ -746,23 +773,28 @@ class Refiner(BaseAgent):
                 message['subquery_list'].pop(0)
                 message['sub_sql'] = old_sql
                 message['try_times'] = 0
+                message['tried_sqls'] = {}
                 message.pop('pred', None)
                 message['send_to'] = GENERATOR_NAME
         else:
             # Refine the SQL
             # import ipdb; ipdb.set_trace()
-            new_sql, filter_error = self._refine(
-                sqldb=sqldb,
-                query=query,
-                evidence=evidence,
-                schema_info=schema_info,
-                pk_info=pk_info,
-                fk_info=fk_info,
-                column_details=column_details,
-                error_info=error_info,
-                complete_schema=complete_schema,
-                matched_content=matched_content
-            )
+            repaired_sql = self._repair_locally(old_sql, error_info, sqldb)
+            if repaired_sql is not None:
+                new_sql, filter_error = repaired_sql, False
+            else:
+                new_sql, filter_error = self._refine(
+                    sqldb=sqldb,
+                    query=query,
+                    evidence=evidence,
+                    schema_info=schema_info,
+                    pk_info=pk_info,
+                    fk_info=fk_info,
+                    column_details=column_details,
+                    error_info=error_info,
+                    complete_schema=complete_schema,
+                    matched_content=matched_content
+                )
 
             if filter_error:
                 message['desc_str'] = message['complete_desc_str']
@@ -1,12 +1,22 @@
 import sys
 import os
 import argparse
+from functools import partial
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Pool
 from tqdm import tqdm
 
 from utils.load_data import *
 from utils.myllm import MyChatGPT
+from utils.llm_cache import get_llm_cache, flush_llm_caches
+from utils.rate_limiter import get_rate_limiter
+from utils.http_clients import configure_http_pool, get_openai_client
+from utils.batch import run_batch_pipeline, LocalBatchSubmitter, OpenAIBatchSubmitter
+from utils.replay_llm import ReplayChatGPT, LatencyModel
 from utils.database import MYSQLDB
+from utils.normalizer import configure_str_normalize
+from utils.table_catalog import get_table_catalog
 from utils.helper import PipelineContext, AgentResult
 from utils.pipeline import agent_pipeline
 from utils.general_prompt import *
@@ -20,127 +30,251 @@ def evaluator(generated_answer: str, answer: str) -> bool:
 
 global_dataset = None
 global_data_process_func = None
+global_table_catalog = None
+global_db_cfg = {}
 
-def init_dataset():
-    global global_dataset, global_data_process_func
+def init_dataset(table_catalog=None, db_cfg=None):
+    global global_dataset, global_data_process_func, global_table_catalog, global_db_cfg
     global_dataset, global_data_process_func = load_hg_dataset("wikitq")
+    global_table_catalog = get_table_catalog(table_catalog) if table_catalog else None
+    global_db_cfg = db_cfg or {}
 
 def process_one_example_with_cfg(args):
-    i, model_name, api_key = args
-    return process_one_example(i, model_name, api_key)
+    i, model_name, api_key, llm_cfg, pipeline_cfg = args
+    return process_one_example(i, model_name, api_key, llm_cfg, pipeline_cfg)
 
-def process_one_example(i, model_name, api_key):
-    try:
-        global global_dataset, global_data_process_func
-
-        data = global_dataset["test"][i]
-        data_dict = global_data_process_func(data)
-        question = data_dict["question"]
-        standard_answer = ", ".join(data_dict["answer"])
-        tables = data_dict["tables"]
-        sqldb = MYSQLDB(tables=tables)
-
-        new_tables = sqldb.get_table_df()
-        new_title = sqldb.get_table_title()
-        table_dict = sqldb.get_table()
-
-        log = {
-                "sqls": [],
-                "s_answer": "",
-                "p_answer": "",
-                "valid": None,
-                "correct": None,
-            }
-
-        num_example_rows = 3
-        prompt_table = create_table_prompt(df = new_tables, title = new_title)
-        total_rows, prompt_rows = select_x_rows_prompt(full_table = False, df = new_tables, title = new_title, num_rows = num_example_rows)
-        prompt_schema = prompt_table + prompt_rows
-
-        my_llm = MyChatGPT(
+def build_llm(model_name, api_key, llm_cfg=None):
+    llm_cfg = llm_cfg or {}
+    cache_cfg = llm_cfg.get("cache")
+    cassette_cfg = llm_cfg.get("cassette")
+    if cassette_cfg:
+        latency = cassette_cfg.get("latency")
+        return ReplayChatGPT(
             model_name=model_name,
-            key=api_key
-        )
-        ctx = PipelineContext(
-            llm = my_llm,
-            sqldb = sqldb,
-            question = question,
-            prompt_schema = prompt_schema,
-            title = new_title,
-            previous_sql_query = None,
-            total_rows = total_rows,
-            log = log,
-            flag = None,
-            num_rows = num_example_rows,
-            llm_options = None,
-            debug = False,
-            strategy = "top",
-            extras = {}
+            cassette_path=cassette_cfg["path"],
+            mode=cassette_cfg["mode"],
+            key=api_key,
+            latency=LatencyModel(base=latency) if latency is not None else None,
+            cache=get_llm_cache(**cache_cfg) if cache_cfg else None
         )
+    return MyChatGPT(
+        model_name=model_name,
+        key=api_key,
+        cache=get_llm_cache(**cache_cfg) if cache_cfg else None,
+        rate_limiter=get_rate_limiter(**llm_cfg.get("rate_limit", {}))
+    )
 
-        valid_flag, answer_flag, sql_query, generated_answer, log = agent_pipeline(ctx, standard_answer)
-        if valid_flag:
-            log["valid"] = True
-            predicted_answer = generated_answer
-        else:
-            log["valid"] = False
-            if not answer_flag:
-                analysis, predicted_answer = chainofthought_answer_agent(
-                    llm = my_llm, question = question, table_dict = table_dict, debug = False
-                )
-            else:
-                predicted_answer = generated_answer
-
-        log["p_answer"] = predicted_answer
-        log["s_answer"] = standard_answer
-
-        if answer_flag:
+def prepare_example(i, llm, pipeline_cfg=None) -> tuple[PipelineContext, str, dict]:
+    global global_dataset, global_data_process_func
+
+    data = global_dataset["test"][i]
+    data_dict = global_data_process_func(data)
+    question = data_dict["question"]
+    standard_answer = ", ".join(data_dict["answer"])
+    tables = data_dict["tables"]
+    if global_table_catalog is not None:
+        sqldb = MYSQLDB.from_catalog(global_table_catalog, tables, **global_db_cfg)
+    else:
+        sqldb = MYSQLDB(tables=tables, **global_db_cfg)
+
+    new_tables = sqldb.get_table_df()
+    new_title = sqldb.get_table_title()
+    table_dict = sqldb.get_table()
+
+    log = {
+            "sqls": [],
+            "s_answer": "",
+            "p_answer": "",
+            "valid": None,
+            "correct": None,
+        }
+
+    num_example_rows = 3
+    prompt_table = sqldb.get_create_table_prompt()
+    total_rows, prompt_rows = select_x_rows_prompt(full_table = False, df = new_tables, title = new_title, num_rows = num_example_rows)
+    prompt_schema = prompt_table + prompt_rows
+
+    ctx = PipelineContext(
+        llm = llm,
+        sqldb = sqldb,
+        question = question,
+        prompt_schema = prompt_schema,
+        title = new_title,
+        previous_sql_query = None,
+        total_rows = total_rows,
+        log = log,
+        flag = None,
+        num_rows = num_example_rows,
+        llm_options = None,
+        debug = False,
+        strategy = "top",
+        extras = {},
+        **(pipeline_cfg or {})
+    )
+    return ctx, standard_answer, table_dict
+
+def finish_example(ctx: PipelineContext, log: dict, valid_flag: bool, answer_flag: bool, predicted_answer: str, standard_answer: str) -> dict:
+    log["valid"] = valid_flag
+    log["p_answer"] = predicted_answer
+    log["s_answer"] = standard_answer
+
+    if answer_flag:
+        log["correct"] = True
+    else:
+        if evaluator(predicted_answer, standard_answer):
             log["correct"] = True
         else:
-            if evaluator(predicted_answer, standard_answer):
-                log["correct"] = True
-            else:
-                log["correct"] = False
+            log["correct"] = False
 
-        sqldb.close()
-        del sqldb
+    return {
+        "correct": log["correct"],
+        "valid": log["valid"],
+    }
 
+def run_example(i, my_llm, pipeline_cfg=None) -> dict:
+    ctx, standard_answer, table_dict = prepare_example(i, my_llm, pipeline_cfg)
+    # Also closes the database when a batch run suspends the sample (PendingLLMCall is not an Exception)
+    try:
+        valid_flag, answer_flag, sql_query, generated_answer, log = agent_pipeline(ctx, standard_answer)
+        predicted_answer = generated_answer
+        if not valid_flag and not answer_flag:
+            analysis, predicted_answer = chainofthought_answer_agent(
+                llm = my_llm, question = ctx.question, table_dict = table_dict, debug = False
+            )
+
+        return finish_example(ctx, log, valid_flag, answer_flag, predicted_answer, standard_answer)
+    finally:
+        ctx.sqldb.close()
+
+def run_example_safe(i, my_llm, pipeline_cfg=None) -> dict:
+    try:
+        return run_example(i, my_llm, pipeline_cfg)
+    except Exception as e:
+        print(f"[Error] Sample {i} failed: {e}", flush=True)
         return {
-            "correct": log["correct"],
-            "valid": log["valid"],
+            "correct": False,
+            "valid": False,
         }
+
+def process_one_example(i, model_name, api_key, llm_cfg=None, pipeline_cfg=None):
+    try:
+        my_llm = build_llm(model_name, api_key, llm_cfg)
+        return run_example(i, my_llm, pipeline_cfg)
     except Exception as e:
         print(f"[Error] Sample {i} failed: {e}", flush=True)
         return {
             "correct": False,
             "valid": False,
         }
+    finally:
+        flush_llm_caches()
+
+async def process_one_example_async(i, my_llm: MyChatGPT, semaphore: asyncio.Semaphore, pipeline_cfg=None):
+    async with semaphore:
+        # The whole sample (ingestion, queries and LLM calls) runs in the default executor, off the event loop
+        return await asyncio.to_thread(run_example_safe, i, my_llm, pipeline_cfg)
+
+async def run_async(indices: list, model_name: str, api_key: str, llm_cfg: dict, concurrency: int, pipeline_cfg: dict = None) -> list:
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    my_llm = build_llm(model_name, api_key, llm_cfg)
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [process_one_example_async(i, my_llm, semaphore, pipeline_cfg) for i in indices]
+    results = []
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+        results.append(await task)
+    return results
+
+def run_batch(indices: list, model_name: str, api_key: str, llm_cfg: dict, batch_dir: str, submitter: str, poll_interval: float,
+              pipeline_cfg: dict = None) -> list:
+    if submitter == "openai":
+        batch_submitter = OpenAIBatchSubmitter(get_openai_client(api_key), poll_interval=poll_interval)
+    else:
+        batch_submitter = LocalBatchSubmitter(build_llm(model_name, api_key, llm_cfg))
+    run_sample = partial(run_example_safe, pipeline_cfg=pipeline_cfg)
+    return run_batch_pipeline(indices, model_name, run_sample, batch_submitter, batch_dir)
 
 def main():
     parser = argparse.ArgumentParser(description="Run Chain-of-Query experiments.")
     parser.add_argument("--model", type=str, help="Model name")
     parser.add_argument("--num_samples", type=int, help="Number of test samples")
+    parser.add_argument("--mode", type=str, default="pool", choices=["pool", "async", "batch"], help="Run samples in a process pool, concurrently from one asyncio process, or stage by stage through batch submissions")
+    parser.add_argument("--concurrency", type=int, default=128, help="Maximum number of samples in flight in async mode")
+    parser.add_argument("--batch_dir", type=str, default="tmp/batch", help="Directory holding batch files and per-sample state in batch mode; rerun with the same directory to resume")
+    parser.add_argument("--batch_submitter", type=str, default="openai", choices=["openai", "local"], help="Submit batches to the OpenAI Batch API, or execute them locally with the configured llm (e.g. a cassette)")
+    parser.add_argument("--batch_poll_interval", type=float, default=30.0, help="Seconds between batch status polls")
+    parser.add_argument("--speculative", action="store_true", help="Check both candidate SQLs of the Basic agent for sufficiency concurrently")
+    parser.add_argument("--fused_answer", action="store_true", help="Decide sufficiency and answer in a single LLM call")
+    parser.add_argument("--static_check", action="store_true", help="Check generated SQL against the table schema before running it and repair misspelled names locally")
+    parser.add_argument("--result_max_rows", type=int, default=None, help="Show the sufficiency and answer agents at most this many result rows, the first and last ones (default: all)")
+    parser.add_argument("--result_max_tokens", type=int, default=None, help="Token budget of the result table shown to the sufficiency and answer agents (default: none)")
+    parser.add_argument("--table_catalog", type=str, default=None, help="Directory of prebuilt tables; each distinct table is ingested once and reused across questions and runs")
+    parser.add_argument("--typed_ingestion", action="store_true", help="Also store numeric and date columns as typed shadow columns (<column>__num, <column>__date)")
+    parser.add_argument("--create_indexes", action="store_true", help="Index key-like and low-cardinality columns of large tables")
+    parser.add_argument("--normalize_cells", action="store_true", help="Normalize numbers and dates in table cells at ingestion")
+    parser.add_argument("--normalize_workers", type=int, default=1, help="Processes normalizing the cells of large tables in async and batch modes")
+    parser.add_argument("--http_max_connections", type=int, default=None, help="Connection pool size of the shared HTTP client per process")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests-per-minute quota shared by all workers")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens-per-minute quota shared by all workers")
+    parser.add_argument("--cassette", type=str, default=None, help="JSONL cassette to record LLM responses to or replay them from")
+    parser.add_argument("--cassette_mode", type=str, default="replay", choices=["replay", "record", "auto"], help="Replay the cassette offline, or record it from the API")
+    parser.add_argument("--replay_latency", type=float, default=None, help="Synthetic base latency in seconds for replayed responses")
+    parser.add_argument("--cache_path", type=str, default=None, help="SQLite file for caching LLM responses across runs")
+    parser.add_argument("--cache_max_mb", type=int, default=1024, help="Size budget of the LLM response cache in MB")
+    parser.add_argument("--cache_bypass", action="store_true", help="Ignore cached responses but refresh the cache")
     args = parser.parse_args()
 
     api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
+    if not api_key and not (args.cassette and args.cassette_mode == "replay"):
         raise ValueError("No API key found. Please set OPENAI_API_KEY in your environment.")
 
+    configure_http_pool(max_connections=args.http_max_connections)
     indices = list(range(args.num_samples))
-    cfg_iter = ((i, args.model, api_key) for i in indices)
-    results = []
-    with Pool(processes=8, initializer=init_dataset) as pool:
-        for res in tqdm(
-            pool.imap_unordered(process_one_example_with_cfg, cfg_iter),
-            total=len(indices),
-        ):
-            results.append(res)
+    cache_cfg = None
+    if args.cache_path:
+        cache_cfg = {
+            "path": args.cache_path,
+            "max_bytes": args.cache_max_mb * 1024 * 1024,
+            "bypass": args.cache_bypass,
+        }
+        get_llm_cache(**cache_cfg).reset_counters()
+    llm_cfg = {
+        "cache": cache_cfg,
+        "rate_limit": {"requests_per_minute": args.rpm, "tokens_per_minute": args.tpm},
+    }
+    if args.cassette:
+        llm_cfg["cassette"] = {"path": args.cassette, "mode": args.cassette_mode, "latency": args.replay_latency}
+    pipeline_cfg = {"speculative": args.speculative, "fused_answer": args.fused_answer, "static_check": args.static_check,
+                    "result_max_rows": args.result_max_rows, "result_max_tokens": args.result_max_tokens}
+    db_cfg = {"typed": args.typed_ingestion, "create_indexes": args.create_indexes, "normalize_cells": args.normalize_cells}
+    configure_str_normalize(num_workers=args.normalize_workers)
+    if args.mode == "batch":
+        # Every stage replays each unfinished sample from the start, so keep its ingested tables between stages
+        init_dataset(args.table_catalog or os.path.join(args.batch_dir, "tables"), db_cfg)
+    elif args.mode != "pool":
+        init_dataset(args.table_catalog, db_cfg)
+    if args.mode == "async":
+        results = asyncio.run(run_async(indices, args.model, api_key, llm_cfg, args.concurrency, pipeline_cfg))
+    elif args.mode == "batch":
+        results = run_batch(indices, args.model, api_key, llm_cfg, args.batch_dir, args.batch_submitter, args.batch_poll_interval, pipeline_cfg)
+    else:
+        cfg_iter = ((i, args.model, api_key, llm_cfg, pipeline_cfg) for i in indices)
+        results = []
+        with Pool(processes=8, initializer=init_dataset, initargs=(args.table_catalog, db_cfg)) as pool:
+            for res in tqdm(
+                pool.imap_unordered(process_one_example_with_cfg, cfg_iter),
+                total=len(indices),
+            ):
+                results.append(res)
 
     correct_count = sum(r["correct"] for r in results)
     invalid_sql = sum(not r["valid"] for r in results)
 
     print("Chain-of-Query:", correct_count, flush=True)
     print("Invalid:", invalid_sql, flush=True)
+    if cache_cfg:
+        stats = get_llm_cache(**cache_cfg).stats()
+        print("LLM cache:", f"{stats['total_hits']} hits, {stats['total_misses']} misses, {stats['entries']} entries", flush=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -11,6 +11,9 @@ from chain.utils.chain import *
 from chain.operations import *
 from chain.utils.llm import MyChatGPT
 from utils.load_data import *
+from utils.rate_limiter import get_rate_limiter
+from utils.http_clients import get_openai_client
+from utils.replay_llm import CassetteClient, LatencyModel, get_cassette
 
 def chain_evaluator_wiki(generated_answer: str, answer: str) -> bool:
     if generated_answer.lower() == answer.lower():
@@ -23,10 +26,21 @@ def init_dataset():
     global_dataset, global_data_process_func = load_hg_dataset("wikitq")
 
 def process_one_example_with_cfg(args):
-    i, model_name, api_key = args
-    return process_one_example(i, model_name, api_key)
+    i, model_name, api_key, rate_limit_cfg, cassette_cfg = args
+    return process_one_example(i, model_name, api_key, rate_limit_cfg, cassette_cfg)
 
-def process_one_example(i, model_name, api_key):
+def build_client(api_key, cassette_cfg=None):
+    if not cassette_cfg:
+        return None
+    latency = cassette_cfg.get("latency")
+    return CassetteClient(
+        get_cassette(cassette_cfg["path"]),
+        mode=cassette_cfg["mode"],
+        inner=get_openai_client(api_key) if cassette_cfg["mode"] != "replay" else None,
+        latency=LatencyModel(base=latency) if latency is not None else None
+    )
+
+def process_one_example(i, model_name, api_key, rate_limit_cfg=None, cassette_cfg=None):
     try:
         global global_dataset, global_data_process_func
         data = global_dataset["test"][i]
@@ -37,7 +51,9 @@ def process_one_example(i, model_name, api_key):
         table_text = [data_dict["tables"][0]["table"]["header"]] + data_dict["tables"][0]["table"]["rows"]
         my_llm = MyChatGPT(
             model_name=model_name,
-            key=api_key
+            key=api_key,
+            rate_limiter=get_rate_limiter(**(rate_limit_cfg or {})),
+            client=build_client(api_key, cassette_cfg)
         )
         sample = {
             "statement": statement,
@@ -84,14 +100,23 @@ def main():
     parser = argparse.ArgumentParser(description="Run Chain-of-Table experiments.")
     parser.add_argument("--model", type=str, help="Model name")
     parser.add_argument("--num_samples", type=int, help="Number of test samples")
+    parser.add_argument("--cassette", type=str, default=None, help="JSONL cassette to record LLM responses to or replay them from")
+    parser.add_argument("--cassette_mode", type=str, default="replay", choices=["replay", "record", "auto"], help="Replay the cassette offline, or record it from the API")
+    parser.add_argument("--replay_latency", type=float, default=None, help="Synthetic base latency in seconds for replayed responses")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests-per-minute quota shared by all workers")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens-per-minute quota shared by all workers")
     args = parser.parse_args()
 
     api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
+    if not api_key and not (args.cassette and args.cassette_mode == "replay"):
         raise ValueError("No API key found. Please set OPENAI_API_KEY in your environment.")
 
     indices = list(range(args.num_samples))
-    cfg_iter = ((i, args.model, api_key) for i in indices)
+    rate_limit_cfg = {"requests_per_minute": args.rpm, "tokens_per_minute": args.tpm}
+    cassette_cfg = None
+    if args.cassette:
+        cassette_cfg = {"path": args.cassette, "mode": args.cassette_mode, "latency": args.replay_latency}
+    cfg_iter = ((i, args.model, api_key, rate_limit_cfg, cassette_cfg) for i in indices)
     results = []
 
     with Pool(processes=8, initializer=init_dataset) as pool:
@@ -11,6 +11,8 @@ import traceback
 from magsql.main_scripts.chat_manager import ChatManager
 from magsql.main_scripts.const import SYSTEM_NAME
 from utils.myllm import MyChatGPT
+from utils.replay_llm import ReplayChatGPT, LatencyModel
+from utils.rate_limiter import get_rate_limiter
 from utils.database import MYSQLDB
 from utils.load_data import *
 from utils.reasoner import sql_answer_agent, baseline_answer_agent
@@ -29,10 +31,10 @@ def init_dataset():
     global_dataset, global_data_process_func = load_hg_dataset("wikitq")
 
 def process_one_example_with_cfg(args):
-    i, model_name, api_key = args
-    return process_one_example(i, model_name, api_key)
+    i, model_name, api_key, rate_limit_cfg, cassette_cfg = args
+    return process_one_example(i, model_name, api_key, rate_limit_cfg, cassette_cfg)
 
-def process_one_example(i, model_name, api_key):
+def process_one_example(i, model_name, api_key, rate_limit_cfg=None, cassette_cfg=None):
     global global_dataset, global_data_process_func
 
     data = global_dataset["test"][i]
@@ -48,10 +50,21 @@ def process_one_example(i, model_name, api_key):
         tables = data_dict["tables"]
         sqldb = MYSQLDB(tables=tables)
 
-        my_llm = MyChatGPT(
-            model_name=model_name,
-            key=api_key
-        )
+        if cassette_cfg:
+            latency = cassette_cfg.get("latency")
+            my_llm = ReplayChatGPT(
+                model_name=model_name,
+                cassette_path=cassette_cfg["path"],
+                mode=cassette_cfg["mode"],
+                key=api_key,
+                latency=LatencyModel(base=latency) if latency is not None else None
+            )
+        else:
+            my_llm = MyChatGPT(
+                model_name=model_name,
+                key=api_key,
+                rate_limiter=get_rate_limiter(**(rate_limit_cfg or {}))
+            )
 
         new_title = sqldb.get_table_title()
         table_dict = sqldb.get_table()
@@ -121,14 +134,23 @@ def main():
     parser = argparse.ArgumentParser(description="Run MAG-SQL experiments.")
     parser.add_argument("--model", type=str, help="Model name")
     parser.add_argument("--num_samples", type=int, help="Number of test samples")
+    parser.add_argument("--cassette", type=str, default=None, help="JSONL cassette to record LLM responses to or replay them from")
+    parser.add_argument("--cassette_mode", type=str, default="replay", choices=["replay", "record", "auto"], help="Replay the cassette offline, or record it from the API")
+    parser.add_argument("--replay_latency", type=float, default=None, help="Synthetic base latency in seconds for replayed responses")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests-per-minute quota shared by all workers")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens-per-minute quota shared by all workers")
     args = parser.parse_args()
 
     api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
+    if not api_key and not (args.cassette and args.cassette_mode == "replay"):
         raise ValueError("No API key found. Please set OPENAI_API_KEY in your environment.")
 
     indices = list(range(args.num_samples))
-    cfg_iter = ((i, args.model, api_key) for i in indices)
+    rate_limit_cfg = {"requests_per_minute": args.rpm, "tokens_per_minute": args.tpm}
+    cassette_cfg = None
+    if args.cassette:
+        cassette_cfg = {"path": args.cassette, "mode": args.cassette_mode, "latency": args.replay_latency}
+    cfg_iter = ((i, args.model, api_key, rate_limit_cfg, cassette_cfg) for i in indices)
     results = []
 
     with Pool(processes=8, initializer=init_dataset) as pool:
@@ -0,0 +1,222 @@
+import os
+import io
+import json
+import time
+from typing import Callable
+from utils.llm_cache import make_cache_key
+from utils.myllm import MyChatGPT
+from utils.replay_llm import Cassette
+
+class PendingLLMCall(BaseException):
+    '''
+    Raised by BatchChatGPT when a sample needs a response that has not been produced yet.
+    It derives from BaseException so that the `except Exception` blocks in the agents and the
+    pipeline let it through and the sample is suspended rather than marked as failed.
+    '''
+    pass
+
+class _NoClient(object):
+    '''
+    Placeholder client; BatchChatGPT never sends requests itself.
+    '''
+    pass
+
+class BatchChatGPT(MyChatGPT):
+    '''
+    MyChatGPT that answers from a response store and, on a miss, records the request and suspends the sample.
+    '''
+    def __init__(self, model_name: str, store: Cassette):
+        super().__init__(model_name, key=None, client=_NoClient())
+        self.store = store
+        self.pending = {}
+
+    def _request(self, messages: list, options: dict, end_str: str = None) -> list:
+        key = make_cache_key(self.model_name, messages, end_str, options, seed = 42)
+        entry = self.store.get(key)
+        if entry is None:
+            self.pending[key] = {
+                "custom_id": key,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": dict(model=self.model_name, seed=42, messages=messages, stop=end_str, **options),
+            }
+            raise PendingLLMCall(key)
+        if entry.get("error"):
+            raise Exception(entry["error"])
+        return [(content, None) for content in entry["responses"]]
+
+class BatchSubmitter(object):
+    '''
+    Turns a JSONL file of Batch-API requests into results: one dict per request with
+    `custom_id` plus either `responses` (list of message contents) or `error`.
+    '''
+    def submit(self, batch_path: str) -> list[dict]:
+        raise NotImplementedError
+
+class LocalBatchSubmitter(BatchSubmitter):
+    '''
+    Executes a batch locally through an llm's request path, e.g. a MyChatGPT for small runs,
+    or a ReplayChatGPT to exercise batch mode offline.
+    '''
+    def __init__(self, llm: MyChatGPT):
+        self.llm = llm
+
+    def submit(self, batch_path: str) -> list[dict]:
+        results = []
+        with open(batch_path, "r", encoding="utf-8") as f:
+            for line in f:
+                request = json.loads(line)
+                body = dict(request["body"])
+                messages = body.pop("messages")
+                end_str = body.pop("stop", None)
+                body.pop("model", None)
+                body.pop("seed", None)
+                try:
+                    responses = [content for content, _ in self.llm._request(messages, body, end_str)]
+                    results.append({"custom_id": request["custom_id"], "responses": responses})
+                except Exception as e:
+                    results.append({"custom_id": request["custom_id"], "error": str(e)})
+        return results
+
+class OpenAIBatchSubmitter(BatchSubmitter):
+    '''
+    Submits through the OpenAI Batch API and polls until the batch finishes.
+    The batch id is written next to the batch file, so a restarted run resumes polling instead of resubmitting.
+    '''
+    def __init__(self, client, poll_interval: float = 30.0, completion_window: str = "24h"):
+        self.client = client
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+
+    def submit(self, batch_path: str) -> list[dict]:
+        id_path = batch_path + ".id"
+        if os.path.exists(id_path):
+            with open(id_path, "r", encoding="utf-8") as f:
+                batch_id = f.read().strip()
+        else:
+            with open(batch_path, "rb") as f:
+                input_file = self.client.files.create(file=f, purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window=self.completion_window,
+            )
+            batch_id = batch.id
+            with open(id_path, "w", encoding="utf-8") as f:
+                f.write(batch_id)
+
+        batch = self.client.batches.retrieve(batch_id)
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch_id)
+        if batch.status != "completed" and not batch.output_file_id and not batch.error_file_id:
+            # Nothing to resume; a rerun submits the batch file again
+            os.remove(id_path)
+            raise RuntimeError(f"Batch {batch_id} ended {batch.status} without results: {getattr(batch, 'errors', None)}")
+
+        results = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = self.client.files.content(file_id).text
+            for line in io.StringIO(content):
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    results.append({"custom_id": item["custom_id"], "error": str(item.get("error") or response.get("body"))})
+                else:
+                    choices = response["body"]["choices"]
+                    results.append({"custom_id": item["custom_id"], "responses": [c["message"]["content"] for c in choices]})
+        return results
+
+def _read_batch(batch_path: str) -> dict:
+    requests = {}
+    with open(batch_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                request = json.loads(line)
+                requests[request["custom_id"]] = request
+    return requests
+
+def _resume_stage(batch_dir: str, store: Cassette) -> int:
+    '''
+    The last stage when none of its requests has a result in the store yet (its batch may still be running and
+    is picked up again through the saved batch id), otherwise the next stage number.
+    '''
+    stages = [int(name[len("stage_"):-len(".jsonl")]) for name in os.listdir(batch_dir)
+              if name.startswith("stage_") and name.endswith(".jsonl")]
+    if not stages:
+        return 0
+    last = max(stages)
+    requests = _read_batch(os.path.join(batch_dir, f"stage_{last}.jsonl"))
+    if requests and not any(store.get(key) is not None for key in requests):
+        return last
+    return last + 1
+
+def run_batch_pipeline(indices: list, model_name: str, run_sample: Callable[[int, MyChatGPT], dict],
+                       submitter: BatchSubmitter, state_dir: str, verbose: bool = True) -> list[dict]:
+    '''
+    Advances all samples one LLM stage at a time.
+    Each round re-runs every unfinished sample against the response store; a sample runs until it needs a
+    response that is not there yet, which is collected into that round's batch. When the batch results land
+    they are appended to the store and the next round resumes every sample one step further.
+    Sample state is the store (`responses.jsonl`) plus the finished results (`results.json`), so an
+    interrupted run picks up where it stopped, resubmitting nothing: a stage without results reuses its batch file.
+    A request the batch returned no result for is stored as an error, so its sample fails instead of being retried forever.
+    Replaying a sample repeats its local work every round: table ingestion, which run_sample should take from a
+    `TableCatalog` so it happens once, and the SQL queries, which are cheap next to an LLM stage.
+    - run_sample: Runs one sample end to end with the given llm and returns its result dict. It must release what it
+      opened (e.g. close its MYSQLDB in a `finally`) since a suspended sample leaves it through PendingLLMCall.
+    '''
+    batch_dir = os.path.join(state_dir, "batches")
+    os.makedirs(batch_dir, exist_ok=True)
+    store = Cassette(os.path.join(state_dir, "responses.jsonl"))
+    results_path = os.path.join(state_dir, "results.json")
+    finished = {}
+    if os.path.exists(results_path):
+        with open(results_path, "r", encoding="utf-8") as f:
+            finished = {int(k): v for k, v in json.load(f).items()}
+
+    stage = _resume_stage(batch_dir, store)
+    while True:
+        pending = {}
+        for i in indices:
+            if i in finished:
+                continue
+            llm = BatchChatGPT(model_name, store)
+            try:
+                finished[i] = run_sample(i, llm)
+            except PendingLLMCall:
+                pending.update(llm.pending)
+        with open(results_path, "w", encoding="utf-8") as f:
+            json.dump(finished, f)
+        if not pending:
+            break
+
+        batch_path = os.path.join(batch_dir, f"stage_{stage}.jsonl")
+        if not os.path.exists(batch_path):
+            with open(batch_path + ".tmp", "w", encoding="utf-8") as f:
+                for request in pending.values():
+                    f.write(json.dumps(request, ensure_ascii=False) + "\n")
+            os.replace(batch_path + ".tmp", batch_path)
+        requests = _read_batch(batch_path)
+        if verbose:
+            print(f"[Batch] Stage {stage}: {len(requests)} requests, {len(finished)}/{len(indices)} samples finished", flush=True)
+
+        results = {result["custom_id"]: result for result in submitter.submit(batch_path)}
+        for key, request in requests.items():
+            result = results.get(key, {"error": f"No result for this request in {batch_path}"})
+            body = request["body"]
+            store.put({
+                "key": key,
+                "model": body["model"],
+                "messages": body["messages"],
+                "stop": body.get("stop"),
+                "responses": result.get("responses"),
+                "error": result.get("error"),
+            })
+        stage += 1
+
+    return [finished[i] for i in indices]
@@ -7,8 +7,17 @@ from typing import Dict, List
 import uuid
 import re
 import threading
-from utils.normalizer import convert_df_type, prepare_df_for_mysqldb_from_table
+import time
+from collections import deque
+from contextlib import contextmanager
+from utils.normalizer import convert_df_type, prepare_df_for_mysqldb_from_table, add_typed_columns
+from utils.sql.process_sql import Schema
+from utils.sql.validator import validate_sql, SQLDiagnostic
+from utils.sql.tokens import tokenize_sql
+from utils.sql.canonical import sql_fingerprint
+from utils.table_render import create_table
 from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.pool import StaticPool
 
 def fix_duplicate_columns(df: pd.DataFrame) -> pd.DataFrame:
     cols = pd.Series(df.columns)
@@ -28,6 +37,79 @@ def check_in_and_return(key: str, source: dict):
             return _v
     raise ValueError(f"'{key}' not found in the provided dictionary.")
 
+# Results that come from running the query (not errors, whose messages quote the query); their rows are shared
+_row_result_classes = ("", "No Row Warning", "Empty Result Warning", "Missing Header Warning")
+# Rows are shared between spellings only for queries slower than this (seconds). Finding the spelling of a query
+# (`sql_fingerprint`) takes about 0.1 ms, more than running most queries on a WikiTQ table
+shared_rows_min_seconds = 0.002
+
+# The first keyword of a statement, after any whitespace and comments
+_sql_head_pattern = re.compile(r"(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)*(\w*)", re.DOTALL)
+# Keywords of statements that write (REPLACE followed by "(" is the string function). Matched on the raw text, so a
+# WITH query mentioning one anywhere, even in a string, is taken for a write: it is not cached and clears the caches
+_sql_write_pattern = re.compile(r"\b(INSERT|UPDATE|DELETE|CREATE|DROP|ALTER)\b|\bREPLACE\b(?!\s*\()", re.IGNORECASE)
+
+def _is_read_only(sql_query: str) -> bool:
+    head = _sql_head_pattern.match(sql_query).group(1).upper()
+    return head == "SELECT" or (head == "WITH" and not _sql_write_pattern.search(sql_query))
+
+def _limit_zero_sql(sql_query: str) -> str | None:
+    '''
+    `sql_query` with its top-level LIMIT clause (the last clause of a SELECT) replaced by LIMIT 0, or LIMIT 0 added.
+    The statement keeps its select list, so SQLite names the columns as for `sql_query`.
+    None when the text is not a single statement.
+    '''
+    tokens = tokenize_sql(sql_query)
+    # sqlite3 takes one final ";"; a second one is another (empty) statement, which it rejects
+    if tokens and tokens[-1][:2] == ("op", ";"):
+        tokens.pop()
+    if not tokens:
+        return None
+    depth, end = 0, tokens[-1][3]
+    for kind, value, start, _ in tokens:
+        if kind == "error" or (kind, value) == ("op", ";"):
+            return None
+        if (kind, value) == ("op", "("):
+            depth += 1
+        elif (kind, value) == ("op", ")"):
+            depth -= 1
+        elif depth == 0 and (kind, value) == ("keyword", "limit"):
+            end = start
+    return sql_query[:end].rstrip() + " LIMIT 0"
+
+def is_query_error(result: dict) -> bool:
+    '''
+    Whether an `execute_query` result reports a failed query, as opposed to rows or a warning about them.
+    '''
+    return result["exception_class"] not in _row_result_classes
+
+# exception_class of queries stopped by their budget
+QUERY_TIMEOUT = "QueryTimeout"
+QUERY_STEP_LIMIT = "QueryStepLimit"
+# SQLite VM instructions between two budget checks
+_progress_interval = 1000
+
+# Smaller tables are scanned faster than an index is built
+_index_min_rows = 1000
+
+def _split_head_tail(max_rows: int) -> tuple[int, int]:
+    tail_rows = max_rows // 2
+    return max_rows - tail_rows, tail_rows
+
+def quote_identifier(name: str) -> str:
+    return '"{}"'.format(str(name).replace('"', '""'))
+
+def _sqlite_column_type(column: pd.Series) -> str:
+    # Same affinities as pandas' to_sql picks for a new SQLite column
+    inferred = pd.api.types.infer_dtype(column, skipna=True)
+    if inferred in ("integer", "boolean"):
+        return "INTEGER"
+    if inferred in ("floating", "mixed-integer-float", "decimal"):
+        return "REAL"
+    if inferred in ("datetime", "datetime64"):
+        return "TIMESTAMP"
+    return "TEXT"
+
 def make_sqlite_friendly(name: str):
     if not name:
         return "_unnamed"
@@ -35,36 +117,133 @@ def make_sqlite_friendly(name: str):
     return name if not name[0].isdigit() else '_' + name
 
 class MYSQLDB(object):
-    def __init__(self, tables: List[Dict[str, Dict]]):
+    '''
+    SQLite database holding the tables of one sample.
+    - storage: "memory" (default) keeps the database in memory for the lifetime of the instance;
+      "file" writes it to tmp/<uuid>.db, which can be opened while debugging and is removed on close.
+    - query_engine: "sqlite3" (default) runs `execute_query` directly on the sqlite3 connection;
+      "records" goes through records/SQLAlchemy as before.
+    - result_cache: Reuse the results of read-only queries until the next write. A repeated query is answered
+      from the cache; a query with the same `sql_fingerprint` in another spelling (e.g. whitespace, keyword case or
+      name quoting) as one that took `shared_rows_min_seconds` or more reuses the rows, with the header SQLite gives
+      its own select list. Returned results are shared, so treat them as read-only.
+    - query_timeout / query_max_steps: Default wall-clock (seconds) and SQLite VM-step budgets of every statement.
+      A statement over budget is interrupted and reported with exception_class QUERY_TIMEOUT / QUERY_STEP_LIMIT.
+      The budgets are enforced on the sqlite3 connection, which the "records" engine only shares in memory storage.
+    - typed: Also store numeric and date columns as typed shadow columns (<column>__num, <column>__date),
+      see `add_typed_columns`. The text columns are kept as they are.
+    - create_indexes: Index key-like and low-cardinality columns of tables with at least `_index_min_rows` rows.
+    - normalize_cells: Normalize numbers and dates in the cells with `str_normalize` (e.g. "march 3, 2001" -> "2001-3-3").
+    Table metadata (columns, types, row count, primary keys, CREATE TABLE prompt, the `Schema` of `validate_query`)
+    is cached until the next write.
+    '''
+    def __init__(self, tables: List[Dict[str, Dict]], storage: str = "memory", query_engine: str = "sqlite3",
+                 result_cache: bool = True, query_timeout: float = 30.0, query_max_steps: int = None,
+                 typed: bool = False, create_indexes: bool = False, normalize_cells: bool = False):
+        self._setup(storage, query_engine, result_cache, query_timeout, query_max_steps)
         self.raw_tables = copy.deepcopy(tables)
         for table_info in tables:
             table_info['table'] = prepare_df_for_mysqldb_from_table(
-                table_info['table'], normalize=True, add_row_id=False
+                table_info['table'], normalize=True, add_row_id=False, normalize_cells=normalize_cells
             )
         self.tables = tables
-        self.tmp_path = "tmp"
-        os.makedirs(self.tmp_path, exist_ok=True)
-        self.db_path = os.path.join(self.tmp_path, '{}.db'.format(uuid.uuid4()))
-        self.sqlite_conn = sqlite3.connect(self.db_path)
+        if storage == "file":
+            self.tmp_path = "tmp"
+            os.makedirs(self.tmp_path, exist_ok=True)
+            self.db_path = os.path.join(self.tmp_path, '{}.db'.format(uuid.uuid4()))
+            self.sqlite_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        else:
+            self.db_path = None
+            self.sqlite_conn = sqlite3.connect(":memory:", check_same_thread=False)
         assert len(tables) >= 1, "Database must contain at least one table."
         self.table_names, self.table_dict = [], {}
         for table in tables:
             new_column_names = [make_sqlite_friendly(name) for name in table["table"].columns.tolist()]
             table["table"].rename(columns=dict(zip(table["table"].columns.tolist(), new_column_names)), inplace=True)
             table["table"] = fix_duplicate_columns(table["table"])
+            if typed:
+                table["table"] = add_typed_columns(table["table"])
             table_title = table.get('title', None)
             table_name = make_sqlite_friendly(table_title) if table_title else 'table_name'
             try:
                 table["table"].to_sql(table_name, self.sqlite_conn)
             except Exception as e:
                 print(f"Error storing table '{table_name}': {e}")
+            if create_indexes:
+                self._create_indexes(table_name, table["table"])
             self.table_names.append(table_name)
             self.table_dict[table_name] = table["table"]
-        self.db = records.Database('sqlite:///{}'.format(self.db_path))
+        self._open_records()
+
+    def _create_indexes(self, table_name: str, df: pd.DataFrame):
+        if len(df) < _index_min_rows:
+            return
+        for column in df.columns:
+            num_distinct = df[column].nunique(dropna=True)
+            num_present = int(df[column].notna().sum())
+            key_like = num_present > 0 and num_distinct == num_present
+            low_cardinality = num_distinct <= len(df) // 20
+            if key_like or low_cardinality:
+                index_name = quote_identifier(f"idx_{table_name}_{column}")
+                self.sqlite_conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {quote_identifier(table_name)} ({quote_identifier(column)})")
+        self.sqlite_conn.commit()
+
+    def _setup(self, storage: str, query_engine: str, result_cache: bool, query_timeout: float, query_max_steps: int):
+        if storage not in ("memory", "file"):
+            raise ValueError(f"Invalid storage '{storage}'. Supported storages: memory, file")
+        if query_engine not in ("sqlite3", "records"):
+            raise ValueError(f"Invalid query engine '{query_engine}'. Supported engines: sqlite3, records")
+        self._closed = True
+        self.storage = storage
+        self.query_engine = query_engine
+        self.result_cache = result_cache
+        self._result_cache = {}
+        self._shared_rows = {}
+        self.result_cache_hits = 0
+        self.result_cache_misses = 0
+        self.query_timeout = query_timeout
+        self.query_max_steps = query_max_steps
+        self._metadata = {}
+        self._sql_schema = None
+
+    def _open_records(self):
+        if self.storage == "file":
+            self.db = records.Database('sqlite:///{}'.format(self.db_path), connect_args={'check_same_thread': False})
+        else:
+            # An in-memory database is private to its connection, so records runs on the same one.
+            sqlite_conn = self.sqlite_conn
+            self.db = records.Database('sqlite://', creator=lambda: sqlite_conn, poolclass=StaticPool)
         self.records_conn = self.db.get_connection()
         self.creator_thread_id = threading.get_ident()
         self._closed = False
 
+    @classmethod
+    def from_catalog(cls, catalog, tables: List[Dict[str, Dict]], query_engine: str = "sqlite3", result_cache: bool = True,
+                     query_timeout: float = 30.0, query_max_steps: int = None, typed: bool = False, create_indexes: bool = False,
+                     normalize_cells: bool = False):
+        '''
+        Builds the database from a prebuilt `TableCatalog` entry instead of ingesting `tables` again.
+        The entry's SQLite file is copied into a private in-memory database, so writes never reach the catalog.
+        Unlike `__init__`, `tables` is not modified.
+        '''
+        entry = catalog.get(tables, typed=typed, create_indexes=create_indexes, normalize_cells=normalize_cells)
+        sqldb = cls.__new__(cls)
+        sqldb._setup("memory", query_engine, result_cache, query_timeout, query_max_steps)
+        sqldb.raw_tables = entry["raw_tables"]
+        sqldb.tables = entry["tables"]
+        sqldb.table_names = entry["table_names"]
+        sqldb.table_dict = {name: table["table"] for name, table in zip(sqldb.table_names, sqldb.tables)}
+        sqldb.db_path = None
+        sqldb.sqlite_conn = sqlite3.connect(":memory:", check_same_thread=False)
+        source_conn = sqlite3.connect(f"file:{entry['db_path']}?mode=ro", uri=True)
+        try:
+            source_conn.backup(sqldb.sqlite_conn)
+        finally:
+            source_conn.close()
+        sqldb._table_metadata(sqldb.table_names[0])["create_table_prompt"] = entry["schema_prompt"]
+        sqldb._open_records()
+        return sqldb
+
     def __str__(self):
         return str(self.execute_query(f"SELECT * FROM {self.table_names[0]}"))
 
@@ -72,32 +251,80 @@ class MYSQLDB(object):
         table_name = self.table_names[0] if not table_name else table_name
         return self.execute_query(f"SELECT * FROM {table_name}")
 
+    def _table_metadata(self, table_name: str) -> dict:
+        '''
+        Cached metadata of a table: {"columns", "types", "primary_keys"}, plus "row_count" and "create_table_prompt"
+        once requested. Dropped on every write.
+        '''
+        metadata = self._metadata.get(table_name)
+        if metadata is None:
+            table_info = self.sqlite_conn.execute(f"PRAGMA table_info({table_name});").fetchall()
+            metadata = {
+                "columns": [row[1] for row in table_info],
+                "types": [row[2] or 'UNKNOWN' for row in table_info],
+                "primary_keys": [row[1] for row in table_info if row[5] == 1],
+            }
+            self._metadata[table_name] = metadata
+        return metadata
+
+    def invalidate_metadata_cache(self):
+        self._metadata.clear()
+        self._sql_schema = None
+
     def get_table_schema(self, table_name: str):
         try:
-            sql_row_count = f"SELECT COUNT(*) AS count FROM {table_name};"
-            count_result = self.records_conn.query(sql_row_count)
-            row_count = count_result.first()["count"]
-
-            sql_query = f"PRAGMA table_info({table_name});"
-            result = self.records_conn.query(sql_query)
-            schema = [(row['name'], row['type'] or 'UNKNOWN') for row in result.all()]
-            return row_count, schema
+            metadata = self._table_metadata(table_name)
+            if "row_count" not in metadata:
+                metadata["row_count"] = self.sqlite_conn.execute(f"SELECT COUNT(*) AS count FROM {table_name};").fetchone()[0]
+            return metadata["row_count"], list(zip(metadata["columns"], metadata["types"]))
         except Exception as e:
             print(f"[Schema Error] Failed to get schema for '{table_name}': {e}")
             return 0, []
 
     def get_primary_keys(self, table_name: str):
         try:
-            sql_query = f"PRAGMA table_info({table_name});"
-            result = self.records_conn.query(sql_query)
-            pk_cols = [row['name'] for row in result.all() if row['pk'] == 1]
-            return pk_cols
+            return list(self._table_metadata(table_name)["primary_keys"])
         except Exception as e:
             print(f"[Primary Key Error] Failed to get primary keys for '{table_name}': {e}")
             return []
 
+    def get_create_table_prompt(self, table_name=None) -> str:
+        '''
+        The `CREATE TABLE` part of the schema prompt. Ingested tables are described by `create_table_prompt` from their
+        DataFrame; tables created by queries by their SQLite column types.
+        '''
+        table_name = self.table_names[0] if not table_name else table_name
+        metadata = self._table_metadata(table_name)
+        if "create_table_prompt" not in metadata:
+            if table_name in self.table_dict:
+                from utils.general_prompt import create_table_prompt
+                metadata["create_table_prompt"] = create_table_prompt(df=self.table_dict[table_name], title=table_name)
+            else:
+                metadata["create_table_prompt"] = create_table(table_name, metadata["columns"], metadata["types"])
+        return metadata["create_table_prompt"]
+
+    def get_sql_schema(self) -> Schema:
+        '''
+        `Schema` of every table and view in the database, including the ones created by queries. Cached until the next write.
+        '''
+        if self._sql_schema is None:
+            table_names = [row[0] for row in self.sqlite_conn.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') "
+                "UNION ALL SELECT name FROM sqlite_temp_master WHERE type IN ('table', 'view');"
+            )]
+            self._sql_schema = Schema({table_name: self.get_header(table_name) for table_name in table_names})
+        return self._sql_schema
+
+    def validate_query(self, sql_query: str) -> SQLDiagnostic:
+        '''
+        Checks a query against the tables without running it, see `validate_sql`. Unknown columns and tables come with
+        the closest known name, and `repaired_sql` is set when those fix the query.
+        '''
+        return validate_sql(sql_query, self.get_sql_schema())
+
     def get_header(self, table_name=None):
-        return self.get_table(table_name)['header']
+        table_name = self.table_names[0] if not table_name else table_name
+        return list(self._table_metadata(table_name)["columns"])
 
     def get_rows(self, table_name):
         return self.get_table(table_name)['rows']
@@ -111,71 +338,256 @@ class MYSQLDB(object):
     def get_table_title(self):
         return self.table_names[0]
 
-    def execute_query(self, sql_query: str) -> dict:
+    @contextmanager
+    def _query_budget(self, timeout: float = None, max_steps: int = None):
+        '''
+        Interrupts the statements run inside the block once they exceed `timeout` seconds or `max_steps` VM steps.
+        Yields a dict whose "exception_class" / "sqlite_error" are set when the budget stopped a statement.
+        '''
+        timeout = self.query_timeout if timeout is None else timeout
+        max_steps = self.query_max_steps if max_steps is None else max_steps
+        budget = {"exception_class": "", "sqlite_error": ""}
+        if not timeout and not max_steps:
+            yield budget
+            return
+        deadline = time.monotonic() + timeout if timeout else None
+        steps = 0
+
+        def progress_handler():
+            nonlocal steps
+            steps += _progress_interval
+            if max_steps and steps > max_steps:
+                budget["exception_class"] = QUERY_STEP_LIMIT
+                budget["sqlite_error"] = f"Query exceeded the budget of {max_steps} SQLite VM steps and was interrupted."
+                return 1
+            if deadline is not None and time.monotonic() > deadline:
+                budget["exception_class"] = QUERY_TIMEOUT
+                budget["sqlite_error"] = f"Query exceeded the time budget of {timeout} seconds and was interrupted."
+                return 1
+            return 0
+
+        self.sqlite_conn.set_progress_handler(progress_handler, _progress_interval)
         try:
-            result = self.records_conn.query(sql_query)
-            headers = result.dataset.headers
-            rows = result.all()
-            if not headers and rows:
-                return {
-                    "header": [],
-                    "rows": [list(row.values()) for row in rows],
-                    "sql": sql_query,
-                    "sqlite_error": "Headers missing but rows present, possible metadata anomaly.",
-                    "exception_class": "Missing Header Warning"
-                }
-            if headers and not rows:
-                return {
-                    "header": headers,
-                    "rows": [],
-                    "sql": sql_query,
-                    "sqlite_error": "SQL query returned zero rows.",
-                    "exception_class": "No Row Warning"
-                }
-            if not headers and not rows:
-                return {
-                    "header": [],
-                    "rows": [],
-                    "sql": sql_query,
-                    "sqlite_error": "Query returned neither headers nor rows.",
-                    "exception_class": "Empty Result Warning"
-                }
-            return {
-                "header": headers,
-                "rows": [list(row.values()) for row in rows],
-                "sql": sql_query,
-                "sqlite_error": "",
-                "exception_class": ""
-            }
-        except OperationalError as oe:
+            yield budget
+        finally:
+            self.sqlite_conn.set_progress_handler(None, 0)
+
+    def execute_query(self, sql_query: str, max_rows: int = None, timeout: float = None, max_steps: int = None) -> dict:
+        '''
+        Runs a query and returns {"header", "rows", "sql", "sqlite_error", "exception_class"}.
+        - max_rows: Keep at most this many rows: the first and last rows of the result, with the ones in between
+          counted but dropped. The result then also has "total_rows", "num_omitted" and "omitted_at"
+          (the index in "rows" where the omitted rows would be).
+        - timeout / max_steps: Budgets of this query, overriding `query_timeout` / `query_max_steps`.
+        '''
+        # Results are cached per spelling, since the header and error messages follow the text of the query;
+        # rows are shared by every spelling with the same fingerprint, computed only on a miss
+        key = (sql_query, max_rows)
+        rows_key = None
+        read_only = _is_read_only(sql_query)
+        if self.result_cache and read_only:
+            cached = self._result_cache.get(key)
+            if cached is None and self.query_engine == "sqlite3" and self._shared_rows:
+                rows_key = (sql_fingerprint(sql_query), max_rows)
+                shared = self._shared_rows.get(rows_key)
+                if shared is not None:
+                    cached = self._respelled_result(sql_query, shared, timeout, max_steps)
+                    if cached is not None:
+                        self._result_cache[key] = cached
+            if cached is not None:
+                self.result_cache_hits += 1
+                return dict(cached)
+            self.result_cache_misses += 1
+        start = time.perf_counter()
+        with self._query_budget(timeout, max_steps) as budget:
+            if self.query_engine == "records":
+                result = self._execute_query_records(sql_query, max_rows)
+            else:
+                result = self._execute_query_sqlite(sql_query, max_rows)
+        if budget["exception_class"]:
+            return self._query_error(sql_query, budget["sqlite_error"], budget["exception_class"])
+        if read_only:
+            if self.result_cache:
+                self._result_cache[key] = result
+                if (self.query_engine == "sqlite3" and result["exception_class"] in _row_result_classes
+                        and time.perf_counter() - start >= shared_rows_min_seconds):
+                    if rows_key is None:
+                        rows_key = (sql_fingerprint(sql_query), max_rows)
+                    self._shared_rows[rows_key] = result
+        else:
+            self._invalidate_caches()
+        return result
+
+    def _respelled_result(self, sql_query: str, shared: dict, timeout: float = None, max_steps: int = None) -> dict | None:
+        '''
+        `shared`, the result of another spelling of `sql_query`, with the header SQLite gives `sql_query`.
+        The header is read from `sql_query` with its LIMIT set to 0, which SQLite ends before computing any row,
+        so sorts and aggregates are not run again. None when the statement fails or is interrupted, so that it
+        runs in full and reports its own error.
+        '''
+        header_query = _limit_zero_sql(sql_query)
+        if header_query is None:
+            return None
+        with self._query_budget(timeout, max_steps) as budget:
+            try:
+                cursor = self.sqlite_conn.cursor()
+                try:
+                    cursor.execute(header_query)
+                    description = cursor.description
+                finally:
+                    cursor.close()
+            except sqlite3.Error:
+                return None
+        if budget["exception_class"] or description is None:
+            return None
+        rows = shared["rows"]
+        if rows and len(rows[0]) != len(description):
+            return None
+        # As in `_execute_query_sqlite`, there is a header only when there are rows
+        headers = [column[0] for column in description] if rows else []
+        return dict(shared, header=headers, sql=sql_query)
+
+    def invalidate_result_cache(self):
+        self._result_cache.clear()
+        self._shared_rows.clear()
+
+    def _invalidate_caches(self):
+        self.invalidate_result_cache()
+        self.invalidate_metadata_cache()
+
+    def result_cache_stats(self) -> dict:
+        return {
+            "hits": self.result_cache_hits,
+            "misses": self.result_cache_misses,
+            "entries": len(self._result_cache),
+        }
+
+    def _query_result(self, sql_query: str, headers: list, rows: list, total_rows: int = None, omitted_at: int = None) -> dict:
+        result = self._classify_result(sql_query, headers, rows)
+        if total_rows is not None:
+            result["total_rows"] = total_rows
+            result["num_omitted"] = total_rows - len(rows)
+            result["omitted_at"] = omitted_at if result["num_omitted"] else len(rows)
+        return result
+
+    def _classify_result(self, sql_query: str, headers: list, rows: list) -> dict:
+        if not headers and rows:
             return {
                 "header": [],
-                "rows": [],
+                "rows": rows,
                 "sql": sql_query,
-                "sqlite_error": str(oe),
-                "exception_class": type(oe).__name__
+                "sqlite_error": "Headers missing but rows present, possible metadata anomaly.",
+                "exception_class": "Missing Header Warning"
             }
-        except SQLAlchemyError as se:
+        if headers and not rows:
             return {
-                "header": [],
+                "header": headers,
                 "rows": [],
                 "sql": sql_query,
-                "sqlite_error": str(se),
-                "exception_class": type(se).__name__
+                "sqlite_error": "SQL query returned zero rows.",
+                "exception_class": "No Row Warning"
             }
-        except Exception as e:
+        if not headers and not rows:
             return {
                 "header": [],
                 "rows": [],
                 "sql": sql_query,
-                "sqlite_error": str(e),
-                "exception_class": type(e).__name__
+                "sqlite_error": "Query returned neither headers nor rows.",
+                "exception_class": "Empty Result Warning"
             }
+        return {
+            "header": headers,
+            "rows": rows,
+            "sql": sql_query,
+            "sqlite_error": "",
+            "exception_class": ""
+        }
+
+    def _query_error(self, sql_query: str, sqlite_error: str, exception_class: str) -> dict:
+        return {
+            "header": [],
+            "rows": [],
+            "sql": sql_query,
+            "sqlite_error": sqlite_error,
+            "exception_class": exception_class
+        }
+
+    def _execute_query_sqlite(self, sql_query: str, max_rows: int = None) -> dict:
+        try:
+            cursor = self.sqlite_conn.cursor()
+            try:
+                cursor.execute(sql_query)
+                if cursor.description is None:
+                    # Statement without a result set: persist it and report an empty result, as records does
+                    if self.sqlite_conn.in_transaction:
+                        self.sqlite_conn.commit()
+                    rows = []
+                elif max_rows is None:
+                    rows = cursor.fetchall()
+                else:
+                    # Stream the result, keeping only the head and tail rows but counting all of them
+                    head_rows, tail_rows = _split_head_tail(max_rows)
+                    rows = cursor.fetchmany(head_rows) if head_rows else []
+                    tail = deque(maxlen=tail_rows)
+                    total_rows = len(rows)
+                    while True:
+                        batch = cursor.fetchmany(1024)
+                        if not batch:
+                            break
+                        total_rows += len(batch)
+                        tail.extend(batch)
+                    rows.extend(tail)
+                # records only reports headers when there is a first row to take them from
+                headers = [column[0] for column in cursor.description] if rows else []
+            finally:
+                cursor.close()
+            if max_rows is None:
+                return self._query_result(sql_query, headers, [list(row) for row in rows])
+            return self._query_result(sql_query, headers, [list(row) for row in rows], total_rows, head_rows)
+        except sqlite3.Error as e:
+            # Same message layout as the SQLAlchemy-wrapped errors of the records path
+            return self._query_error(sql_query, f"({type(e).__module__}.{type(e).__name__}) {e}\n[SQL: {sql_query}]", type(e).__name__)
+        except Exception as e:
+            return self._query_error(sql_query, str(e), type(e).__name__)
+
+    def _execute_query_records(self, sql_query: str, max_rows: int = None) -> dict:
+        try:
+            result = self.records_conn.query(sql_query)
+            headers = result.dataset.headers
+            rows = result.all()
+            if max_rows is None:
+                return self._query_result(sql_query, headers or [], [list(row.values()) for row in rows])
+            head_rows, tail_rows = _split_head_tail(max_rows)
+            total_rows = len(rows)
+            if total_rows > max_rows:
+                rows = rows[:head_rows] + (rows[-tail_rows:] if tail_rows else [])
+            return self._query_result(sql_query, headers or [], [list(row.values()) for row in rows], total_rows, head_rows)
+        except OperationalError as oe:
+            return self._query_error(sql_query, str(oe), type(oe).__name__)
+        except SQLAlchemyError as se:
+            return self._query_error(sql_query, str(se), type(se).__name__)
+        except Exception as e:
+            return self._query_error(sql_query, str(e), type(e).__name__)
 
     def execute_sql_noreturn(self, sql_statement: str) -> dict:
+        self._invalidate_caches()
         try:
             cursor = self.sqlite_conn.cursor()
-            cursor.execute(sql_statement)
+            with self._query_budget() as budget:
+                try:
+                    cursor.execute(sql_statement)
+                except sqlite3.OperationalError:
+                    if not budget["exception_class"]:
+                        raise
+            if budget["exception_class"]:
+                if self.sqlite_conn.in_transaction:
+                    self.sqlite_conn.rollback()
+                return {
+                    "sql": sql_statement,
+                    "success": False,
+                    "sqlite_error": budget["sqlite_error"],
+                    "exception_class": budget["exception_class"]
+                }
             self.sqlite_conn.commit()
             return {
                 "sql": sql_statement,
@@ -206,25 +618,78 @@ class MYSQLDB(object):
             }
 
     def add_sub_table(self, sub_table, table_name=None, verbose=True):
+        '''
+        Adds the columns of `sub_table` (which carries a row_id column) to the table, matched on row_id.
+        The new columns are added with ALTER TABLE and filled from a temp table in one transaction, so the cost
+        follows the size of the sub-table rather than the table. Name collisions, duplicate row_ids or a table
+        without row_id fall back to rewriting the merged table.
+        '''
         table_name = self.table_names[0] if not table_name else table_name
-        sql_query = f"SELECT * FROM {table_name}"
-        old_table_df = pd.DataFrame(self.execute_query(sql_query)["rows"],
-                                    columns=self.execute_query(sql_query)["header"])
         sub_table_df = convert_df_type(pd.DataFrame(data=sub_table['rows'], columns=sub_table['header']))
-        new_table = old_table_df.merge(sub_table_df, how='left', on='row_id')
-        new_table.to_sql(table_name, self.sqlite_conn, if_exists='replace', index=False)
+        if not self._add_columns_in_place(table_name, sub_table_df):
+            self._add_columns_by_rewrite(table_name, sub_table_df)
+        self._invalidate_caches()
         if verbose:
             print(f"Inserted columns {', '.join(sub_table['header'])} into table '{table_name}'.")
 
+    def _add_columns_in_place(self, table_name: str, sub_table_df: pd.DataFrame) -> bool:
+        existing_columns = [row[1].lower() for row in self.sqlite_conn.execute(f"PRAGMA table_info({quote_identifier(table_name)})")]
+        new_columns = [column for column in sub_table_df.columns if column != 'row_id']
+        if ('row_id' not in existing_columns or 'row_id' not in sub_table_df.columns
+                or any(str(column).lower() in existing_columns for column in new_columns)
+                or len({str(column).lower() for column in new_columns}) != len(new_columns)
+                or sub_table_df['row_id'].duplicated().any()):
+            return False
+        if not new_columns:
+            return True
+
+        target = quote_identifier(table_name)
+        staging = quote_identifier(f"_sub_table_{uuid.uuid4().hex}")
+        quoted_columns = [quote_identifier(column) for column in new_columns]
+        rows = [
+            [None if pd.isna(value) else value for value in row]
+            for row in sub_table_df[['row_id'] + new_columns].astype(object).values.tolist()
+        ]
+        if self.sqlite_conn.in_transaction:
+            self.sqlite_conn.commit()
+        cursor = self.sqlite_conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            for column, quoted in zip(new_columns, quoted_columns):
+                cursor.execute(f"ALTER TABLE {target} ADD COLUMN {quoted} {_sqlite_column_type(sub_table_df[column])}")
+            cursor.execute(f"CREATE TEMP TABLE {staging} (row_id PRIMARY KEY, {', '.join(quoted_columns)})")
+            cursor.executemany(
+                f"INSERT INTO temp.{staging} VALUES ({', '.join(['?'] * (len(new_columns) + 1))})", rows
+            )
+            cursor.execute(
+                f"UPDATE {target} SET ({', '.join(quoted_columns)}) = "
+                f"(SELECT {', '.join(quoted_columns)} FROM temp.{staging} AS s WHERE s.row_id = {target}.row_id) "
+                f"WHERE row_id IN (SELECT row_id FROM temp.{staging})"
+            )
+            cursor.execute(f"DROP TABLE temp.{staging}")
+            self.sqlite_conn.commit()
+        except Exception:
+            self.sqlite_conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        return True
+
+    def _add_columns_by_rewrite(self, table_name: str, sub_table_df: pd.DataFrame):
+        result = self.execute_query(f"SELECT * FROM {table_name}")
+        old_table_df = pd.DataFrame(result["rows"], columns=result["header"])
+        new_table = old_table_df.merge(sub_table_df, how='left', on='row_id')
+        new_table.to_sql(table_name, self.sqlite_conn, if_exists='replace', index=False)
+
     def close(self):
         if self._closed:
             return
         try:
-            if hasattr(self, 'sqlite_conn') and self.sqlite_conn:
-                self.sqlite_conn.close()
             if hasattr(self, 'records_conn') and self.records_conn:
                 self.records_conn.close()
-            if hasattr(self, 'db_path') and os.path.exists(self.db_path):
+            if hasattr(self, 'sqlite_conn') and self.sqlite_conn:
+                self.sqlite_conn.close()
+            if hasattr(self, 'db_path') and self.db_path and os.path.exists(self.db_path):
                 os.remove(self.db_path)
         except Exception as e:
             print(f"[MYSQLDB Error] Failed to close: {e}")
@@ -8,6 +8,7 @@ import ast
 from utils.database import MYSQLDB
 from utils.helper import PipelineContext, AgentResult
 from utils.normalizer import convert_df_type, prepare_df_for_mysqldb_from_table
+from utils.table_render import result_pipe_lines, df_pipe_table, df_create_table
 
 def _make_sqlite_friendly(name: str):
     if not name:
@@ -60,6 +61,25 @@ def extract_analysis_and_answer(reply: str) -> tuple[str, str]:
 
     return analysis, answer
 
+def extract_analysis_decision_and_answer(reply: str) -> tuple[str, str, str]:
+    analysis = ""
+    decision = ""
+    answer = ""
+
+    match_analysis = re.search(r"Analysis:\s*(.*?)\s*Decision:", reply, re.DOTALL | re.IGNORECASE)
+    if match_analysis:
+        analysis = match_analysis.group(1).strip()
+
+    match_decision = re.search(r"Decision:\s*([^\n\r]*)", reply, re.DOTALL | re.IGNORECASE)
+    if match_decision:
+        decision = match_decision.group(1).strip()
+
+    match_answer = re.search(r"Answer:\s*([^\n\r]*)", reply, re.DOTALL | re.IGNORECASE)
+    if match_answer:
+        answer = match_answer.group(1).strip()
+
+    return analysis, decision, answer
+
 def extract_sql(reply: str) -> str:
     sql = ""
     match_sql = re.search(r"```sql\s*(.*?)```", reply, re.DOTALL | re.IGNORECASE)
@@ -74,16 +94,40 @@ def extract_sql(reply: str) -> str:
 def ensure_strings(lst):
     return [str(item) if not isinstance(item, str) else item for item in lst]
 
-def table2pipe(table: dict) -> str:
+def _omitted_rows_line(num_omitted: int) -> str:
+    return f"| ... {num_omitted} more rows ... |\n"
+
+def table2pipe(table: dict, max_tokens: int = None) -> str:
+    '''
+    Renders a query result as a pipe table.
+    Rows left out by `execute_query(..., max_rows=N)` are shown as one "... N more rows ..." line.
+    - max_tokens: Rough budget (4 characters per token); rows are dropped from the middle of the
+      table, next to the marker, until the rendering fits. The header, first and last rows are kept.
+    '''
     try:
-        pipe_table = "| " + " | ".join(table["header"]) + " |\n"
-        for raw_row in table["rows"]:
-            row = ensure_strings(raw_row)
-            pipe_row = "| " + " | ".join(row) + " |\n"
-            pipe_table += pipe_row
-        return pipe_table
+        header_line, row_lines = result_pipe_lines(table)
     except (KeyError, TypeError, AttributeError) as e:
         raise ValueError("Wrong table format.") from e
+    num_omitted = table.get("num_omitted", 0)
+    omitted_at = table.get("omitted_at", len(row_lines))
+    if max_tokens is not None:
+        if not num_omitted:
+            # Nothing left out yet: trim around the middle row
+            omitted_at = (len(row_lines) + 1) // 2
+        head_lines, tail_lines = row_lines[:omitted_at], row_lines[omitted_at:]
+        size = len(header_line) + sum(len(line) for line in row_lines)
+        budget = max_tokens * 4
+        while size + (len(_omitted_rows_line(num_omitted)) if num_omitted else 0) > budget and len(head_lines) + len(tail_lines) > 2:
+            if len(head_lines) > len(tail_lines):
+                size -= len(head_lines.pop())
+            else:
+                size -= len(tail_lines.pop(0))
+            num_omitted += 1
+        row_lines = head_lines + tail_lines
+        omitted_at = len(head_lines)
+    if num_omitted:
+        row_lines = row_lines[:omitted_at] + [_omitted_rows_line(num_omitted)] + row_lines[omitted_at:]
+    return header_line + "".join(row_lines)
 
 def contains_yes(s: str) -> bool:
     return "yes" in s.lower()
@@ -96,23 +140,7 @@ def remove_semicolon(original: str) -> str:
     return new
 
 def create_table_prompt(df: pd.DataFrame, title: str) -> str:
-    prompt = "CREATE TABLE {}(\n".format(title)
-    for header in df.columns:
-
-        column_type = 'text'
-        try:
-            if df[header].dtype == 'int64':
-                column_type = 'int'
-            elif df[header].dtype == 'float64':
-                column_type = 'real'
-            elif df[header].dtype == 'datetime64':
-                column_type = 'datetime'
-        except AttributeError as e:
-            pass
-
-        prompt += '\t{} {},\n'.format(header, column_type)
-    prompt = prompt.rstrip(',\n') + ')\n'
-    return prompt
+    return df_create_table(df, title)
 
 def select_x_rows_prompt(full_table: bool, df: pd.DataFrame, title: str, num_rows: int = 3) -> tuple[int, str]:
     total_number = len(df)
@@ -127,15 +155,7 @@ def select_x_rows_prompt(full_table: bool, df: pd.DataFrame, title: str, num_row
         else:
             prompt = f'/*\n{num_rows} example rows:\nSELECT * FROM {title} LIMIT {num_rows};\n'
 
-    prompt += "| "
-    prompt += " | ".join(df.columns)
-    prompt += " |\n"
-
-    for _, row in df.iloc[:num_rows].iterrows():
-        prompt += "| "
-        prompt += " | ".join(map(str, row.values))
-        prompt += " |\n"
-
+    prompt += df_pipe_table(df, num_rows)
     prompt += '*/\n'
     return total_number, prompt
 
@@ -155,16 +175,8 @@ def _select_temp_x_rows_prompt(full_table: bool, sqldb: MYSQLDB, title: str, tot
             prompt = f"/*\n{num_rows} example rows:\nSELECT * FROM {title} LIMIT {num_rows};\n"
     execute_result = sqldb.execute_query(sql_rows)
     if not execute_result["sqlite_error"]:
-        header = execute_result["header"]
-        rows = execute_result["rows"]
-        prompt += "| "
-        prompt += " | ".join(header)
-        prompt += " |\n"
-        for row_list in rows:
-            row = ensure_strings(row_list)
-            prompt += "| "
-            prompt += " | ".join(row)
-            prompt += " |\n"
+        header_line, row_lines = result_pipe_lines(execute_result)
+        prompt += header_line + "".join(row_lines)
         prompt += '*/\n'
         return prompt
     else:
@@ -183,15 +195,8 @@ def TEMP_table_prompt(ctx: PipelineContext) -> AgentResult:
         else:
             first_cte_name = cte_names[0].split(',')[0].strip()
             table_name = _make_sqlite_friendly(first_cte_name)
-        temp_table_schema = sqldb.get_table_schema(table_name)
-        total_num = temp_table_schema[0]
-        temp_schema = temp_table_schema[1]
-        prompt = "CREATE TABLE {}(\n".format(table_name)
-        for column in temp_schema:
-            column_name = column[0]
-            column_type = column[1]
-            prompt += '\t{} {},\n'.format(column_name, column_type)
-        prompt = prompt.rstrip(',\n') + ')\n'
+        total_num, _ = sqldb.get_table_schema(table_name)
+        prompt = sqldb.get_create_table_prompt(table_name)
         row_prompt = _select_temp_x_rows_prompt(full_table = False, sqldb = sqldb, title = table_name, total_num = total_num, num_rows = 3)
         prompt += row_prompt
         return AgentResult(
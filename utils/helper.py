@@ -6,6 +6,7 @@ from typing import Any
 from dataclasses import dataclass, field
 from utils.myllm import MyChatGPT
 from utils.database import MYSQLDB
+from utils.table_render import table_text_linear
 
 @dataclass
 class PipelineContext:
@@ -27,6 +28,13 @@ class PipelineContext:
     - debug: Whether to use debug mode for the agent.
     - strategy: The strategy to use for the agent.
     - extras: Additional context for the agent.
+    - speculative: Check both Basic-agent candidate SQLs for sufficiency concurrently instead of one after the other.
+    - fused_answer: Decide sufficiency and answer in one LLM call instead of a Sufficiency call followed by an Answer call.
+    - static_check: Check generated SQL against the table schema before running it (`MYSQLDB.validate_query`),
+      repairing misspelled column and table names locally and skipping SQL that cannot run.
+    - checked_sqls: Sufficiency verdicts by (`sql_fingerprint`, prompt_schema), so a SQL is checked at most once.
+    - result_max_rows / result_max_tokens: Bounds on the SQL results shown to the sufficiency and answer agents (rows
+      kept by `execute_query`, token budget of the rendered table); None shows the whole result.
     '''
     llm: MyChatGPT
     sqldb: MYSQLDB
@@ -42,6 +50,12 @@ class PipelineContext:
     debug: bool = False
     strategy: str = "top"
     extras: dict[str, Any] = field(default_factory=dict)
+    speculative: bool = False
+    fused_answer: bool = False
+    static_check: bool = False
+    checked_sqls: dict[tuple[str, str], tuple] = field(default_factory=dict)
+    result_max_rows: int | None = None
+    result_max_tokens: int | None = None
 
 @dataclass
 class AgentResult:
@@ -66,20 +80,7 @@ def table2string(
     num_rows=100,
     caption=None,
 ):
-    df = table2df(table_text, num_rows)
-    linear_table = ""
-    if caption is not None:
-        linear_table += "table caption : " + caption + "\n"
-    header = "col : " + " | ".join(df.columns) + "\n"
-    linear_table += header
-    rows = df.values.tolist()
-    for row_idx, row in enumerate(rows):
-        row = [str(x) for x in row]
-        line = "row {} : ".format(row_idx + 1) + " | ".join(row)
-        if row_idx != len(rows) - 1:
-            line += "\n"
-        linear_table += line
-    return linear_table
+    return table_text_linear(table_text, num_rows=num_rows, caption=caption)
 
 class NoIndent(object):
     def __init__(self, value):
@@ -0,0 +1,56 @@
+import os
+import httpx
+import openai
+
+http_pool_config = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 60.0,
+    "http2": True,
+}
+
+_clients = {}
+
+def configure_http_pool(max_connections: int = None, max_keepalive_connections: int = None,
+                        keepalive_expiry: float = None, http2: bool = None):
+    '''
+    Sets the connection pool limits used by clients created after this call.
+    Call it before the first client is built (e.g. in `main`, before the worker Pool forks).
+    '''
+    updates = {
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive_connections,
+        "keepalive_expiry": keepalive_expiry,
+        "http2": http2,
+    }
+    http_pool_config.update({k: v for k, v in updates.items() if v is not None})
+
+def _http2_available() -> bool:
+    try:
+        import h2
+        return True
+    except ImportError:
+        return False
+
+def _http_client_kwargs() -> dict:
+    return {
+        "limits": httpx.Limits(
+            max_connections=http_pool_config["max_connections"],
+            max_keepalive_connections=http_pool_config["max_keepalive_connections"],
+            keepalive_expiry=http_pool_config["keepalive_expiry"],
+        ),
+        "http2": http_pool_config["http2"] and _http2_available(),
+    }
+
+def get_openai_client(api_key: str, base_url: str = None) -> openai.OpenAI:
+    '''
+    Returns the process-wide `openai.OpenAI` client for (api_key, base_url), so every sample and wrapper
+    in a worker shares one keep-alive connection pool instead of opening new TLS connections per sample.
+    '''
+    key = ("sync", os.getpid(), api_key, base_url)
+    client = _clients.get(key)
+    if client is None:
+        http_client_cls = getattr(openai, "DefaultHttpxClient", httpx.Client)
+        client = openai.OpenAI(api_key=api_key, base_url=base_url, http_client=http_client_cls(**_http_client_kwargs()))
+        _clients[key] = client
+    return client
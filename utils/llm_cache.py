@@ -0,0 +1,248 @@
+import os
+import json
+import atexit
+import time
+import hashlib
+import sqlite3
+import threading
+
+def make_cache_key(model_name: str, messages: list, end_str=None, options: dict = None, seed: int = None) -> str:
+    '''
+    Content address of a chat completion request.
+    Every field that can change the response is part of the key, so editing one prompt
+    only invalidates the entries built from that prompt.
+    '''
+    payload = {
+        "model": model_name,
+        "messages": messages,
+        "stop": end_str,
+        "options": options or {},
+        "seed": seed,
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class LLMCache(object):
+    '''
+    On-disk response cache for chat completions, stored in a single SQLite file.
+    - path: The SQLite file. All Pool workers pointing at the same path share the entries.
+    - max_bytes: Size budget for cached responses; least recently used entries are evicted beyond it.
+    - bypass: Skip lookups (responses are still written), used to refresh a cache.
+    Lookups only read: access times and hit/miss counters are collected in memory and written in batches
+    (every `flush_every` lookups or `flush_seconds`, and on `set`, `stats` and `close`).
+    '''
+    flush_every = 64
+    flush_seconds = 5.0
+
+    def __init__(self, path: str, max_bytes: int = 1 << 30, bypass: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        self._lock = threading.Lock()
+        # key -> last access time, and hit/miss counts, not written to the file yet
+        self._touched = {}
+        self._pending_counts = {"hits": 0, "misses": 0}
+        self._last_flush = time.monotonic()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, "
+            "created REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+        self._conn.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+        # Running total of `size`, kept up to date by `set` and `_evict`; summed once for files written before it existed
+        self._conn.execute(
+            "INSERT OR IGNORE INTO counters SELECT 'bytes', COALESCE(SUM(size), 0) FROM responses"
+        )
+
+    def get(self, key: str) -> list | None:
+        if self.bypass:
+            return None
+        with self._lock:
+            try:
+                row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            except sqlite3.OperationalError as e:
+                # A locked or busy file counts as a miss; the response is requested and stored again
+                print(f"[LLMCache Warning] Lookup failed: {e}")
+                row = None
+            counter = "hits" if row else "misses"
+            self._pending_counts[counter] += 1
+            if row:
+                self._touched[key] = time.time()
+            if sum(self._pending_counts.values()) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_seconds:
+                self._flush_quietly(wait=False)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def _flush(self):
+        '''
+        Writes the collected access times and counters; called inside an open write transaction.
+        '''
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE responses SET last_access = MAX(last_access, ?) WHERE key = ?",
+                [(accessed, key) for key, accessed in self._touched.items()]
+            )
+        for name, count in self._pending_counts.items():
+            if count:
+                self._conn.execute("UPDATE counters SET value = value + ? WHERE name = ?", (count, name))
+
+    def _flushed(self):
+        self._touched.clear()
+        self._pending_counts = {"hits": 0, "misses": 0}
+        self._last_flush = time.monotonic()
+
+    def _flush_quietly(self, wait: bool = True):
+        if not self._touched and not any(self._pending_counts.values()):
+            self._last_flush = time.monotonic()
+            return
+        try:
+            if not wait:
+                # From a lookup, never wait for another process's write lock
+                self._conn.execute("PRAGMA busy_timeout = 0")
+            self._conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            # Another process holds the write lock; keep the batch for the next flush
+            self._last_flush = time.monotonic()
+            return
+        finally:
+            if not wait:
+                self._conn.execute("PRAGMA busy_timeout = 60000")
+        try:
+            self._flush()
+            self._conn.execute("COMMIT")
+            self._flushed()
+        except sqlite3.Error as e:
+            self._conn.execute("ROLLBACK")
+            self._last_flush = time.monotonic()
+            print(f"[LLMCache Warning] Failed to record cache accesses: {e}")
+
+    def set(self, key: str, response: list, model_name: str = None):
+        data = json.dumps(response, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                print(f"[LLMCache Warning] Failed to store response: {e}")
+                return
+            try:
+                self._flush()
+                old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model_name, data, size, now, now)
+                )
+                total = self._add_bytes(size - (old[0] if old else 0))
+                self._evict(total)
+                self._conn.execute("COMMIT")
+                self._flushed()
+            except sqlite3.Error as e:
+                self._conn.execute("ROLLBACK")
+                print(f"[LLMCache Warning] Failed to store response: {e}")
+
+    def _add_bytes(self, delta: int) -> int:
+        self._conn.execute("UPDATE counters SET value = value + ? WHERE name = 'bytes'", (delta,))
+        return self._conn.execute("SELECT value FROM counters WHERE name = 'bytes'").fetchone()[0]
+
+    def _evict(self, total: int):
+        if total <= self.max_bytes:
+            return
+        cursor = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC")
+        expired = []
+        freed = 0
+        for key, size in cursor:
+            if total - freed <= self.max_bytes:
+                break
+            expired.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", expired)
+        self._add_bytes(-freed)
+
+    def flush(self):
+        '''
+        Writes the access times and counters collected since the last flush.
+        '''
+        with self._lock:
+            self._flush_quietly()
+
+    def stats(self) -> dict:
+        '''
+        Hit/miss counters of this process, plus the totals accumulated by every process sharing the file.
+        '''
+        with self._lock:
+            self._flush_quietly()
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            totals = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_hits": totals.get("hits", 0),
+            "total_misses": totals.get("misses", 0),
+            "entries": entries,
+            "bytes": totals.get("bytes", 0),
+        }
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        with self._lock:
+            self._pending_counts = {"hits": 0, "misses": 0}
+            self._conn.execute("UPDATE counters SET value = 0 WHERE name IN ('hits', 'misses')")
+
+    def clear(self):
+        with self._lock:
+            self._touched.clear()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.execute("UPDATE counters SET value = 0 WHERE name = 'bytes'")
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.reset_counters()
+
+    def close(self):
+        with self._lock:
+            self._flush_quietly()
+            self._conn.close()
+
+_caches = {}
+
+def get_llm_cache(path: str, max_bytes: int = 1 << 30, bypass: bool = False) -> LLMCache:
+    '''
+    Returns the cache for `path`, opening it once per process so every sample in a worker reuses one connection.
+    '''
+    key = (os.getpid(), os.path.abspath(path))
+    cache = _caches.get(key)
+    if cache is None:
+        cache = LLMCache(path, max_bytes=max_bytes, bypass=bypass)
+        _caches[key] = cache
+        atexit.register(cache.close)
+    cache.max_bytes = max_bytes
+    cache.bypass = bypass
+    return cache
+
+def flush_llm_caches():
+    '''
+    Writes the access times and counters collected by every cache this process opened. Pool workers are terminated
+    without running exit hooks, so they call this after each sample.
+    '''
+    pid = os.getpid()
+    for (cache_pid, _), cache in list(_caches.items()):
+        if cache_pid == pid:
+            cache.flush()
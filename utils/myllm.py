@@ -1,16 +1,46 @@
-import openai
 import time
-import numpy as np
+import threading
+from contextlib import contextmanager
+import openai
 import tiktoken
-import requests
-import time
-import numpy as np
-from transformers import AutoTokenizer
+from utils.llm_cache import LLMCache, make_cache_key
+from utils.http_clients import get_openai_client
+from utils.rate_limiter import RateLimiter, estimate_request_tokens, retry_after_seconds, is_rate_limit_error, backoff_delay
+
+sql_system_message = "You are an expert in SQLite and table-based question answering. Please follow the given examples and complete the task."
+text_system_message = "You are a semantic understanding specialist. Please follow the given examples and complete the task."
+
+class RequestCancelled(Exception):
+    pass
+
+_cancellation = threading.local()
+
+@contextmanager
+def cancel_on(event: threading.Event):
+    '''
+    Requests made by this thread inside the block raise RequestCancelled instead of being sent once `event` is set.
+    A request already sent is not interrupted: it is still paid for and counted against the rate limiter.
+    '''
+    previous = getattr(_cancellation, "event", None)
+    _cancellation.event = event
+    try:
+        yield
+    finally:
+        _cancellation.event = previous
+
+def _check_cancelled():
+    event = getattr(_cancellation, "event", None)
+    if event is not None and event.is_set():
+        raise RequestCancelled("Request cancelled before it was sent.")
 
 class MyChatGPT:
-    def __init__(self, model_name: str, key: str):
+    def __init__(self, model_name: str, key: str, cache: LLMCache = None, rate_limiter: RateLimiter = None, retry_limit: int = 5,
+                 client = None):
         self.model_name = model_name
-        self.client = openai.OpenAI(api_key=key)
+        self.client = client if client is not None else get_openai_client(key)
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.retry_limit = retry_limit
 
     def adjust_max_tokens(self, prompt: str, buffer: int = 2000) -> int:
         try:
@@ -57,6 +87,74 @@ class MyChatGPT:
             "max_tokens": max_tokens,
         }
 
+    def _retry_delay(self, error: Exception, retry_num: int) -> float:
+        retry_after = retry_after_seconds(error)
+        delay = backoff_delay(retry_num, retry_after = retry_after)
+        if self.rate_limiter is not None and is_rate_limit_error(error):
+            self.rate_limiter.penalize(delay)
+        return delay
+
+    def _start_request(self, messages: list, options: dict, end_str: str = None) -> tuple:
+        '''
+        (cache key, cached results or None, estimated tokens) of a request; shared by `_request` and `_arequest`.
+        '''
+        cache_key = None
+        if self.cache is not None:
+            cache_key = make_cache_key(self.model_name, messages, end_str, options, seed = 42)
+            contents = self.cache.get(cache_key)
+            if contents is not None:
+                return cache_key, [(content, None) for content in contents], 0
+        return cache_key, None, estimate_request_tokens(messages, options)
+
+    def _create_kwargs(self, messages: list, options: dict, end_str: str = None) -> dict:
+        return dict(model=self.model_name, seed = 42, messages=messages, stop=end_str, **options)
+
+    def _on_error(self, e: Exception, retry_num: int) -> tuple:
+        '''
+        (placeholder response or None, error, seconds to wait before retrying) after a failed attempt.
+        '''
+        print(f"OpenAI API Error: {e}", flush=True)
+        if "This model's maximum context length is" in str(e):
+            print("Warning: Input exceeds max context length. Returning placeholder response.")
+            return {"choices": [{"message": {"content": "PLACEHOLDER"}}]}, str(e), 0
+        if retry_num >= self.retry_limit:
+            print("Too many retry attempts. Returning placeholder response.")
+            return {"choices": [{"message": {"content": "PLACEHOLDER"}}]}, str(e), 0
+        return None, str(e), self._retry_delay(e, retry_num)
+
+    def _finish_request(self, gpt_responses, error: str, cache_key: str) -> list:
+        if error:
+            raise Exception(error)
+
+        contents = [res.message.content for res in gpt_responses.choices]
+        if self.cache is not None:
+            self.cache.set(cache_key, contents, self.model_name)
+        return [(content, None) for content in contents]
+
+    def _request(self, messages: list, options: dict, end_str: str = None) -> list:
+        cache_key, cached, request_tokens = self._start_request(messages, options, end_str)
+        if cached is not None:
+            return cached
+
+        gpt_responses = None
+        retry_num = 0
+        error = None
+        while gpt_responses is None:
+            _check_cancelled()
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(request_tokens)
+                _check_cancelled()
+            try:
+                gpt_responses = self.client.chat.completions.create(**self._create_kwargs(messages, options, end_str))
+                error = None
+            except openai.OpenAIError as e:
+                gpt_responses, error, delay = self._on_error(e, retry_num)
+                if gpt_responses is None:
+                    time.sleep(delay)
+                retry_num += 1
+
+        return self._finish_request(gpt_responses, error, cache_key)
+
     def generate_plus_with_score(self, prompt: str, options: dict = None, end_str: str = None) -> list:
         if options is None:
             options = self.get_model_options(prompt=prompt)
@@ -64,7 +162,7 @@ class MyChatGPT:
         messages = [
             {
                 "role": "system",
-                "content": "You are an expert in SQLite and table-based question answering. Please follow the given examples and complete the task.",
+                "content": sql_system_message,
             },
             {
                 "role": "user",
@@ -72,46 +170,7 @@ class MyChatGPT:
             },
         ]
 
-        gpt_responses = None
-        retry_num = 0
-        retry_limit = 2
-        error = None
-
-        while gpt_responses is None:
-            try:
-                gpt_responses = self.client.chat.completions.create(
-                    model=self.model_name,
-                    seed = 42,
-                    messages=messages,
-                    stop=end_str,
-                    **options
-                )
-                error = None
-            except openai.OpenAIError as e:
-                print(f"OpenAI API Error: {e}", flush=True)
-                error = str(e)
-
-                if "This model's maximum context length is" in str(e):
-                    print("Warning: Input exceeds max context length. Returning placeholder response.")
-                    gpt_responses = {
-                        "choices": [{"message": {"content": "PLACEHOLDER"}}]
-                    }
-                elif retry_num >= retry_limit:
-                    print("Too many retry attempts. Returning placeholder response.")
-                    gpt_responses = {
-                        "choices": [{"message": {"content": "PLACEHOLDER"}}]
-                    }
-                else:
-                    time.sleep(10)
-
-                retry_num += 1
-
-        if error:
-            raise Exception(error)
-
-        results = [(res.message.content, None) for res in gpt_responses.choices]
-
-        return results
+        return self._request(messages, options, end_str)
 
     def generate(self, prompt: str, options: dict = None, returnall: bool = False, end_str: str = None):
         if options is None:
@@ -132,7 +191,7 @@ class MyChatGPT:
         messages = [
             {
                 "role": "system",
-                "content": "You are a semantic understanding specialist. Please follow the given examples and complete the task.",
+                "content": text_system_message,
             },
             {
                 "role": "user",
@@ -140,46 +199,7 @@ class MyChatGPT:
             },
         ]
 
-        gpt_responses = None
-        retry_num = 0
-        retry_limit = 2
-        error = None
-
-        while gpt_responses is None:
-            try:
-                gpt_responses = self.client.chat.completions.create(
-                    model=self.model_name,
-                    seed = 42,
-                    messages=messages,
-                    stop=end_str,
-                    **options
-                )
-                error = None
-            except openai.OpenAIError as e:
-                print(f"OpenAI API Error: {e}", flush=True)
-                error = str(e)
-
-                if "This model's maximum context length is" in str(e):
-                    print("Warning: Input exceeds max context length. Returning placeholder response.")
-                    gpt_responses = {
-                        "choices": [{"message": {"content": "PLACEHOLDER"}}]
-                    }
-                elif retry_num >= retry_limit:
-                    print("Too many retry attempts. Returning placeholder response.")
-                    gpt_responses = {
-                        "choices": [{"message": {"content": "PLACEHOLDER"}}]
-                    }
-                else:
-                    time.sleep(10)
-
-                retry_num += 1
-
-        if error:
-            raise Exception(error)
-
-        results = [(res.message.content, None) for res in gpt_responses.choices]
-
-        return results
+        return self._request(messages, options, end_str)
 
     def generate_text(self, prompt: str, options: dict = None, returnall: bool = False, end_str: str = None):
         if options is None:
@@ -191,4 +211,4 @@ class MyChatGPT:
         if returnall:
             return result_texts
         else:
-            return results[0][0]
\ No newline at end of file
+            return results[0][0]
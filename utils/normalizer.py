@@ -4,9 +4,13 @@ import recognizers_suite
 from recognizers_suite import Culture
 import re
 import unicodedata
-from fuzzywuzzy import fuzz
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from utils.sql.extraction_from_sql import *
 from utils.sql.all_keywords import ALL_KEY_WORDS
+from utils.value_index import get_table_value_index
 
 culture = Culture.English
 
@@ -65,31 +69,166 @@ def str_normalize(user_input, recognition_types=None):
         user_input = user_input[:-len("00:00:00") - 1]
     return user_input
 
-def prepare_df_for_mysqldb_from_table(table: Dict, add_row_id=True, normalize=True, lower_case=True):
+# Words in the recognizers' patterns that are never recognized without a number or date word next to them
+_str_normalize_stopwords = {"a", "i", "the", "and", "for", "with", "from", "this", "that", "are", "all", "any", "out", "over", "some",
+                            "more", "most", "less", "than", "how", "which", "you", "they", "she", "have", "also", "but",
+                            "get", "say", "ask", "like", "well", "not", "take", "rest", "result", "call", "building"}
+_str_normalize_trigger_pattern = None
+_str_normalize_cache = OrderedDict()
+_str_normalize_cache_lock = threading.Lock()
+str_normalize_config = {"cache_size": 100000, "num_workers": 1, "min_parallel": 256}
+_str_normalize_pool = None
+
+def _recognizer_words() -> set:
+    from recognizers_number.resources.english_numeric import EnglishNumeric
+    from recognizers_date_time.resources.english_date_time import EnglishDateTime
+
+    def collect(obj, out):
+        if isinstance(obj, str):
+            out.append(obj)
+        elif isinstance(obj, dict):
+            for key, value in obj.items():
+                collect(key, out)
+                collect(value, out)
+        elif isinstance(obj, (list, tuple, set)):
+            for value in obj:
+                collect(value, out)
+
+    patterns = []
+    for resource in (EnglishNumeric, EnglishDateTime):
+        for name, value in vars(resource).items():
+            if not name.startswith('_'):
+                collect(value, patterns)
+    words = set()
+    for pattern in patterns:
+        pattern = re.sub(r"\\[a-zA-Z]", " ", pattern)
+        pattern = re.sub(r"\(\?P?<[a-zA-Z_]+>", " ", pattern)
+        words.update(re.findall(r"[a-z]+", pattern.lower()))
+    return words
+
+def _get_trigger_pattern():
+    '''
+    Matches any text str_normalize can change: a digit, or a word starting with one of the words (or word stems, like
+    "eigh" or "wednes") of the recognizers' English patterns. Words of one or two letters (e.g. "h", "pm") must match
+    whole, and `_str_normalize_stopwords` never fire on their own.
+    '''
+    global _str_normalize_trigger_pattern
+    if _str_normalize_trigger_pattern is None:
+        words = _recognizer_words() - _str_normalize_stopwords
+        stems = sorted((word for word in words if len(word) >= 3), key=len, reverse=True)
+        short_words = sorted(word for word in words if len(word) <= 2)
+        _str_normalize_trigger_pattern = re.compile(
+            r"\d|\b(?:{})|\b(?:{})\b".format("|".join(stems), "|".join(short_words)), re.IGNORECASE
+        )
+    return _str_normalize_trigger_pattern
+
+def configure_str_normalize(cache_size: int = None, num_workers: int = None, min_parallel: int = None):
+    '''
+    - cache_size: Normalized strings kept in the in-process LRU cache.
+    - num_workers: Processes used by `str_normalize_batch`; 1 normalizes in the calling process.
+    - min_parallel: Fewest uncached strings in one batch worth sending to the processes.
+    '''
+    updates = {"cache_size": cache_size, "num_workers": num_workers, "min_parallel": min_parallel}
+    str_normalize_config.update({k: v for k, v in updates.items() if v is not None})
+
+def _cache_get(key):
+    with _str_normalize_cache_lock:
+        value = _str_normalize_cache.get(key)
+        if value is not None:
+            _str_normalize_cache.move_to_end(key)
+        return value
+
+def _cache_put(key, value):
+    with _str_normalize_cache_lock:
+        _str_normalize_cache[key] = value
+        _str_normalize_cache.move_to_end(key)
+        while len(_str_normalize_cache) > str_normalize_config["cache_size"]:
+            _str_normalize_cache.popitem(last=False)
+
+def str_normalize_cached(user_input, recognition_types=None) -> str:
+    '''
+    `str_normalize` with the recognizers skipped for text they cannot change, and results memoized on
+    (text, recognition_types). Relative dates ("today") resolve at the time they are first normalized.
+    '''
+    user_input = str(user_input)
+    if not _get_trigger_pattern().search(user_input.replace("\\n", "; ")):
+        return user_input.replace("\\n", "; ")
+    key = (user_input, tuple(recognition_types) if recognition_types is not None else None)
+    value = _cache_get(key)
+    if value is None:
+        value = str_normalize(user_input, recognition_types)
+        _cache_put(key, value)
+    return value
+
+def _str_normalize_chunk(args) -> List[str]:
+    values, recognition_types = args
+    return [str_normalize(value, recognition_types) for value in values]
+
+def _get_str_normalize_pool(num_workers: int):
+    global _str_normalize_pool
+    if _str_normalize_pool is None or _str_normalize_pool._max_workers != num_workers:
+        if _str_normalize_pool is not None:
+            _str_normalize_pool.shutdown()
+        _str_normalize_pool = ProcessPoolExecutor(max_workers=num_workers)
+    return _str_normalize_pool
+
+def str_normalize_batch(values: List, recognition_types=None, num_workers: int = None) -> List[str]:
+    '''
+    `str_normalize_cached` over a whole column. Each distinct uncached text is normalized once; with num_workers > 1
+    (default: `configure_str_normalize`) and at least `min_parallel` of them, they are spread over a process pool.
+    Daemonic processes (e.g. multiprocessing.Pool workers) cannot start one, and normalize in-process.
+    '''
+    num_workers = num_workers or str_normalize_config["num_workers"]
+    trigger_pattern = _get_trigger_pattern()
+    types_key = tuple(recognition_types) if recognition_types is not None else None
+    results, pending = {}, []
+    for value in dict.fromkeys(str(value) for value in values):
+        if not trigger_pattern.search(value.replace("\\n", "; ")):
+            results[value] = value.replace("\\n", "; ")
+            continue
+        cached = _cache_get((value, types_key))
+        if cached is None:
+            pending.append(value)
+        else:
+            results[value] = cached
+
+    if num_workers > 1 and len(pending) >= str_normalize_config["min_parallel"] and not multiprocessing.current_process().daemon:
+        chunk_size = max(1, len(pending) // (num_workers * 4))
+        chunks = [(pending[i:i + chunk_size], recognition_types) for i in range(0, len(pending), chunk_size)]
+        normalized = [value for chunk in _get_str_normalize_pool(num_workers).map(_str_normalize_chunk, chunks) for value in chunk]
+    else:
+        normalized = _str_normalize_chunk((pending, recognition_types))
+    for value, normalized_value in zip(pending, normalized):
+        _cache_put((value, types_key), normalized_value)
+        results[value] = normalized_value
+    return [results[str(value)] for value in values]
+
+def prepare_df_for_mysqldb_from_table(table: Dict, add_row_id=True, normalize=True, lower_case=True, normalize_cells=False):
     header, rows = table['header'], table['rows']
     if add_row_id and 'row_id' not in header:
         header = ["row_id"] + header
         rows = [["{}".format(i)] + row for i, row in enumerate(rows)]
     if normalize:
-        df = convert_df_type(pd.DataFrame(data=rows, columns=header), lower_case=lower_case)
+        df = convert_df_type(pd.DataFrame(data=rows, columns=header), lower_case=lower_case, normalize_cells=normalize_cells)
     else:
         df = pd.DataFrame(data=rows, columns=header)
     return df
 
-def convert_df_type(df: pd.DataFrame, lower_case=True):
-    def get_table_content_in_column(table):
-        if isinstance(table, pd.DataFrame):
-            header = table.columns.tolist()
-            rows = table.values.tolist()
-        else:
-            header, rows = table['header'], table['rows']
-        all_col_values = []
-        for i in range(len(header)):
-            one_col_values = []
-            for _row in rows:
-                one_col_values.append(_row[i])
-            all_col_values.append(one_col_values)
-        return all_col_values
+def _all_number_column(column: pd.Series) -> bool:
+    '''
+    True when every cell is accepted by `float()` or is a None token.
+    Stops at the first cell that is neither, so text columns are usually settled after a few cells.
+    '''
+    none_tokens = [str(None), str(None).lower()]
+    for cell_value in column.tolist():
+        try:
+            float(cell_value)
+        except Exception as e:
+            if not cell_value in none_tokens:
+                return False
+    return True
+
+def convert_df_type(df: pd.DataFrame, lower_case=True, normalize_cells=False):
     new_columns = []
     for idx, header in enumerate(df.columns):
         if header == '':
@@ -110,23 +249,19 @@ def convert_df_type(df: pd.DataFrame, lower_case=True):
     df.columns = new_columns
     null_tokens = ['', '-', '/']
     for header in df.columns:
-        df[header] = df[header].map(lambda x: str(None) if x in null_tokens else x)
-    all_col_values = get_table_content_in_column(df)
-    for col_i, one_col_values in enumerate(all_col_values):
-        all_number_flag = True
-        for row_i, cell_value in enumerate(one_col_values):
-            try:
-                float(cell_value)
-            except Exception as e:
-                if not cell_value in [str(None), str(None).lower()]:
-                    all_number_flag = False
-        if all_number_flag:
-            _header = df.columns[col_i]
-            df[_header] = df[_header].map(lambda x: "NaN" if x in [str(None), str(None).lower()] else x)
-
-    # # Normalize cell values.
-    # for header in df.columns:
-    #     df[header] = df[header].map(lambda x: str_normalize(x))
+        null_cells = df[header].isin(null_tokens)
+        if null_cells.any():
+            df[header] = df[header].mask(null_cells, str(None))
+    for header in df.columns:
+        if _all_number_column(df[header]):
+            null_cells = df[header].isin([str(None), str(None).lower()])
+            if null_cells.any():
+                df[header] = df[header].mask(null_cells, "NaN")
+
+    # Normalize cell values.
+    if normalize_cells:
+        for header in df.columns:
+            df[header] = str_normalize_batch(df[header].tolist())
 
     # # Strip the mis-added "01-01 00:00:00"
     # all_col_values = get_table_content_in_column(df)
@@ -170,7 +305,10 @@ def convert_df_type(df: pd.DataFrame, lower_case=True):
                 new_columns.append(lower_header)
         df.columns = new_columns
         for header in df.columns:
-            df[header] = df[header].map(lambda x: str(x).lower().strip())
+            column = df[header]
+            if pd.api.types.infer_dtype(column, skipna=False) != "string":
+                column = column.map(str)
+            df[header] = column.str.lower().str.strip()
 
     # Recognize header type
     # for header in df.columns:
@@ -211,6 +349,65 @@ def convert_df_type(df: pd.DataFrame, lower_case=True):
 
     return df
 
+_typed_null_tokens = {'', 'none', 'nan', 'null', 'n/a'}
+_typed_number_pattern = re.compile(r'^[-+]?[$€£]?(\d{1,3}(,\d{3})+|\d+)?(\.\d+)?%?$')
+_typed_date_formats = ["%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%B %d, %Y", "%b %d, %Y", "%d %B %Y", "%d %b %Y", "%B %d %Y", "%b %d %Y"]
+
+def _parse_number_column(values: pd.Series):
+    '''
+    Parses cells such as "1,234", "$3.5", "-2" or "12%" (read as 12) into numbers.
+    Returns None unless every non-null cell parses.
+    '''
+    numbers = []
+    for cell_value in values.tolist():
+        if not _typed_number_pattern.match(cell_value) or not any(ch.isdigit() for ch in cell_value):
+            return None
+        numbers.append(float(re.sub(r'[$€£,%]', '', cell_value)))
+    return numbers
+
+def _parse_date_column(values: pd.Series):
+    '''
+    Parses cells written in one of `_typed_date_formats` into ISO dates. Returns None unless one format fits every non-null cell.
+    '''
+    for date_format in _typed_date_formats:
+        dates = pd.to_datetime(values, format=date_format, errors='coerce')
+        if not dates.isna().any():
+            return dates.dt.strftime("%Y-%m-%d").tolist()
+    return None
+
+def add_typed_columns(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Adds a typed shadow column next to each text column whose cells are all numbers or all dates, leaving the original columns as they are:
+    - <column>__num: The numbers, as int64 (SQLite INTEGER) when all of them are whole and none is missing, float64 (REAL) otherwise.
+    - <column>__date: The dates as ISO "YYYY-MM-DD" text, which sorts and compares like dates and works with SQLite's date functions.
+    Missing cells become NULL. Columns that are all null are left alone.
+    '''
+    shadow_columns = {}
+    for header in df.columns:
+        column = df[header].map(lambda x: str(x).strip().lower())
+        present = ~column.isin(_typed_null_tokens)
+        if not present.any():
+            continue
+        numbers = _parse_number_column(column[present])
+        if numbers is not None:
+            name = f"{header}__num"
+            shadow = pd.Series(float("nan"), index=df.index, dtype="float64")
+            shadow[present] = numbers
+            if present.all() and all(number.is_integer() for number in numbers):
+                shadow = shadow.astype("int64")
+            shadow_columns[name] = shadow
+            continue
+        dates = _parse_date_column(column[present])
+        if dates is not None:
+            name = f"{header}__date"
+            shadow = pd.Series(None, index=df.index, dtype="object")
+            shadow[present] = dates
+            shadow_columns[name] = shadow
+    for name, shadow in shadow_columns.items():
+        if name not in df.columns:
+            df[name] = shadow
+    return df
+
 def normalize(x):
     if x is None:
         return None
@@ -231,79 +428,66 @@ def normalize(x):
     x = re.sub('\s+', ' ', x, flags=re.U).lower().strip()
     return x
 
-def post_process_sql(sql_str, df, table_title=None, process_program_with_fuzzy_match_on_db=True, verbose=False):
-    def basic_fix(sql_str, all_headers, table_title=None):
-        def finditer(sub_str: str, mother_str: str):
-            result = []
-            start_index = 0
-            while True:
-                start_index = mother_str.find(sub_str, start_index, -1)
-                if start_index == -1:
-                    break
-                end_idx = start_index + len(sub_str)
-                result.append((start_index, end_idx))
-                start_index = end_idx
-            return result
-        if table_title:
-            sql_str = sql_str.replace("FROM " + table_title, "FROM w")
-            sql_str = sql_str.replace("FROM " + table_title.lower(), "FROM w")
-        while '' in all_headers:
-            all_headers.remove('')
-        sql_str = sql_str.replace("\\n", "\n")
-        sql_str = sql_str.replace("\n", "\\n")
-        all_headers.sort(key=lambda x: len(x), reverse=True)
-        have_matched = [0 for i in range(len(sql_str))]
-        idx_s_single_quotation = [_ for _ in range(1, len(sql_str)) if
-                                  sql_str[_] in ["\'"] and sql_str[_ - 1] not in ["\'"]]
-        idx_s_double_quotation = [_ for _ in range(1, len(sql_str)) if
-                                  sql_str[_] in ["\""] and sql_str[_ - 1] not in ["\""]]
-        for idx_s in [idx_s_single_quotation, idx_s_double_quotation]:
-            if len(idx_s) % 2 == 0:
-                for idx in range(int(len(idx_s) / 2)):
-                    start_idx = idx_s[idx * 2]
-                    end_idx = idx_s[idx * 2 + 1]
-                    have_matched[start_idx: end_idx] = [2 for _ in range(end_idx - start_idx)]
-        for header in all_headers:
-            if (header in sql_str) and (header not in ALL_KEY_WORDS):
-                all_matched_of_this_header = finditer(header, sql_str)
-                for matched_of_this_header in all_matched_of_this_header:
-                    start_idx, end_idx = matched_of_this_header
-                    if all(have_matched[start_idx: end_idx]) == 0 and (not sql_str[start_idx - 1] == "`") and (
-                            not sql_str[end_idx] == "`"):
-                        have_matched[start_idx: end_idx] = [1 for _ in range(end_idx - start_idx)]
-        start_have_matched = [0] + have_matched
-        end_have_matched = have_matched + [0]
-        start_idx_s = [idx - 1 for idx in range(1, len(start_have_matched)) if
-                       start_have_matched[idx - 1] == 0 and start_have_matched[idx] == 1]
-        end_idx_s = [idx for idx in range(len(end_have_matched) - 1) if
-                     end_have_matched[idx] == 1 and end_have_matched[idx + 1] == 0]
-        assert len(start_idx_s) == len(end_idx_s)
-        spans = []
-        current_idx = 0
-        for start_idx, end_idx in zip(start_idx_s, end_idx_s):
-            spans.append(sql_str[current_idx:start_idx])
-            spans.append(sql_str[start_idx:end_idx + 1])
-            current_idx = end_idx + 1
-        spans.append(sql_str[current_idx:])
-        sql_str = '`'.join(spans)
-
-        return sql_str
+_single_quote_pattern = re.compile(r"(?<=[^'])'")
+_double_quote_pattern = re.compile(r'(?<=[^"])"')
+_header_run_pattern = re.compile(rb"\x01+")
+
+def basic_fix(sql_str, all_headers, table_title=None):
+    '''
+    Wraps header names used in `sql_str` in backticks and renames the table to w.
+    Headers are matched longest first; an occurrence is taken unless it is already inside a backticked name or wholly
+    covered by longer headers and quoted literals, and the runs of taken characters are then wrapped.
+    Character states live in one bytearray (0 free, 1 header, 2 quoted), so the scans below run in C.
+    '''
+    if table_title:
+        sql_str = sql_str.replace("FROM " + table_title, "FROM w")
+        sql_str = sql_str.replace("FROM " + table_title.lower(), "FROM w")
+    while '' in all_headers:
+        all_headers.remove('')
+    sql_str = sql_str.replace("\\n", "\n")
+    sql_str = sql_str.replace("\n", "\\n")
+    all_headers.sort(key=lambda x: len(x), reverse=True)
+    have_matched = bytearray(len(sql_str))
+    for quote_pattern in [_single_quote_pattern, _double_quote_pattern]:
+        idx_s = [m.start() for m in quote_pattern.finditer(sql_str)]
+        if len(idx_s) % 2 == 0:
+            for start_idx, end_idx in zip(idx_s[0::2], idx_s[1::2]):
+                have_matched[start_idx: end_idx] = b"\x02" * (end_idx - start_idx)
+    for header in all_headers:
+        if (header in sql_str) and (header not in ALL_KEY_WORDS):
+            start_idx = sql_str.find(header, 0, -1)
+            while start_idx != -1:
+                end_idx = start_idx + len(header)
+                # At least one character not yet taken by a longer header or a literal
+                if have_matched.find(0, start_idx, end_idx) != -1 and (not sql_str[start_idx - 1] == "`") and (
+                        not sql_str[end_idx] == "`"):
+                    have_matched[start_idx: end_idx] = b"\x01" * (end_idx - start_idx)
+                start_idx = sql_str.find(header, end_idx, -1)
+    # A run of header characters opens after a free character (or the start) and closes before one (or the end);
+    # runs touching a quoted literal lack one of the two, as before
+    start_idx_s, end_idx_s = [], []
+    for m in _header_run_pattern.finditer(have_matched):
+        start_idx, end_idx = m.span()
+        if start_idx == 0 or have_matched[start_idx - 1] == 0:
+            start_idx_s.append(start_idx)
+        if end_idx == len(have_matched) or have_matched[end_idx] == 0:
+            end_idx_s.append(end_idx - 1)
+    assert len(start_idx_s) == len(end_idx_s)
+    spans = []
+    current_idx = 0
+    for start_idx, end_idx in zip(start_idx_s, end_idx_s):
+        spans.append(sql_str[current_idx:start_idx])
+        spans.append(sql_str[start_idx:end_idx + 1])
+        current_idx = end_idx + 1
+    spans.append(sql_str[current_idx:])
+    return '`'.join(spans)
 
+def post_process_sql(sql_str, df, table_title=None, process_program_with_fuzzy_match_on_db=True, verbose=False):
     def fuzzy_match_process(sql_str, df, verbose=False):
+        value_index = get_table_value_index(df)
+
         def _get_matched_cells(value_str, df, fuzz_threshold=70):
-            matched_cells = []
-            for row_id, row in df.iterrows():
-                for cell in row:
-                    cell = str(cell)
-                    fuzz_score = fuzz.ratio(value_str, cell)
-                    if fuzz_score == 100:
-                        matched_cells = [(cell, fuzz_score)]
-                        return matched_cells
-                    if fuzz_score >= fuzz_threshold:
-                        matched_cells.append((cell, fuzz_score))
-
-            matched_cells = sorted(matched_cells, key=lambda x: x[1], reverse=True)
-            return matched_cells
+            return value_index.cells.match(value_str, fuzz_threshold)
 
         def _check_valid_fuzzy_match(value_str, matched_cell):
             number_pattern = "[+]?[.]?[\d]+(?:,\d\d\d)*[\.]?\d*(?:[eE][-+]?\d+)?"
@@ -378,15 +562,7 @@ def post_process_sql(sql_str, df, table_title=None, process_program_with_fuzzy_m
         new_sql_str = ' '.join(sql_tokens)
         sql_columns = re.findall('`\s(.*?)\s`', new_sql_str)
         for sql_col in sql_columns:
-            matched_columns = []
-            for col in df.columns:
-                score = fuzz.ratio(sql_col.lower(), col)
-                if score == 100:
-                    matched_columns = [(col, score)]
-                    break
-                if score >= 80:
-                    matched_columns.append((col, score))
-            matched_columns = sorted(matched_columns, key=lambda x: x[1], reverse=True)
+            matched_columns = value_index.columns.match(sql_col.lower(), 80)
             if matched_columns:
                 matched_col = matched_columns[0][0]
                 new_sql_str = new_sql_str.replace(f"` {sql_col} `", f"`{matched_col}`")
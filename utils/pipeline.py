@@ -1,9 +1,12 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from utils.load_data import *
-from utils.myllm import MyChatGPT
+from utils.myllm import MyChatGPT, cancel_on
 from utils.database import MYSQLDB
 from utils.helper import PipelineContext, AgentResult
+from utils.sql.canonical import sql_fingerprint
 from utils.general_prompt import *
-from utils.reasoner import SUFFICIENCY_agent, ANSWER_agent
+from utils.reasoner import SUFFICIENCY_agent, ANSWER_agent, SUFFICIENCY_ANSWER_agent
 # from utils.agents.text_helper import DECOMPOSE_agent_t, COMPOSE_agent_t, DECOMPOSE_needs
 from utils.agents.column_selector import SELECT_clause, BASIC_clause
 from utils.agents.withas import WITHAS_clause
@@ -13,18 +16,168 @@ from utils.agents.order2 import ORDERBY_clause2
 from utils.agents.aggfunc1 import AggFun_clause1
 from utils.agents.order1 import ORDERBY_clause1
 
+agent_map = {
+    "Basic": BASIC_clause,
+    "WithAs": WITHAS_clause,
+    "TempTable": TEMP_table_prompt,
+    "Where": WHERE_clause,
+    "Select": SELECT_clause,
+    "Agg2": AggFun_clause2,
+    "Order2": ORDERBY_clause2,
+    "Agg1": AggFun_clause1,
+    "Order1": ORDERBY_clause1,
+}
+
+def _check_key(ctx: PipelineContext, sql_query: str) -> tuple:
+    return sql_fingerprint(sql_query), ctx.prompt_schema
+
+def _run_check(ctx: PipelineContext, standard_answer: str, sql_query: str, sql_result: dict = None) -> tuple[bool, tuple | None, dict]:
+    '''
+    Sufficiency check of one SQL without touching `ctx` or the pipeline log, so it can run off the main thread.
+    Returns the flag, the fused answer (answer_flag, generated_answer) or None, and the log entries the check wrote.
+    '''
+    entries = {}
+    if ctx.fused_answer:
+        sufficiency_flag, answer_flag, generated_answer, entries = SUFFICIENCY_ANSWER_agent(
+            llm = ctx.llm, sqldb = ctx.sqldb, question = ctx.question, prompt_schema = ctx.prompt_schema, title = ctx.title,
+            standard_answer = standard_answer, sql_query = sql_query, log = entries, sql_result = sql_result,
+            max_rows = ctx.result_max_rows, max_tokens = ctx.result_max_tokens
+        )
+        return sufficiency_flag, (answer_flag, generated_answer), entries
+    sufficiency_flag = SUFFICIENCY_agent(
+        llm = ctx.llm, sqldb = ctx.sqldb, question = ctx.question, prompt_schema = ctx.prompt_schema, title = ctx.title,
+        standard_answer = standard_answer, sql_query = sql_query, log = entries, sql_result = sql_result,
+        max_rows = ctx.result_max_rows, max_tokens = ctx.result_max_tokens
+    )
+    return sufficiency_flag, None, entries
+
+def _record_check(ctx: PipelineContext, sql_query: str, log: dict, check: tuple[bool, tuple | None, dict]) -> tuple[bool, tuple | None]:
+    '''
+    Merges a `_run_check` result into the log and `ctx.checked_sqls`. Call it on the main thread.
+    '''
+    sufficiency_flag, answer, entries = check
+    log.update(entries)
+    if answer is not None:
+        answer = answer + (log,)
+    ctx.checked_sqls[_check_key(ctx, sql_query)] = sufficiency_flag, answer
+    return sufficiency_flag, answer
+
+def _check_sql(ctx: PipelineContext, standard_answer: str, sql_query: str, log: dict, sql_result: dict = None) -> tuple[bool, tuple | None]:
+    '''
+    Sufficiency check of one SQL. With `ctx.fused_answer` the check also answers the question in the same call,
+    and that answer (answer_flag, generated_answer, log) is returned next to the flag; otherwise it is None.
+    A SQL already checked against the same schema (see `ctx.checked_sqls`) gets its earlier verdict.
+    '''
+    key = _check_key(ctx, sql_query)
+    if key in ctx.checked_sqls:
+        return ctx.checked_sqls[key]
+    return _record_check(ctx, sql_query, log, _run_check(ctx, standard_answer, sql_query, sql_result))
+
+def _answer_sql(ctx: PipelineContext, standard_answer: str, sql_query: str, log: dict, answer: tuple = None) -> tuple[bool, str, dict]:
+    '''
+    Answer from a sufficient SQL, reusing the fused check's answer when there is one.
+    '''
+    if answer is not None:
+        return answer
+    return ANSWER_agent(
+        llm = ctx.llm, sqldb = ctx.sqldb, question = ctx.question, prompt_schema = ctx.prompt_schema, title = ctx.title,
+        standard_answer = standard_answer, sql_query = sql_query, log = log,
+        max_rows = ctx.result_max_rows, max_tokens = ctx.result_max_tokens
+    )
+
+def _static_check(ctx: PipelineContext, sql: str) -> tuple[str, bool]:
+    '''
+    With `ctx.static_check`, checks a generated SQL against the database schema without running it. A SQL whose only
+    problems are misspelled column or table names with one clear closest match is repaired, and the repair is logged
+    under "repairs". Returns the SQL to use and whether it passed the check.
+    '''
+    if not ctx.static_check:
+        return sql, True
+    diagnostic = ctx.sqldb.validate_query(sql)
+    if diagnostic.repaired_sql is not None:
+        ctx.log.setdefault("repairs", []).append({"sql": sql, "repaired_sql": diagnostic.repaired_sql, "error": diagnostic.error_message()})
+        return diagnostic.repaired_sql, True
+    return sql, diagnostic.valid
+
+def _screen_candidates(ctx: PipelineContext, sql_1: str, sql_2: str) -> tuple[str, str | None]:
+    '''
+    Static check of the Basic agent's two candidates. A candidate that fails it is dropped when the other one passes,
+    and sql_2 is dropped when it is the same query as sql_1 (same `sql_fingerprint`), which saves its execution and
+    sufficiency check.
+    '''
+    sql_1, valid_1 = _static_check(ctx, sql_1)
+    if not sql_2:
+        return sql_1, sql_2
+    sql_2, valid_2 = _static_check(ctx, sql_2)
+    if sql_fingerprint(sql_2) == sql_fingerprint(sql_1):
+        return sql_1, None
+    if valid_1 and not valid_2:
+        return sql_1, None
+    if valid_2 and not valid_1:
+        return sql_2, None
+    return sql_1, sql_2
+
+def _recent_distinct_sqls(sqls: list) -> list:
+    '''
+    The logged SQLs, most recent first, keeping one of each `sql_fingerprint`.
+    '''
+    seen = set()
+    distinct = []
+    for sql in reversed(sqls):
+        fingerprint = sql_fingerprint(sql)
+        if fingerprint not in seen:
+            seen.add(fingerprint)
+            distinct.append(sql)
+    return distinct
+
+def _sequential_sufficiency(ctx: PipelineContext, standard_answer: str, sql_1: str, sql_2: str, log: dict) -> tuple[str | None, tuple | None]:
+    '''
+    Checks sql_1 and, only if it is not sufficient, sql_2. Returns the first accepted candidate with its
+    fused answer (see `_check_sql`), or (None, None).
+    '''
+    for sql in [sql_1] + ([sql_2] if sql_2 else []):
+        sufficiency_flag, answer = _check_sql(ctx, standard_answer, sql, log)
+        if sufficiency_flag:
+            return sql, answer
+    return None, None
+
+def _speculative_sufficiency(ctx: PipelineContext, standard_answer: str, sql_1: str, sql_2: str, log: dict) -> tuple[str | None, tuple | None]:
+    '''
+    Runs the sufficiency checks of both candidate SQLs concurrently and returns the first accepted one,
+    with sql_1 taking precedence, like `_sequential_sufficiency`. The queries run up front on this thread
+    (the connection is not shared across threads); only the LLM calls overlap. When sql_1 wins, the sql_2
+    check is cancelled if its request has not been sent yet (see `cancel_on`); a request already in flight
+    runs to completion, is paid for and counts against the shared rpm/tpm quota, and its verdict is discarded.
+    The workers only return their verdicts (see `_run_check`); they are merged into the log and `ctx.checked_sqls`
+    here in sql_1, sql_2 order, so both end up as after `_sequential_sufficiency`. Candidates already checked are
+    not checked again.
+    '''
+    candidates = [sql for sql in (sql_1, sql_2) if _check_key(ctx, sql) not in ctx.checked_sqls]
+    if not candidates:
+        return _sequential_sufficiency(ctx, standard_answer, sql_1, sql_2, log)
+    results = {sql: ctx.sqldb.execute_query(sql, max_rows = ctx.result_max_rows) for sql in candidates}
+    cancelled = threading.Event()
+
+    def check(sql: str) -> tuple[bool, tuple | None, dict]:
+        with cancel_on(cancelled):
+            return _run_check(ctx, standard_answer, sql, results[sql])
+
+    executor = ThreadPoolExecutor(max_workers=len(candidates))
+    futures = {sql: executor.submit(check, sql) for sql in candidates}
+    try:
+        for sql in (sql_1, sql_2):
+            if sql in futures:
+                sufficiency_flag, answer = _record_check(ctx, sql, log, futures[sql].result())
+            else:
+                sufficiency_flag, answer = ctx.checked_sqls[_check_key(ctx, sql)]
+            if sufficiency_flag:
+                return sql, answer
+        return None, None
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
 def agent_pipeline(ctx: PipelineContext, standard_answer: str) -> tuple[bool, bool, str, str, dict]:
-    agent_map = {
-        "Basic": BASIC_clause,
-        "WithAs": WITHAS_clause,
-        "TempTable": TEMP_table_prompt,
-        "Where": WHERE_clause,
-        "Select": SELECT_clause,
-        "Agg2": AggFun_clause2,
-        "Order2": ORDERBY_clause2,
-        "Agg1": AggFun_clause1,
-        "Order1": ORDERBY_clause1,
-    }
     valid_flag = True
     answer_flag = False
     sufficiency_flag = False
@@ -39,30 +192,15 @@ def agent_pipeline(ctx: PipelineContext, standard_answer: str) -> tuple[bool, bo
         valid_flag = result.flag_valid
         if not valid_flag:
             raise ValueError("Invalid SQL query generated by Basic Agent.")
-        sql_1 = result.updates["sql1"]
-        sql_2 = result.updates["sql2"]
+        sql_1, sql_2 = _screen_candidates(ctx, result.updates["sql1"], result.updates["sql2"])
 
-        sufficiency_flag = SUFFICIENCY_agent(
-            llm = ctx.llm, sqldb = ctx.sqldb, question = ctx.question, prompt_schema = ctx.prompt_schema, title = ctx.title,
-            standard_answer = standard_answer, sql_query = sql_1, log = log
-        )
-        if sufficiency_flag:
-            answer_flag, generated_answer, log = ANSWER_agent(
-                llm = ctx.llm, sqldb = ctx.sqldb, question = ctx.question, prompt_schema = ctx.prompt_schema, title = ctx.title,
-                standard_answer = standard_answer, sql_query = sql_1, log = log
-            )
-            return valid_flag, answer_flag, sql_1, generated_answer, log
-        if sql_2:
-            sufficiency_flag = SUFFICIENCY_agent(
-                llm = ctx.llm, sqldb = ctx.sqldb, question = ctx.question, prompt_schema = ctx.prompt_schema, title = ctx.title,
-                standard_answer = standard_answer, sql_query = sql_2, log = log
-            )
-            if sufficiency_flag:
-                answer_flag, generated_answer, log = ANSWER_agent(
-                    llm = ctx.llm, sqldb = ctx.sqldb, question = ctx.question, prompt_schema = ctx.prompt_schema, title = ctx.title,
-                    standard_answer = standard_answer, sql_query = sql_2, log = log
-                )
-                return valid_flag, answer_flag, sql_2, generated_answer, log
+        if ctx.speculative and sql_2:
+            sufficient_sql, answer = _speculative_sufficiency(ctx, standard_answer, sql_1, sql_2, log)
+        else:
+            sufficient_sql, answer = _sequential_sufficiency(ctx, standard_answer, sql_1, sql_2, log)
+        if sufficient_sql:
+            answer_flag, generated_answer, log = _answer_sql(ctx, standard_answer, sufficient_sql, log, answer)
+            return valid_flag, answer_flag, sufficient_sql, generated_answer, log
 
         sql_query = sql_1
         ctx.previous_sql_query = sql_1
@@ -73,13 +211,17 @@ def agent_pipeline(ctx: PipelineContext, standard_answer: str) -> tuple[bool, bo
             valid_flag = result.flag_valid
             ctx.flag = False
             if not valid_flag:
-                for sql_query in reversed(ctx.log["sqls"]):
-                    sql_result = ctx.sqldb.execute_query(sql_query)
+                for sql_query in _recent_distinct_sqls(ctx.log["sqls"]):
+                    sql_query, static_valid = _static_check(ctx, sql_query)
+                    if not static_valid:
+                        continue
+                    sql_result = ctx.sqldb.execute_query(sql_query, max_rows = ctx.result_max_rows)
                     if sql_result:
                         ctx.previous_sql_query = sql_query
                         answer_flag, generated_answer, log = ANSWER_agent(
                             llm = ctx.llm, sqldb = ctx.sqldb, question = ctx.question, prompt_schema = ctx.prompt_schema, title = ctx.title,
-                            standard_answer = standard_answer, sql_query = sql_query, log = log
+                            standard_answer = standard_answer, sql_query = sql_query, log = log,
+                            max_rows = ctx.result_max_rows, max_tokens = ctx.result_max_tokens
                         )
                         return valid_flag, answer_flag, sql_query, generated_answer, log
                 raise ValueError(f"Invalid SQL query generated by {current_agent} Agent.")
@@ -99,23 +241,19 @@ def agent_pipeline(ctx: PipelineContext, standard_answer: str) -> tuple[bool, bo
                 continue
             else:
                 ctx.flag = True
-            sufficiency_flag = SUFFICIENCY_agent(
-                llm = ctx.llm, sqldb = ctx.sqldb, question = ctx.question, prompt_schema = ctx.prompt_schema, title = ctx.title,
-                standard_answer = standard_answer, sql_query = sql_query, log = log
-            )
+            sql_query, _ = _static_check(ctx, sql_query)
+            sufficiency_flag, answer = _check_sql(ctx, standard_answer, sql_query, log)
             if sufficiency_flag:
-                answer_flag, generated_answer, log = ANSWER_agent(
-                    llm = ctx.llm, sqldb = ctx.sqldb, question = ctx.question, prompt_schema = ctx.prompt_schema, title = ctx.title,
-                    standard_answer = standard_answer, sql_query = sql_query, log = log
-                )
+                answer_flag, generated_answer, log = _answer_sql(ctx, standard_answer, sql_query, log, answer)
                 return valid_flag, answer_flag, sql_query, generated_answer, log
             ctx.previous_sql_query = sql_query
         answer_flag, generated_answer, log = ANSWER_agent(
             llm = ctx.llm, sqldb = ctx.sqldb, question = ctx.question, prompt_schema = ctx.prompt_schema, title = ctx.title,
-            standard_answer = standard_answer, sql_query = sql_query, log = log
+            standard_answer = standard_answer, sql_query = sql_query, log = log,
+            max_rows = ctx.result_max_rows, max_tokens = ctx.result_max_tokens
         )
         return valid_flag, answer_flag, sql_query, generated_answer, log
     except Exception as e:
         valid_flag = False
         print("Error: ", e)
-        return valid_flag, answer_flag, sql_query, generated_answer, log
\ No newline at end of file
+        return valid_flag, answer_flag, sql_query, generated_answer, log
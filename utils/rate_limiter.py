@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+def estimate_request_tokens(messages: list, options: dict = None) -> int:
+    '''
+    Rough token cost of a chat request as counted against a tokens-per-minute quota:
+    prompt tokens (about 4 characters each) plus the requested completion budget.
+    '''
+    options = options or {}
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    completion_tokens = options.get("max_tokens") or 0
+    return prompt_chars // 4 + completion_tokens * (options.get("n") or 1)
+
+def retry_after_seconds(error: Exception) -> float | None:
+    '''
+    Reads the server-suggested wait from an API error's `retry-after-ms` / `retry-after` headers.
+    '''
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+def backoff_delay(attempt: int, retry_after: float = None, base: float = 2.0, cap: float = 60.0) -> float:
+    '''
+    Exponential backoff with full jitter. A server-provided Retry-After wins, with a little jitter
+    on top so that workers released at the same moment do not retry in lockstep.
+    '''
+    if retry_after is not None:
+        return retry_after + random.uniform(0, min(1.0, retry_after * 0.1 + 0.1))
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class RateLimiter(object):
+    '''
+    Token-bucket limiter on requests per minute and tokens per minute.
+    - requests_per_minute / tokens_per_minute: The account quota; None disables that bucket.
+    - state_path: JSON file holding the bucket state. Processes sharing the path (e.g. Pool workers)
+      draw from the same buckets; the file is guarded by an exclusive lock.
+    After a 429 every sharer pauses until the advertised Retry-After and the buckets restart empty,
+    so throughput ramps back up at the quota rate instead of bursting into another 429.
+    '''
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None, state_path: str = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.state_path = state_path if fcntl is not None else None
+        self._lock = threading.Lock()
+        self._state = None
+        if self.state_path:
+            dir_name = os.path.dirname(self.state_path)
+            if dir_name:
+                os.makedirs(dir_name, exist_ok=True)
+            self._lock_path = self.state_path + ".lock"
+
+    def _initial_state(self, now: float) -> dict:
+        return {
+            "requests": self.requests_per_minute or 0,
+            "tokens": self.tokens_per_minute or 0,
+            "updated": now,
+            "blocked_until": 0.0,
+        }
+
+    def _load(self, now: float) -> dict:
+        if not self.state_path:
+            if self._state is None:
+                self._state = self._initial_state(now)
+            return self._state
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return self._initial_state(now)
+
+    def _store(self, state: dict):
+        if not self.state_path:
+            self._state = state
+            return
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _update(self, fn):
+        with self._lock:
+            if not self.state_path:
+                return fn(time.time())
+            with open(self._lock_path, "a") as lock_fp:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+                try:
+                    return fn(time.time())
+                finally:
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+    def _refill(self, state: dict, now: float):
+        elapsed = now - state["updated"]
+        if elapsed <= 0:
+            return
+        if self.requests_per_minute:
+            state["requests"] = min(self.requests_per_minute, state["requests"] + elapsed * self.requests_per_minute / 60.0)
+        if self.tokens_per_minute:
+            state["tokens"] = min(self.tokens_per_minute, state["tokens"] + elapsed * self.tokens_per_minute / 60.0)
+        state["updated"] = now
+
+    def _try_acquire(self, tokens: int) -> float:
+        '''
+        Takes one request and `tokens` tokens if available; otherwise returns how long to wait.
+        '''
+        def fn(now):
+            state = self._load(now)
+            self._refill(state, now)
+            wait = 0.0
+            if state["blocked_until"] > now:
+                wait = state["blocked_until"] - now
+            else:
+                if self.requests_per_minute and state["requests"] < 1:
+                    wait = max(wait, (1 - state["requests"]) * 60.0 / self.requests_per_minute)
+                if self.tokens_per_minute:
+                    needed = min(tokens, self.tokens_per_minute)
+                    if state["tokens"] < needed:
+                        wait = max(wait, (needed - state["tokens"]) * 60.0 / self.tokens_per_minute)
+                if wait == 0.0:
+                    if self.requests_per_minute:
+                        state["requests"] -= 1
+                    if self.tokens_per_minute:
+                        state["tokens"] -= min(tokens, self.tokens_per_minute)
+            self._store(state)
+            return wait
+        return self._update(fn)
+
+    def acquire(self, tokens: int = 0):
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def penalize(self, delay: float):
+        '''
+        Pauses every process sharing this limiter for `delay` seconds and empties the buckets.
+        '''
+        def fn(now):
+            state = self._load(now)
+            state["blocked_until"] = max(state["blocked_until"], now + delay)
+            state["requests"] = 0
+            state["tokens"] = 0
+            state["updated"] = state["blocked_until"]
+            self._store(state)
+        self._update(fn)
+
+_limiters = {}
+
+def get_rate_limiter(requests_per_minute: float = None, tokens_per_minute: float = None,
+                     state_path: str = "tmp/rate_limiter.json") -> RateLimiter | None:
+    '''
+    Returns the process-wide limiter for the given quota, or None when no quota is configured.
+    '''
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    key = (os.getpid(), requests_per_minute, tokens_per_minute, state_path)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = RateLimiter(requests_per_minute, tokens_per_minute, state_path)
+        _limiters[key] = limiter
+    return limiter
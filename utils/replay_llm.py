@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import random
+import threading
+from types import SimpleNamespace
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from utils.llm_cache import LLMCache, make_cache_key
+from utils.myllm import MyChatGPT
+from utils.http_clients import get_openai_client
+
+class CassetteMiss(KeyError):
+    pass
+
+class Cassette(object):
+    '''
+    JSONL file of recorded chat completions, one request/response pair per line, keyed like the LLM cache.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+    def get(self, key: str) -> dict | None:
+        return self.entries.get(key)
+
+    def put(self, entry: dict):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.entries[entry["key"]] = entry
+            # Pool workers recording to the same cassette append under an exclusive lock, so lines never interleave
+            with open(self.path, "a", encoding="utf-8") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(line)
+                    f.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+_cassettes = {}
+
+def get_cassette(path: str) -> Cassette:
+    '''
+    Loads each cassette once per process.
+    '''
+    key = (os.getpid(), os.path.abspath(path))
+    cassette = _cassettes.get(key)
+    if cassette is None:
+        cassette = Cassette(path)
+        _cassettes[key] = cassette
+    return cassette
+
+class LatencyModel(object):
+    '''
+    Synthetic response time: a fixed round trip plus a per-output-token decode cost, with optional jitter.
+    '''
+    def __init__(self, base: float = 0.5, per_token: float = 0.02, jitter: float = 0.0):
+        self.base = base
+        self.per_token = per_token
+        self.jitter = jitter
+
+    def delay(self, contents: list) -> float:
+        tokens = sum(len(content or "") for content in contents) // 4
+        return max(0.0, self.base + self.per_token * tokens + random.uniform(-self.jitter, self.jitter))
+
+def _make_response(entry: dict):
+    usage = entry.get("usage") or {}
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content)) for content in entry["responses"]],
+        usage=SimpleNamespace(
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+        ),
+    )
+
+def _request_key(kwargs: dict) -> tuple[str, dict]:
+    options = {k: v for k, v in kwargs.items() if k not in ("model", "messages", "stop", "seed")}
+    key = make_cache_key(kwargs.get("model"), kwargs.get("messages"), kwargs.get("stop"), options, kwargs.get("seed"))
+    return key, options
+
+class CassetteClient(object):
+    '''
+    Stand-in for `openai.OpenAI` exposing `chat.completions.create`.
+    - mode "replay": Serve recorded responses; an unrecorded request raises CassetteMiss.
+    - mode "record": Forward to `inner` (a real client) and append every response to the cassette.
+    - mode "auto": Replay when recorded, otherwise record.
+    '''
+    def __init__(self, cassette: Cassette, mode: str = "replay", inner=None, latency: LatencyModel = None):
+        if mode not in ("replay", "record", "auto"):
+            raise ValueError(f"Invalid cassette mode '{mode}'. Supported modes: replay, record, auto")
+        if mode != "replay" and inner is None:
+            raise ValueError(f"Cassette mode '{mode}' requires a real client to record from.")
+        self.cassette = cassette
+        self.mode = mode
+        self.inner = inner
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _lookup(self, key: str):
+        if self.mode == "record":
+            return None
+        entry = self.cassette.get(key)
+        if entry is None and self.mode == "replay":
+            raise CassetteMiss(f"No recorded response for request {key[:12]}; record it first with mode='record'.")
+        return entry
+
+    def _record(self, key: str, kwargs: dict, options: dict, response) -> dict:
+        usage = getattr(response, "usage", None)
+        entry = {
+            "key": key,
+            "model": kwargs.get("model"),
+            "messages": kwargs.get("messages"),
+            "stop": kwargs.get("stop"),
+            "options": options,
+            "responses": [choice.message.content for choice in response.choices],
+            "usage": {
+                "prompt_tokens": getattr(usage, "prompt_tokens", 0),
+                "completion_tokens": getattr(usage, "completion_tokens", 0),
+            },
+        }
+        self.cassette.put(entry)
+        return entry
+
+    def create(self, **kwargs):
+        key, options = _request_key(kwargs)
+        entry = self._lookup(key)
+        if entry is None:
+            response = self.inner.chat.completions.create(**kwargs)
+            return _make_response(self._record(key, kwargs, options, response))
+        if self.latency is not None:
+            time.sleep(self.latency.delay(entry["responses"]))
+        return _make_response(entry)
+
+class ReplayChatGPT(MyChatGPT):
+    '''
+    Drop-in MyChatGPT backed by a cassette, for running the pipelines without an API key.
+    Record once with a key and mode="record", then replay deterministically with mode="replay".
+    Caching, rate limiting and retries of MyChatGPT stay on the call path, so profiles match real runs minus the network.
+    '''
+    def __init__(self, model_name: str, cassette_path: str, mode: str = "replay", key: str = None,
+                 latency: LatencyModel = None, cache: LLMCache = None):
+        cassette = get_cassette(cassette_path)
+        inner = get_openai_client(key) if mode != "replay" else None
+        super().__init__(
+            model_name, key, cache=cache,
+            client=CassetteClient(cassette, mode, inner, latency),
+        )
+        self.cassette = cassette
@@ -0,0 +1,158 @@
+import hashlib
+import re
+from functools import lru_cache
+from utils.sql.tokens import SQLITE_KEYWORDS, tokenize_sql, number_pattern, plain_name_pattern
+
+# SQLite compares names case-insensitively for ASCII letters only
+_ascii_lower = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+# Quoted, these are column names; bare, they can also be the row id or a boolean literal
+_unquoted_meanings = frozenset(("rowid", "oid", "_rowid_", "true", "false"))
+_equivalent_ops = {"==": "=", "<>": "!="}
+_atom_kinds = frozenset(("name", "literal"))
+# Parentheses around a single name or literal after these are redundant ("WHERE x = (1)")
+_operand_ops = frozenset(("=", "!=", "<", ">", "<=", ">=", "+", "-", "*", "/", "%", "||"))
+_operand_keywords = frozenset(("WHERE", "AND", "OR", "NOT", "ON", "HAVING", "WHEN", "THEN", "ELSE", "BETWEEN", "LIKE", "IS"))
+# Parentheses around a whole WHERE / HAVING / ON condition are redundant when one of these follows it
+_condition_keywords = frozenset(("WHERE", "HAVING", "ON"))
+_clause_end_keywords = frozenset((
+    "GROUP", "ORDER", "LIMIT", "HAVING", "WINDOW", "UNION", "INTERSECT", "EXCEPT", "JOIN", "LEFT", "RIGHT", "FULL",
+    "INNER", "CROSS", "NATURAL", "WHERE", "RETURNING",
+))
+_query_starts = frozenset(("keyword", keyword) for keyword in ("SELECT", "WITH", "VALUES"))
+
+def _canonical_tokens(sql: str) -> list | None:
+    '''
+    [(kind, text)] of the tokens of `sql` in canonical spelling, with kind "keyword", "name", "literal" or "op";
+    None when `sql` has a token SQLite does not recognize (e.g. an unterminated quote).
+    '''
+    tokens = []
+    sql_tokens = tokenize_sql(sql)
+    # SQLite matches window names by their text, quotes included, so quoted names are kept as written there
+    has_windows = any(kind == "keyword" and value in ("over", "window") for kind, value, _, _ in sql_tokens)
+    for kind, value, start, end in sql_tokens:
+        text = sql[start:end]
+        if kind == "keyword":
+            tokens.append(("keyword", value.upper()))
+        elif kind == "name":
+            tokens.append(("name", text.translate(_ascii_lower)))
+        elif kind == "quoted" and has_windows:
+            tokens.append(("name", text))
+        elif kind == "quoted":
+            name = text[1:-1].replace("``", "`") if text[0] == "`" else text[1:-1]
+            name = name.translate(_ascii_lower)
+            if plain_name_pattern.fullmatch(name) and name not in SQLITE_KEYWORDS and name not in _unquoted_meanings:
+                tokens.append(("name", name))
+            else:
+                tokens.append(("name", "`{}`".format(name.replace("`", "``"))))
+        elif kind == "number":
+            if text.isascii() and text.isdigit():
+                text = str(int(text))
+            elif number_pattern.fullmatch(text):
+                text = text.lower()
+            tokens.append(("literal", text))
+        elif kind in ("string", "dquote", "param"):
+            # A double-quoted name that matches no column is a string literal, so it is kept as written
+            tokens.append(("literal", text))
+        elif kind == "op":
+            tokens.append(("op", _equivalent_ops.get(text, text)))
+        else:
+            return None
+    return tokens
+
+def _matching_parens(tokens: list) -> dict:
+    pairs, stack = {}, []
+    for i, token in enumerate(tokens):
+        if token == ("op", "("):
+            stack.append(i)
+        elif token == ("op", ")") and stack:
+            pairs[stack.pop()] = i
+    return pairs
+
+def _has_top_level_comma(tokens: list, start: int, end: int) -> bool:
+    depth = 0
+    for token in tokens[start:end]:
+        if token == ("op", "("):
+            depth += 1
+        elif token == ("op", ")"):
+            depth -= 1
+        elif token == ("op", ",") and depth == 0:
+            return True
+    return False
+
+def _is_redundant(tokens: list, pairs: dict, open_at: int, close_at: int) -> bool:
+    before = tokens[open_at - 1] if open_at > 0 else None
+    after = tokens[close_at + 1] if close_at + 1 < len(tokens) else None
+    inner = tokens[open_at + 1:close_at]
+    if not inner or inner[0] in _query_starts:
+        # "()" and subqueries keep their parentheses
+        return False
+    # "((x))"; a list or row value inside keeps its own parentheses
+    if pairs.get(open_at + 1) == close_at - 1 and not _has_top_level_comma(tokens, open_at + 2, close_at - 1) \
+            and tokens[open_at + 2] not in _query_starts:
+        return True
+    if before is None:
+        return False
+    # "= (1)", "WHERE (x)"
+    if len(inner) == 1 and inner[0][0] in _atom_kinds and (
+        (before[0] == "op" and before[1] in _operand_ops) or (before[0] == "keyword" and before[1] in _operand_keywords)
+    ):
+        return after is None or after[1] not in (".", "(")
+    # "WHERE (a = 1 AND b = 2) ORDER BY ..."
+    return before[0] == "keyword" and before[1] in _condition_keywords and not _has_top_level_comma(tokens, open_at + 1, close_at) \
+        and (after is None or after == ("op", ")") or (after[0] == "keyword" and after[1] in _clause_end_keywords))
+
+def _drop_redundant_parens(tokens: list) -> list:
+    while True:
+        pairs = _matching_parens(tokens)
+        for open_at, close_at in sorted(pairs.items()):
+            if _is_redundant(tokens, pairs, open_at, close_at):
+                tokens = tokens[:open_at] + tokens[open_at + 1:close_at] + tokens[close_at + 1:]
+                break
+        else:
+            return tokens
+
+def _join_tokens(tokens: list) -> str:
+    parts = []
+    previous = None
+    for token in tokens:
+        kind, text = token
+        if previous is not None and not (
+            text in (")", ",", ".") or previous[1] in ("(", ".")
+            or (text == "(" and previous[0] == "name")
+        ):
+            parts.append(" ")
+        parts.append(text)
+        previous = token
+    return "".join(parts)
+
+@lru_cache(maxsize=4096)
+def canonicalize_sql(sql: str) -> str:
+    '''
+    Canonical spelling of a SQLite query, equal for queries that differ only in:
+    - whitespace, comments and trailing semicolons;
+    - the case of keywords and names, and the quoting of names (`name`, [name] and name);
+    - the spelling of numbers (007 and 7) and of the operators == / = and <> / !=;
+    - redundant parentheses: doubled ones, ones around a single name or literal in an expression,
+      and ones around a whole WHERE / HAVING / ON condition.
+    Strings and double-quoted tokens are kept verbatim, since SQLite reads a double-quoted name that matches no
+    column as a string. Keywords are upper case and names lower case. SQL with an unrecognized token is only stripped.
+    '''
+    tokens = _canonical_tokens(sql)
+    if tokens is None:
+        return sql.strip()
+    statements, current = [], []
+    for token in tokens + [("op", ";")]:
+        if token == ("op", ";"):
+            if current:
+                statements.append(_join_tokens(_drop_redundant_parens(current)))
+            current = []
+        else:
+            current.append(token)
+    return "; ".join(statements)
+
+@lru_cache(maxsize=4096)
+def sql_fingerprint(sql: str) -> str:
+    '''
+    Short stable digest of `canonicalize_sql(sql)`, used to recognize repeated queries.
+    '''
+    return hashlib.sha256(canonicalize_sql(sql).encode("utf-8")).hexdigest()[:16]
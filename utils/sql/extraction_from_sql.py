@@ -1,5 +1,6 @@
 import argparse
 import json
+from functools import lru_cache
 from utils.sql.process_sql import (
   tokenize, CLAUSE_KEYWORDS, WHERE_OPS, COND_OPS, UNIT_OPS, AGG_OPS,
   JOIN_KEYWORDS, ORDER_OPS, skip_semicolon, SQL_OPS)
@@ -417,6 +418,11 @@ def extract_schema_from_sql(schema, sql):
   return toks
 
 def extract_template_from_sql(sql, schema={}):
+  # The template depends on the SQL text only
+  return list(_extract_template_cached(sql))
+
+@lru_cache(maxsize=4096)
+def _extract_template_cached(sql):
   try:
     toks = tokenize(sql)
   except:
@@ -461,9 +467,14 @@ def extract_template_from_sql(sql, schema={}):
     elif template[-1] != "[MASK]": # value, schema, join on as
       template.append("[MASK]")
     idx += 1
-  return template
+  return tuple(template)
 
 def extract_partial_template_from_sql(sql, schema={}):
+  # The template depends on the SQL text only
+  return list(_extract_partial_template_cached(sql))
+
+@lru_cache(maxsize=4096)
+def _extract_partial_template_cached(sql):
   toks = tokenize(sql)
   # print(toks)
   template = []
@@ -505,7 +516,7 @@ def extract_partial_template_from_sql(sql, schema={}):
     else:
       template.append(tok)
     idx += 1
-  return template
+  return tuple(template)
 
 
 def is_valid_schema(schema):
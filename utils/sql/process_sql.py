@@ -1,6 +1,10 @@
+import re
 import json
 import sqlite3
-from nltk import word_tokenize
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 
 CLAUSE_KEYWORDS = ('select', 'from', 'where', 'group', 'order', 'limit', 'intersect', 'union', 'except')
 JOIN_KEYWORDS = ('join', 'on', 'as')
@@ -26,6 +30,7 @@ class Schema:
     def __init__(self, schema):
         self._schema = schema
         self._idMap = self._map(self._schema)
+        self._fingerprint = hashlib.sha1(json.dumps(schema).encode("utf-8")).hexdigest()
 
     @property
     def schema(self):
@@ -35,6 +40,11 @@ class Schema:
     def idMap(self):
         return self._idMap
 
+    @property
+    def fingerprint(self):
+        # Equal for schemas with the same tables and columns, whichever object holds them
+        return self._fingerprint
+
     def _map(self, schema):
         idMap = {'*': "__all__"}
         id = 1
@@ -87,8 +97,81 @@ def get_schema_from_json(fpath):
     return schema
 
 
+# nltk's word tokenizer (NLTKWordTokenizer, nltk 3.10) as the regex substitutions it applies in order. A query is
+# one sentence: nltk's word_tokenize first splits text into sentences with Punkt, which only differs inside a
+# query where a period ends a "sentence" mid-text (e.g. "... LIMIT 1. SELECT"), whose period stays attached here.
+_starting_quotes = [
+    (re.compile(r"([«“‘„]|[`]+)"), r" \1 "),
+    (re.compile(r"^\""), r"``"),
+    (re.compile(r"(``)"), r" \1 "),
+    (re.compile(r"([ \(\[{<])(\"|\'{2})"), r"\1 `` "),
+    (re.compile(r"(?i)(?<!\w)(\')(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)"), r"\1 "),
+]
+_punctuation = [
+    (re.compile(r'([^\.])(\.)([\]\)}>"\'»”’ ]*)\s*$'), r"\1 \2 \3 "),
+    (re.compile(r"([:,])([^\d])"), r" \1 \2"),
+    (re.compile(r"([:,])$"), r" \1 "),
+    (re.compile(r"\.{2,}"), r" \g<0> "),
+    (re.compile(r"[;@#$%&]"), r" \g<0> "),
+    (re.compile(r"[\u2012-\u2015]"), r" \g<0> "),
+    (re.compile(r'([^\.])(\.)([\]\)}>"\']*)\s*$'), r"\1 \2\3 "),
+    (re.compile(r"[?!]"), r" \g<0> "),
+    (re.compile(r"([^'])' "), r"\1 ' "),
+    (re.compile(r"[*]"), r" \g<0> "),
+    (re.compile(r"[\]\[\(\)\{\}\<\>]"), r" \g<0> "),
+    (re.compile(r"--"), r" -- "),
+]
+_ending_quotes = [
+    (re.compile(r"([»”’])"), r" \1 "),
+    (re.compile(r"''"), " '' "),
+    (re.compile(r'"'), " '' "),
+    (re.compile(r"\s+"), " "),
+    (re.compile(r"([^' ])('[sS]|'[mM]|'[dD]|') "), r"\1 \2 "),
+    (re.compile(r"([^' ])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T) "), r"\1 \2 "),
+]
+_contractions = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r"\b(can)(not)\b", r"\b(d)('ye)\b", r"\b(gim)(me)\b", r"\b(gon)(na)\b", r"\b(got)(ta)\b",
+        r"\b(lem)(me)\b", r"\b(more)('n)\b", r"\b(wan)(na)(?=\s)", r" ('t)(is)\b", r" ('t)(was)\b",
+    )
+]
+
+# Text that none of the substitutions above change apart from spacing: no quote, bracket other than ( ) < >,
+# ":" and the like, no ".." / "--" / ",," run, no final period and no contraction they split ("cannot", ...).
+# One findall tokenizes it.
+_simple_text_pattern = re.compile(r"[^`'\"«»“”‘’„\u2012-\u2015\[\]{}:@#$&?]*")
+_fallback_text_pattern = re.compile(
+    r"\.\.|--|,,|\.[\])}>\s]*$|(?i:cannot|gimme|gonna|gotta|lemme|wanna)|[.!](?=[)\";}\]*:@'({\[!?]|\s)"
+)
+_word_token_pattern = re.compile(r"(?:[^\s()<>*%;!,]|,(?=\d))+|[()<>*%;!,]")
+
+
+def word_tokenize(string):
+    """
+    nltk's word_tokenize of a one-sentence string, without nltk: a single findall for text in its simple case,
+    the tokenizer's substitutions otherwise.
+    """
+    if _simple_text_pattern.fullmatch(string) and not _fallback_text_pattern.search(string):
+        return _word_token_pattern.findall(string)
+    for regexp, substitution in _starting_quotes + _punctuation:
+        string = regexp.sub(substitution, string)
+    string = " " + string + " "
+    for regexp, substitution in _ending_quotes:
+        string = regexp.sub(substitution, string)
+    for regexp in _contractions:
+        string = regexp.sub(r" \1 \2 ", string)
+    return string.split()
+
+
 def tokenize(string):
-    string = str(string)
+    """
+    Tokens of a SQL query. Results are cached by text; each call returns a new list.
+    """
+    return list(_tokenize_cached(str(string)))
+
+
+@lru_cache(maxsize=4096)
+def _tokenize_cached(string):
     string = string.replace("\'", "\"")  # ensures all string values wrapped by "" problem??
     quote_idxs = [idx for idx, char in enumerate(string) if char == '"']
     assert len(quote_idxs) % 2 == 0, "Unexpected quote"
@@ -126,7 +209,7 @@ def tokenize(string):
         if pre_tok in prefix:
             toks = toks[:eq_idx-1] + [pre_tok + "="] + toks[eq_idx+1: ]
 
-    return toks
+    return tuple(toks)
 
 
 def scan_alias(toks):
@@ -533,12 +616,46 @@ def load_data(fpath):
     return data
 
 
-def get_sql(schema, query):
-    toks = tokenize(query)
-    tables_with_alias = get_tables_with_alias(schema.schema, toks)
-    _, sql = parse_sql(toks, 0, tables_with_alias, schema)
+_parse_cache = OrderedDict()
+_parse_cache_lock = threading.Lock()
+parse_cache_size = 1024
+
 
-    return sql
+def get_sql(schema, query):
+    """
+    Parsed query. Results are cached by (schema fingerprint, query text); each call returns a new copy.
+    """
+    key = (schema.fingerprint, query)
+    with _parse_cache_lock:
+        sql = _parse_cache.get(key)
+        if sql is not None:
+            _parse_cache.move_to_end(key)
+    if sql is None:
+        toks = tokenize(query)
+        tables_with_alias = get_tables_with_alias(schema.schema, toks)
+        _, sql = parse_sql(toks, 0, tables_with_alias, schema)
+        with _parse_cache_lock:
+            _parse_cache[key] = sql
+            while len(_parse_cache) > parse_cache_size:
+                _parse_cache.popitem(last=False)
+    return _copy_parsed(sql)
+
+
+def _copy_parsed(node):
+    # A parse is dicts, lists and tuples of strings, numbers and bools; tuples are rebuilt only for the
+    # nested subqueries they may hold
+    if isinstance(node, dict):
+        return {key: _copy_parsed(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_copy_parsed(value) for value in node]
+    if isinstance(node, tuple):
+        return tuple(_copy_parsed(value) for value in node)
+    return node
+
+
+def clear_parse_cache():
+    with _parse_cache_lock:
+        _parse_cache.clear()
 
 
 def skip_semicolon(toks, start_idx):
@@ -0,0 +1,55 @@
+import re
+
+# SQLite's keywords; SQLite also accepts most of them as names, so they are never reported as unknown
+SQLITE_KEYWORDS = frozenset('''
+    abort action add after all alter always analyze and as asc attach autoincrement before begin between by cascade
+    case cast check collate column commit conflict constraint create cross current current_date current_time
+    current_timestamp database default deferrable deferred delete desc detach distinct do drop each else end escape
+    except exclude exclusive exists explain fail filter first following for foreign from full generated glob group
+    groups having if ignore immediate in index indexed initially inner insert instead intersect into is isnull join key
+    last left like limit match materialized natural no not nothing notnull null nulls of offset on or order others outer
+    over partition plan pragma preceding primary query raise range recursive references regexp reindex release rename
+    replace restrict returning right rollback row rows savepoint select set table temp temporary then ties to transaction
+    trigger unbounded union unique update using vacuum values view virtual when where window with without
+'''.split())
+
+# SQLite's tokens, shared by the validator, the canonicalizer and MYSQLDB
+_token_pattern = re.compile(r'''
+    (?P<space>[ \t\n\f\r]+|--[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<dquote>"(?:[^"]|"")*")
+  | (?P<bquote>`(?:[^`]|``)*`)
+  | (?P<bracket>\[[^\]]*\])
+  | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)[A-Za-z0-9_.$\x80-\U0010FFFF]*)
+  | (?P<param>\?\d*|[:@$][A-Za-z_][A-Za-z0-9_]*)
+  | (?P<name>[A-Za-z_\x80-\U0010FFFF][A-Za-z0-9_$\x80-\U0010FFFF]*)
+  | (?P<op>\|\||->>|->|<<|>>|<=|>=|==|!=|<>|[-+*/%&|~<>=(),.;])
+  | (?P<error>.)
+''', re.VERBOSE | re.DOTALL)
+number_pattern = re.compile(r"0[xX][0-9a-fA-F]+|(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?")
+plain_name_pattern = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+def tokenize_sql(sql: str) -> list:
+    '''
+    [(kind, value, start, end)] of the tokens of `sql`, without spaces and comments. Names (quoted or not) have kind
+    "name" / "dquote" / "quoted" and their value lower-cased and unquoted; keywords have kind "keyword".
+    '''
+    tokens = []
+    for match in _token_pattern.finditer(sql):
+        kind, text = match.lastgroup, match.group()
+        if kind == "space":
+            continue
+        if kind == "name":
+            value = text.lower()
+            if value in SQLITE_KEYWORDS:
+                kind = "keyword"
+        elif kind == "dquote":
+            value = text[1:-1].replace('""', '"').lower()
+        elif kind == "bquote":
+            kind, value = "quoted", text[1:-1].replace('``', '`').lower()
+        elif kind == "bracket":
+            kind, value = "quoted", text[1:-1].lower()
+        else:
+            value = text
+        tokens.append((kind, value, match.start(), match.end()))
+    return tokens
@@ -0,0 +1,557 @@
+import re
+from dataclasses import dataclass, field
+from fuzzywuzzy import fuzz
+from utils.sql.process_sql import Schema
+from utils.sql.tokens import SQLITE_KEYWORDS, tokenize_sql, number_pattern, plain_name_pattern
+
+# Names SQLite resolves without a table: the implicit row id and the boolean literals
+_builtin_names = frozenset(("rowid", "oid", "_rowid_", "true", "false"))
+# Keywords that end an operand, so a name right after one is an alias ("CASE ... END AS x" without the AS)
+_operand_end_keywords = frozenset(("end", "null", "current_date", "current_time", "current_timestamp"))
+_query_start_keywords = frozenset(("select", "with", "values"))
+
+_squash_pattern = re.compile(r"[\W_]+")
+
+# Closest-name suggestions scoring at least this (fuzz.ratio) are applied by the local repair
+repair_threshold = 80
+
+@dataclass
+class SQLIssue:
+    '''
+    One problem found in a SQL query.
+    - kind: "unknown_column", "unknown_table" or "syntax".
+    - name: The unknown name (lower case), or the offending text for syntax issues.
+    - start / end: Character span of the name in the query.
+    - suggestion / score: The closest known name and its fuzz.ratio score, when there is one.
+    '''
+    kind: str
+    name: str
+    start: int
+    end: int
+    message: str
+    suggestion: str | None = None
+    score: int = 0
+
+@dataclass
+class SQLDiagnostic:
+    '''
+    Result of `validate_sql`.
+    - issues: Problems that make SQLite reject the query.
+    - checked: False when some statement is of a kind the validator does not look into (e.g. INSERT);
+      such statements are never reported as invalid.
+    - repaired_sql: The query with every issue fixed by its suggestion, when all issues are names with one
+      clear closest match (see `repair_threshold`) and the fixed query passes the check; otherwise None.
+    '''
+    sql: str
+    issues: list[SQLIssue] = field(default_factory=list)
+    checked: bool = True
+    repaired_sql: str | None = None
+
+    @property
+    def valid(self) -> bool:
+        return not self.issues
+
+    def error_message(self) -> str:
+        return "; ".join(issue.message for issue in self.issues)
+
+    def to_dict(self) -> dict:
+        return {
+            "valid": self.valid,
+            "checked": self.checked,
+            "issues": [issue.__dict__.copy() for issue in self.issues],
+            "repaired_sql": self.repaired_sql,
+        }
+
+def _is_name(token) -> bool:
+    return token[0] in ("name", "dquote", "quoted")
+
+def _squash(name: str) -> str:
+    return _squash_pattern.sub("", name)
+
+def _closest(name: str, candidates) -> tuple[str | None, int, bool]:
+    '''
+    (closest candidate, its score, whether it is the only one with that score). Names equal once spaces and
+    punctuation are dropped ("career nwin loss" and "career_nwin_loss") score 100.
+    '''
+    best, best_score, unique = None, 0, False
+    squashed = _squash(name)
+    for candidate in sorted(candidates):
+        score = 100 if squashed and _squash(candidate) == squashed else fuzz.ratio(name, candidate)
+        if score > best_score:
+            best, best_score, unique = candidate, score, True
+        elif score == best_score:
+            unique = False
+    return best, best_score, unique
+
+class _StatementChecker(object):
+    '''
+    Resolves the names of one SELECT / WITH / CREATE TABLE AS statement. Scoping is flat: a column is known if
+    any table the statement reads has it, and an alias defined anywhere in the statement is known everywhere.
+    This never rejects a query SQLite accepts, at the cost of missing columns taken from the wrong table.
+    '''
+    def __init__(self, sql: str, tokens: list, tables: dict, issues: list):
+        self.sql = sql
+        self.tokens = tokens
+        self.tables = tables
+        self.issues = issues
+        self.definitions = set()
+        self.types = set()
+        self.aliases = set()
+        self.ctes = {}
+        self.sources = {}
+        self.unknown_source = False
+        self._resolving = {}
+        # Output columns of CTEs and subqueries that are a plain column reference, by the token they come from
+        self.passthrough = {}
+        self.column_lists = set()
+        self.close = self._match_parens()
+
+    def _issue(self, kind: str, index: int, message: str, candidates=()):
+        _, name, start, end = self.tokens[index]
+        suggestion, score, unique = _closest(name, candidates)
+        if suggestion is not None:
+            message += " (closest: {})".format(suggestion)
+        self.issues.append(SQLIssue(kind, name, start, end, message, suggestion, score))
+        if not unique:
+            # A tie is not a clear match, so it is suggested but never repaired
+            self.issues[-1].score = min(score, repair_threshold - 1)
+
+    def _match_parens(self) -> dict | None:
+        close, stack = {}, []
+        for index, token in enumerate(self.tokens):
+            if token[1] == "(" and token[0] == "op":
+                stack.append(index)
+            elif token[1] == ")" and token[0] == "op":
+                if not stack:
+                    self.issues.append(SQLIssue("syntax", ")", token[2], token[3], "unbalanced parentheses: unexpected ')'"))
+                    return None
+                close[stack.pop()] = index
+        if stack:
+            token = self.tokens[stack[-1]]
+            self.issues.append(SQLIssue("syntax", "(", token[2], token[3], "unbalanced parentheses: '(' is not closed"))
+            return None
+        return close
+
+    def _value(self, index: int):
+        return self.tokens[index][1] if index < len(self.tokens) else None
+
+    def _keyword(self, index: int, *keywords) -> bool:
+        return index < len(self.tokens) and self.tokens[index][0] == "keyword" and self.tokens[index][1] in keywords
+
+    def _op(self, index: int, op: str) -> bool:
+        return index < len(self.tokens) and self.tokens[index][0] == "op" and self.tokens[index][1] == op
+
+    def _name_at(self, index: int) -> bool:
+        return index < len(self.tokens) and _is_name(self.tokens[index])
+
+    def run(self, start: int = 0):
+        if self.close is None:
+            return
+        self._scan_ctes()
+        self._scan_sources()
+        self._scan_aliases()
+        self._check_references(start)
+
+    def _scan_ctes(self):
+        for index, token in enumerate(self.tokens):
+            if token[0] != "keyword" or token[1] != "with":
+                continue
+            index += 1
+            if self._keyword(index, "recursive"):
+                index += 1
+            while self._name_at(index):
+                name_index, columns = index, None
+                index += 1
+                if self._op(index, "("):
+                    columns = set()
+                    for column_index in range(index + 1, self.close[index]):
+                        if _is_name(self.tokens[column_index]):
+                            columns.add(self.tokens[column_index][1])
+                            self.definitions.add(column_index)
+                    self.column_lists.update(columns)
+                    index = self.close[index] + 1
+                if not self._keyword(index, "as"):
+                    break
+                index += 1
+                if self._keyword(index, "not"):
+                    index += 1
+                if self._keyword(index, "materialized"):
+                    index += 1
+                if not self._op(index, "("):
+                    break
+                self.definitions.add(name_index)
+                name = self.tokens[name_index][1]
+                self.ctes[name] = columns if columns is not None else ("query", index + 1, self.close[index])
+                index = self.close[index] + 1
+                if not self._op(index, ","):
+                    break
+                index += 1
+
+    def _scan_sources(self):
+        for index, token in enumerate(self.tokens):
+            if token[0] == "keyword" and token[1] in ("from", "join"):
+                index = self._scan_source(index + 1)
+                while self._op(index, ","):
+                    index = self._scan_source(index + 1)
+
+    def _scan_source(self, index: int) -> int:
+        '''
+        Registers the table, subquery or table-valued function at `index` under its alias; returns the index after it.
+        '''
+        if self._op(index, "("):
+            end = self.close[index]
+            if self._keyword(index + 1, *_query_start_keywords):
+                ref = ("query", index + 1, end)
+            else:
+                # Parenthesized join: its first table has no FROM / JOIN before it
+                self._scan_source(index + 1)
+                return end + 1
+            name, index = None, end + 1
+        elif self._name_at(index):
+            if self._op(index + 1, ".") and self._name_at(index + 2):
+                # schema.table
+                self.definitions.add(index)
+                index += 2
+            name = self.tokens[index][1]
+            self.definitions.add(index)
+            if self._op(index + 1, "("):
+                ref, index = None, self.close[index + 1] + 1
+            elif name in self.ctes:
+                ref, index = ("cte", name), index + 1
+            elif name in self.tables:
+                ref, index = ("table", name), index + 1
+            else:
+                self._issue("unknown_table", index, "no such table: {}".format(name), list(self.tables) + list(self.ctes))
+                self.unknown_source = True
+                ref, index = None, index + 1
+        else:
+            return index
+        alias = None
+        if self._keyword(index, "as") and self._name_at(index + 1):
+            alias, index = index + 1, index + 2
+        elif self._name_at(index):
+            alias, index = index, index + 1
+        if alias is not None:
+            self.definitions.add(alias)
+            name = self.tokens[alias][1]
+        if name is not None:
+            if name in self.sources and self.sources[name] != ref:
+                # The same alias for different tables in different subqueries
+                ref = None
+            self.sources[name] = ref
+        elif ref is not None:
+            self.sources[("anonymous", index)] = ref
+        return index
+
+    def _scan_aliases(self):
+        cast_parens = {}
+        for index, token in enumerate(self.tokens):
+            kind, value = token[0], token[1]
+            if kind == "op" and value == "(" and index > 0 and self.tokens[index - 1][1] == "cast":
+                cast_parens[index] = self.close[index]
+            if kind == "keyword" and value == "as":
+                if any(start < index < end for start, end in cast_parens.items()):
+                    # CAST(x AS type): the type name is not an alias
+                    end = next(end for start, end in cast_parens.items() if start < index < end)
+                    self.types.update(range(index + 1, end))
+                elif self._name_at(index + 1) and index + 1 not in self.definitions:
+                    self.definitions.add(index + 1)
+                    self.aliases.add(self.tokens[index + 1][1])
+            elif kind == "keyword" and value in ("collate", "over") and self._name_at(index + 1):
+                self.definitions.add(index + 1)
+            elif _is_name(token) and index not in self.definitions and index > 0:
+                if self._keyword(index + 1, "as") and self._op(index + 2, "("):
+                    # WINDOW name AS (...)
+                    self.definitions.add(index)
+                elif self._ends_operand(index - 1) and not self._op(index + 1, "(") and not self._op(index + 1, "."):
+                    # "expression alias" without AS
+                    self.definitions.add(index)
+                    self.aliases.add(value)
+
+    def _ends_operand(self, index: int) -> bool:
+        kind, value = self.tokens[index][0], self.tokens[index][1]
+        if kind in ("name", "dquote", "quoted"):
+            return index not in self.types
+        if kind in ("number", "string"):
+            return True
+        if kind == "keyword":
+            return value in _operand_end_keywords
+        return kind == "op" and value == ")"
+
+    def _ref_columns(self, ref):
+        '''
+        Columns of a source (a table, CTE or subquery), or None when they cannot be told.
+        '''
+        if ref is None:
+            return None
+        if ref[0] == "table":
+            return self.tables[ref[1]]
+        if ref[0] == "cte":
+            columns = self.ctes[ref[1]]
+            if isinstance(columns, tuple):
+                # Recursive CTEs refer to themselves while their columns are worked out
+                if ref in self._resolving:
+                    return self._resolving[ref]
+                self._resolving[ref] = None
+                columns = self.ctes[ref[1]] = self._output_columns(columns[1], columns[2])
+            return columns
+        if ref not in self._resolving:
+            self._resolving[ref] = None
+            self._resolving[ref] = self._output_columns(ref[1], ref[2])
+        return self._resolving[ref]
+
+    def _output_columns(self, start: int, end: int):
+        '''
+        Column names of the query in tokens[start:end] (of its first SELECT for compound queries), or None.
+        '''
+        index = start
+        while index < end:
+            if self._keyword(index, "with"):
+                # Skip the CTE definitions of a nested WITH
+                index += 1
+                while index < end and not self._keyword(index, "select", "values"):
+                    index = self.close[index] + 1 if self._op(index, "(") else index + 1
+                continue
+            if self._keyword(index, "values"):
+                return None
+            if self._keyword(index, "select"):
+                break
+            index += 1
+        else:
+            return None
+        index += 1
+        if self._keyword(index, "distinct", "all"):
+            index += 1
+        columns, item_start = set(), index
+        while index <= end:
+            at_end = index == end or self._keyword(index, "from", "where", "group", "having", "order", "limit", "window",
+                                                   "union", "intersect", "except")
+            if at_end or self._op(index, ","):
+                item = self.tokens[item_start:index]
+                names = self._item_names(item, item_start, start, end)
+                if names is None:
+                    return None
+                columns.update(names)
+                if at_end:
+                    return columns
+                item_start = index + 1
+            elif self._op(index, "("):
+                index = self.close[index]
+            index += 1
+        return columns
+
+    def _item_names(self, item: list, item_start: int, start: int, end: int):
+        if not item:
+            return set()
+        if item[-1][1] == "*" and item[-1][0] == "op":
+            if len(item) == 1:
+                # SELECT *: the columns of every source of this query
+                columns = set()
+                for key, ref in self.sources.items():
+                    position = self._source_position(key)
+                    if position is None or not start <= position < end:
+                        continue
+                    source_columns = self._ref_columns(ref)
+                    if source_columns is None:
+                        return None
+                    columns.update(source_columns)
+                return columns
+            if len(item) == 3 and _is_name(item[0]):
+                return self._ref_columns(self.sources.get(item[0][1]))
+            return None
+        last = item[-1]
+        if len(item) == 1 and _is_name(last) or len(item) == 3 and _is_name(last) and item[1][1] == ".":
+            self.passthrough.setdefault(last[1], set()).add(item_start + len(item) - 1)
+            return {last[1]}
+        if len(item) >= 2 and _is_name(last):
+            # "x AS name", "t.name" or "x name"
+            before_kind, before = item[-2][0], item[-2][1]
+            if (before_kind == "keyword" and (before == "as" or before in _operand_end_keywords)) \
+                    or (before_kind == "op" and before in (".", ")")) \
+                    or before_kind in ("name", "dquote", "quoted", "number", "string"):
+                return {last[1]}
+        # Unnamed expression: SQLite names it after its text
+        return {self.sql[item[0][2]:item[-1][3]].lower()}
+
+    def _source_position(self, key):
+        if isinstance(key, tuple):
+            return key[1]
+        for index, token in enumerate(self.tokens):
+            if index in self.definitions and _is_name(token) and token[1] == key:
+                return index
+        return None
+
+    def _known_columns(self):
+        '''
+        Columns of every source of the statement, or None when some source is unknown.
+        '''
+        if self.unknown_source:
+            return None
+        columns = set()
+        for ref in self.sources.values():
+            source_columns = self._ref_columns(ref)
+            if source_columns is None:
+                return None
+            columns.update(source_columns)
+        for cte_columns in self.ctes.values():
+            if isinstance(cte_columns, set):
+                columns.update(cte_columns)
+        return columns
+
+    def _is_self_defined(self, index: int, table_columns: set) -> bool:
+        '''
+        Whether the name at `index` is known only as the output column it defines itself: "SELECT nmae FROM w"
+        inside a CTE names a column nmae, which must not make the reference valid.
+        '''
+        name = self.tokens[index][1]
+        return self.passthrough.get(name) == {index} and name not in table_columns and name not in self.aliases \
+            and name not in self.column_lists
+
+    def _check_references(self, start: int):
+        known_columns = self._known_columns()
+        table_columns = set()
+        for ref in self.sources.values():
+            if ref is not None and ref[0] == "table" and self.tables[ref[1]] is not None:
+                table_columns.update(self.tables[ref[1]])
+        all_columns = set().union(*(columns for columns in self.tables.values() if columns is not None))
+        index = start
+        while index < len(self.tokens):
+            token = self.tokens[index]
+            if not _is_name(token) or index in self.definitions or index in self.types or self._op(index + 1, "("):
+                index += 1
+                continue
+            if self._op(index + 1, "."):
+                if self._op(index + 3, "."):
+                    # schema.table.column
+                    index += 5
+                    continue
+                index = self._check_qualified(index)
+                continue
+            name = token[1]
+            if known_columns is not None and token[0] != "dquote" and name not in _builtin_names and (
+                    name not in known_columns and name not in self.aliases or self._is_self_defined(index, table_columns)):
+                candidates = (known_columns if self.sources else all_columns) - {name}
+                self._issue("unknown_column", index, "no such column: {}".format(name), candidates)
+            index += 1
+
+    def _check_qualified(self, index: int) -> int:
+        qualifier = self.tokens[index][1]
+        column_index = index + 2
+        if qualifier not in self.sources:
+            names = [key for key in self.sources if isinstance(key, str)]
+            self._issue("unknown_table", index, "no such table: {}".format(qualifier), names)
+            return column_index + 1
+        if not self._name_at(column_index):
+            return column_index + 1
+        columns = self._ref_columns(self.sources[qualifier])
+        column = self.tokens[column_index][1]
+        if columns is not None and column not in columns and column not in _builtin_names:
+            self._issue("unknown_column", column_index, "no such column: {}.{}".format(qualifier, column), columns)
+        return column_index + 1
+
+def _split_statements(tokens: list) -> list:
+    statements, current = [], []
+    for token in tokens:
+        if token[0] == "op" and token[1] == ";":
+            if current:
+                statements.append(current)
+            current = []
+        else:
+            current.append(token)
+    if current:
+        statements.append(current)
+    return statements
+
+def _schema_tables(schema: Schema) -> dict:
+    '''
+    {table: set of columns} of a `process_sql.Schema`, lower case.
+    '''
+    tables = {}
+    for key in schema.idMap:
+        if key == "*":
+            continue
+        table, _, column = key.partition(".")
+        tables.setdefault(table, set())
+        if column:
+            tables[table].add(column)
+    return tables
+
+def _check_syntax_tokens(tokens: list, issues: list):
+    for kind, value, start, end in tokens:
+        if kind == "error":
+            if value in ("'", '"', "`", "["):
+                issues.append(SQLIssue("syntax", value, start, end, "unterminated quote {}".format(value)))
+            else:
+                issues.append(SQLIssue("syntax", value, start, end, "unrecognized token: {}".format(value)))
+        elif kind == "number" and not number_pattern.fullmatch(value):
+            issues.append(SQLIssue("syntax", value, start, end, "unrecognized token: {}".format(value)))
+
+def _check(sql: str, tables: dict) -> tuple[list, bool]:
+    issues = []
+    tokens = tokenize_sql(sql)
+    if not tokens:
+        return [SQLIssue("syntax", "", 0, len(sql), "empty query")], True
+    _check_syntax_tokens(tokens, issues)
+    if issues:
+        return issues, True
+    checked = True
+    for statement in _split_statements(tokens):
+        index = 0
+        if statement[0][1] == "explain":
+            index = 3 if len(statement) > 2 and statement[1][1] == "query" else 1
+        head = [token[1] for token in statement[index:index + 6]]
+        if head and (head[0] in _query_start_keywords or head[0] == "("):
+            _StatementChecker(sql, statement, tables, issues).run(index)
+        elif head[:1] == ["create"] and ("table" in head[1:3] or "view" in head[1:3]):
+            # CREATE [TEMP] TABLE / VIEW [IF NOT EXISTS] name AS query
+            name_index = index + head.index("table" if "table" in head[1:3] else "view") + 1
+            if [token[1] for token in statement[name_index:name_index + 3]] == ["if", "not", "exists"]:
+                name_index += 3
+            if name_index + 1 < len(statement) and statement[name_index + 1][1] == "as":
+                checker = _StatementChecker(sql, statement, tables, issues)
+                checker.definitions.add(name_index)
+                checker.run(name_index + 2)
+                if checker.close is not None:
+                    tables[statement[name_index][1]] = checker._ref_columns(("query", name_index + 2, len(statement)))
+            elif name_index < len(statement) and _is_name(statement[name_index]):
+                tables[statement[name_index][1]] = None
+        elif head[:2] == ["drop", "table"] or head[:2] == ["drop", "view"]:
+            tables.pop(statement[-1][1], None)
+        else:
+            checked = False
+    return issues, checked
+
+def _repair(sql: str, issues: list) -> str | None:
+    if not issues or any(issue.kind == "syntax" or issue.score < repair_threshold for issue in issues):
+        return None
+    repaired = sql
+    for issue in sorted(issues, key=lambda issue: issue.start, reverse=True):
+        original = sql[issue.start:issue.end]
+        suggestion = issue.suggestion
+        if original[0] == "`":
+            replacement = "`{}`".format(suggestion.replace("`", "``"))
+        elif original[0] == "[":
+            replacement = "[{}]".format(suggestion)
+        elif original[0] != '"' and plain_name_pattern.fullmatch(suggestion) and suggestion not in SQLITE_KEYWORDS:
+            replacement = suggestion
+        else:
+            replacement = '"{}"'.format(suggestion.replace('"', '""'))
+        repaired = repaired[:issue.start] + replacement + repaired[issue.end:]
+    return repaired
+
+def validate_sql(sql: str, schema) -> SQLDiagnostic:
+    '''
+    Checks a SQLite query against a schema without running it: syntax the tokenizer can tell (quotes, parentheses,
+    tokens), and every table and column name, with WITH / CTEs, subqueries, aliases and CREATE TABLE AS resolved.
+    `schema` is a `process_sql.Schema` or a {table: [columns]} dict. Unknown names come with the closest known name,
+    and `repaired_sql` is set when those suggestions fix the query.
+    '''
+    if not isinstance(schema, Schema):
+        schema = Schema(schema)
+    tables = _schema_tables(schema)
+    issues, checked = _check(sql, dict(tables))
+    diagnostic = SQLDiagnostic(sql=sql, issues=issues, checked=checked)
+    repaired_sql = _repair(sql, issues)
+    if repaired_sql is not None and not _check(repaired_sql, dict(tables))[0]:
+        diagnostic.repaired_sql = repaired_sql
+    return diagnostic
@@ -0,0 +1,138 @@
+import os
+import json
+import uuid
+import pickle
+import shutil
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+from utils.database import MYSQLDB
+
+CATALOG_VERSION = 2
+
+def table_content_key(tables: List[Dict[str, Dict]], typed: bool = False, create_indexes: bool = False,
+                      normalize_cells: bool = False) -> str:
+    '''
+    Content hash of the tables as loaded from the dataset (title, header and rows) and of the ingestion options.
+    '''
+    payload = {
+        "version": CATALOG_VERSION,
+        "typed": typed,
+        "create_indexes": create_indexes,
+        "normalize_cells": normalize_cells,
+        "tables": [
+            {"title": table.get("title"), "header": table["table"]["header"], "rows": table["table"]["rows"]}
+            for table in tables
+        ],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class TableCatalog(object):
+    '''
+    On-disk store of ingested tables, so that a table shared by many questions is normalized and written to SQLite once per machine.
+    Each distinct table gets a directory `<root>/<key[:2]>/<key>/` holding:
+    - db.sqlite: The normalized tables, as MYSQLDB writes them.
+    - tables.pkl: The raw tables, the normalized DataFrames, the table names and the schema prompt.
+    Entries are built in a scratch directory and renamed into place, so concurrent workers never see a partial entry.
+    Use with `MYSQLDB.from_catalog(catalog, tables)`.
+    The last `max_entries` entries used are also kept in memory (pickled), so repeated tables skip the disk read.
+    '''
+    def __init__(self, root: str = "tmp/table_catalog", max_entries: int = 256):
+        self.root = root
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        os.makedirs(root, exist_ok=True)
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def _build(self, tables: List[Dict[str, Dict]], key: str, typed: bool, create_indexes: bool, normalize_cells: bool):
+        scratch_dir = os.path.join(self.root, f".build-{uuid.uuid4()}")
+        os.makedirs(scratch_dir)
+        sqldb = MYSQLDB(tables=pickle.loads(pickle.dumps(tables)), typed=typed, create_indexes=create_indexes,
+                        normalize_cells=normalize_cells)
+        try:
+            target_conn = sqlite3.connect(os.path.join(scratch_dir, "db.sqlite"))
+            try:
+                sqldb.sqlite_conn.backup(target_conn)
+            finally:
+                target_conn.close()
+            state = {
+                "raw_tables": sqldb.raw_tables,
+                "tables": sqldb.tables,
+                "table_names": sqldb.table_names,
+                "schema_prompt": sqldb.get_create_table_prompt(),
+            }
+            with open(os.path.join(scratch_dir, "tables.pkl"), "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            sqldb.close()
+
+        final_dir = self.entry_dir(key)
+        os.makedirs(os.path.dirname(final_dir), exist_ok=True)
+        try:
+            os.rename(scratch_dir, final_dir)
+        except OSError:
+            if not os.path.exists(os.path.join(final_dir, "tables.pkl")):
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+                raise
+            # Another worker finished the same table first
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    def _load(self, key: str) -> tuple[str, bytes]:
+        entry_dir = self.entry_dir(key)
+        with open(os.path.join(entry_dir, "tables.pkl"), "rb") as f:
+            return os.path.join(entry_dir, "db.sqlite"), f.read()
+
+    def _lookup(self, key: str) -> tuple[str, bytes] | None:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+            return cached
+
+    def get(self, tables: List[Dict[str, Dict]], typed: bool = False, create_indexes: bool = False,
+            normalize_cells: bool = False) -> dict:
+        '''
+        Returns a private copy of the entry for `tables` ingested with the given MYSQLDB options, building it first if needed:
+        {"db_path", "raw_tables", "tables", "table_names", "schema_prompt"}.
+        '''
+        key = table_content_key(tables, typed=typed, create_indexes=create_indexes, normalize_cells=normalize_cells)
+        cached = self._lookup(key)
+        if cached is None:
+            with self._lock:
+                key_lock = self._key_locks.setdefault(key, threading.Lock())
+            # One thread builds or loads each entry; other tables are served meanwhile
+            with key_lock:
+                cached = self._lookup(key)
+                if cached is None:
+                    if not os.path.exists(os.path.join(self.entry_dir(key), "tables.pkl")):
+                        self._build(tables, key, typed, create_indexes, normalize_cells)
+                    cached = self._load(key)
+                    with self._lock:
+                        self._entries[key] = cached
+                        while len(self._entries) > self.max_entries:
+                            self._entries.popitem(last=False)
+                        self._key_locks.pop(key, None)
+        db_path, state = cached
+        entry = pickle.loads(state)
+        entry["db_path"] = db_path
+        return entry
+
+_catalogs = {}
+
+def get_table_catalog(root: str) -> TableCatalog:
+    '''
+    Opens each catalog once per process.
+    '''
+    key = (os.getpid(), os.path.abspath(root))
+    catalog = _catalogs.get(key)
+    if catalog is None:
+        catalog = TableCatalog(root)
+        _catalogs[key] = catalog
+    return catalog
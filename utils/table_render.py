@@ -0,0 +1,161 @@
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Cells that iterrows hands back unchanged; a row holding anything else (None, timestamps, ...) can be converted
+# by the row Series pandas builds for it, e.g. None -> nan next to strings
+_plain_cell_types = (str, int, float, bool, np.number, np.bool_)
+
+def pipe_lines(header: list, rows) -> tuple[str, list[str]]:
+    '''
+    ("| h1 | h2 |\\n", ["| a | b |\\n", ...]) of a table whose cells are strings already.
+    '''
+    header_line = "| " + " | ".join(header) + " |\n"
+    return header_line, ["| " + " | ".join(row) + " |\n" for row in rows]
+
+def pipe_table(header: list, rows) -> str:
+    '''
+    The pipe format of a table whose cells are strings already, built in one join.
+    '''
+    header_line, row_lines = pipe_lines(header, rows)
+    return header_line + "".join(row_lines)
+
+def linear_table(header: list, rows, caption: str = None) -> str:
+    '''
+    The "col : h1 | h2" / "row 1 : a | b" format of a table whose cells are strings already, without a final newline.
+    '''
+    parts = []
+    if caption is not None:
+        parts.append("table caption : " + caption + "\n")
+    parts.append("col : " + " | ".join(header) + "\n")
+    parts.append("\n".join("row {} : ".format(row_idx) + " | ".join(row) for row_idx, row in enumerate(rows, 1)))
+    return "".join(parts)
+
+def create_table(title: str, columns: list, types: list) -> str:
+    '''
+    The CREATE TABLE part of the schema prompt.
+    '''
+    parts = ["CREATE TABLE {}(\n".format(title)]
+    parts.extend('\t{} {},\n'.format(column, column_type) for column, column_type in zip(columns, types))
+    return "".join(parts).rstrip(',\n') + ')\n'
+
+def create_table_types(df: pd.DataFrame) -> list[str]:
+    '''
+    The column types `create_table` shows for an ingested DataFrame ("text" for a repeated column name).
+    '''
+    types = []
+    for header in df.columns:
+        column_type = 'text'
+        try:
+            if df[header].dtype == 'int64':
+                column_type = 'int'
+            elif df[header].dtype == 'float64':
+                column_type = 'real'
+            elif df[header].dtype == 'datetime64':
+                column_type = 'datetime'
+        except AttributeError as e:
+            pass
+        types.append(column_type)
+    return types
+
+def df_rows_as_str(df: pd.DataFrame) -> list[list[str]]:
+    '''
+    The cells of `df` as `str`, the way `str` shows the values of `df.iterrows()` rows: from the array of the
+    columns' common dtype, with rows that pandas would convert going through the same row Series.
+    '''
+    values = df.values
+    columns = [list(map(str, column)) for column in values.T]
+    rows = [list(row) for row in zip(*columns)] if columns else [[] for _ in range(len(values))]
+    if values.dtype == object:
+        for row_idx, row in enumerate(values):
+            if not all(isinstance(cell, _plain_cell_types) for cell in row):
+                rows[row_idx] = list(map(str, pd.Series(row, index=df.columns).values))
+    return rows
+
+_render_cache = OrderedDict()
+_render_cache_lock = threading.Lock()
+render_cache_size = 256
+
+def content_version(obj) -> bytes | None:
+    '''
+    A digest of `obj`'s pickle, which changes with any cell (its value or its type); None if it cannot be pickled.
+    '''
+    try:
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def _memoized(key: tuple, version, render):
+    '''
+    `render()`, reused while the same key is rendered from the same content `version` (rendered every time when
+    the version is None). Keys hold no table, so a table edited in place or a new one at the same address misses.
+    '''
+    if version is None:
+        return render()
+    cache_key = key + (version,)
+    with _render_cache_lock:
+        cached = _render_cache.get(cache_key)
+        if cached is not None:
+            _render_cache.move_to_end(cache_key)
+            return cached
+    text = render()
+    with _render_cache_lock:
+        _render_cache[cache_key] = text
+        _render_cache.move_to_end(cache_key)
+        while len(_render_cache) > render_cache_size:
+            _render_cache.popitem(last=False)
+    return text
+
+def clear_render_cache():
+    with _render_cache_lock:
+        _render_cache.clear()
+
+def df_pipe_table(df: pd.DataFrame, num_rows: int) -> str:
+    '''
+    Pipe format of the columns and first `num_rows` rows of `df` (memoized).
+    '''
+    rows = df.iloc[:num_rows]
+    return _memoized(("df_pipe",), content_version(rows), lambda: pipe_table(df.columns, df_rows_as_str(rows)))
+
+def df_create_table(df: pd.DataFrame, title: str) -> str:
+    '''
+    CREATE TABLE format of `df` under `title` (memoized).
+    '''
+    # The columns and their types are all it shows
+    return _memoized(("df_create_table", title), (tuple(df.columns), tuple(map(str, df.dtypes))),
+                     lambda: create_table(title, df.columns, create_table_types(df)))
+
+def result_pipe_lines(result: dict) -> tuple[str, list[str]]:
+    '''
+    `pipe_lines` of a query result ({"header", "rows"}). Not memoized: a result is rarely rendered twice, and a digest
+    of its rows costs about as much as rendering them.
+    '''
+    header, rows = result["header"], result["rows"]
+    return pipe_lines(header, ([cell if isinstance(cell, str) else str(cell) for cell in row] for row in rows))
+
+def _table_text_cells(table_text, num_rows: int) -> tuple[list, list] | None:
+    # Cells that are all strings come out of the DataFrame unchanged; other tables go through pandas
+    if not isinstance(table_text, list) or not table_text:
+        return None
+    header, rows = table_text[0], table_text[1:][:num_rows]
+    if not isinstance(header, (list, tuple)) or not all(isinstance(h, str) for h in header):
+        return None
+    for row in rows:
+        if not isinstance(row, (list, tuple)) or len(row) != len(header) or not all(isinstance(cell, str) for cell in row):
+            return None
+    return header, rows
+
+def table_text_linear(table_text, num_rows: int = 100, caption: str = None) -> str:
+    '''
+    "col : / row N :" format of the header and first `num_rows` rows of a table given as
+    [header, row, ...], as `pd.DataFrame(rows, columns=header)` shows them.
+    '''
+    cells = _table_text_cells(table_text, num_rows)
+    if cells is None:
+        df = pd.DataFrame(data=table_text[1:][:num_rows], columns=table_text[0])
+        cells = df.columns, [[str(x) for x in row] for row in df.values.tolist()]
+    return linear_table(cells[0], cells[1], caption)
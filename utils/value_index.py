@@ -0,0 +1,98 @@
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from typing import List
+import pandas as pd
+from fuzzywuzzy import fuzz
+from utils.table_render import content_version
+
+try:
+    from rapidfuzz import fuzz as rapid_fuzz, process as rapid_process
+except ImportError:
+    rapid_fuzz = rapid_process = None
+
+class ValueIndex(object):
+    '''
+    Fuzzy lookup of strings against a fixed list, giving the same answers as scoring every string with `fuzz.ratio`.
+    Each distinct string is kept once, in order of first occurrence, with the positions it occurs at.
+    Candidates are generated before scoring with an upper bound of `fuzz.ratio`, so only strings that can reach
+    the threshold are scored:
+    - With rapidfuzz installed, its vectorized `ratio` (the longest common subsequence, which is never below the
+      matching blocks `fuzz.ratio` counts) with a score cutoff.
+    - Otherwise, the characters shared with the query (from an inverted index of characters), which bound the
+      length of any common subsequence.
+    '''
+    def __init__(self, values: List[str]):
+        positions = defaultdict(list)
+        for position, value in enumerate(values):
+            positions[value].append(position)
+        self.values = list(positions.keys())
+        self.positions = [positions[value] for value in self.values]
+        self.lengths = [len(value) for value in self.values]
+        self._postings = defaultdict(list)
+        for value_id, value in enumerate(self.values):
+            for char, char_count in Counter(value).items():
+                self._postings[char].append((value_id, char_count))
+
+    def _candidates(self, query: str, threshold: int) -> List[int]:
+        # One point below the threshold covers the rounding in fuzz.ratio
+        cutoff = threshold - 1
+        if rapid_process is not None:
+            matches = rapid_process.extract(query, self.values, scorer=rapid_fuzz.ratio, processor=None,
+                                            score_cutoff=cutoff, limit=None)
+            return sorted(value_id for _, _, value_id in matches)
+        shared = defaultdict(int)
+        for char, query_count in Counter(query).items():
+            for value_id, char_count in self._postings.get(char, ()):
+                shared[value_id] += min(query_count, char_count)
+        return sorted(
+            value_id for value_id, num_shared in shared.items()
+            if 200 * num_shared >= cutoff * (len(query) + self.lengths[value_id])
+        )
+
+    def match(self, query: str, threshold: int) -> list[tuple[str, int]]:
+        '''
+        [(value, fuzz.ratio score)] of the values scoring at least `threshold`, once per occurrence, best first
+        (ties in order of occurrence). The first value scoring 100 is returned alone.
+        '''
+        matched = []
+        for value_id in self._candidates(query, threshold):
+            value = self.values[value_id]
+            score = fuzz.ratio(query, value)
+            if score == 100:
+                return [(value, score)]
+            if score >= threshold:
+                matched.extend((position, value, score) for position in self.positions[value_id])
+        matched.sort()
+        return sorted([(value, score) for _, value, score in matched], key=lambda x: x[1], reverse=True)
+
+class TableValueIndex(object):
+    '''
+    The cells (as `str`, in row-major order) and the column names of a table, indexed for fuzzy matching.
+    '''
+    def __init__(self, df: pd.DataFrame):
+        self.cells = ValueIndex([str(cell) for row in df.values.tolist() for cell in row])
+        self.columns = ValueIndex([str(col) for col in df.columns])
+
+_table_indexes = OrderedDict()
+_table_indexes_lock = threading.Lock()
+table_index_cache_size = 64
+
+def get_table_value_index(df: pd.DataFrame) -> TableValueIndex:
+    '''
+    Builds the index of `df` once per content (see `content_version`), so equal tables share it and a table
+    edited in place gets a new one. The last `table_index_cache_size` indexes are kept.
+    '''
+    version = content_version(df)
+    if version is None:
+        return TableValueIndex(df)
+    with _table_indexes_lock:
+        index = _table_indexes.get(version)
+        if index is not None:
+            _table_indexes.move_to_end(version)
+            return index
+    index = TableValueIndex(df)
+    with _table_indexes_lock:
+        _table_indexes[version] = index
+        while len(_table_indexes) > table_index_cache_size:
+            _table_indexes.popitem(last=False)
+    return index